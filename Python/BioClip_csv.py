@@ -6,9 +6,17 @@ import csv
 import re
 import time
 from datetime import timedelta
-from bioclip import TreeOfLifeClassifier, Rank
+from bioclip import Rank
 from tqdm import tqdm
 import pandas as pd
+from bioclip_utils import iter_rank_predictions
+from embedding_cache import EmbeddingCache
+from resume_index import ResumeIndex
+from label_bundle import apply_restricted_vocabulary
+from result_sink import ColumnarSink, topk_columns
+from stage_timer import StageTimer, timed, profile_run
+from warm_start import load_classifier, known_families
+from taxonomy_index import load_target_families
 
 # Start timing
 start_time = time.time()
@@ -21,50 +29,94 @@ os.makedirs(output_folder, exist_ok=True)
 
 csv_path = os.path.join(output_folder, "classifications_cam32.csv")
 
+# Number of images stacked into one forward pass of the model
+# Lower this if the GPU/CPU runs out of memory
+BATCH_SIZE = 32
+
+# Number of threads decoding and preprocessing images ahead of the model
+# (set to 0 to decode on the main thread)
+NUM_WORKERS = 4
+
+# Restricted vocabulary: path of the label bundle with the text embeddings of the target
+# families plus an "other" bucket, built on the first run and reused afterwards
+# (set to None to score against the full Tree-of-Life label set)
+LABEL_BUNDLE_PATH = None  # e.g. os.path.join(output_folder, "label_bundle.npz")
+
+# Optional columnar output: folder of a Parquet/Arrow dataset with the top-k family and order
+# predictions and their scores (needs pyarrow, set to None to only write the CSV)
+COLUMNAR_OUTPUT_DIR = None  # e.g. os.path.join(output_folder, "classifications_cam32_parquet")
+COLUMNAR_FORMAT = "parquet"  # or "arrow"
+TOP_K = 3
+
+# Opt-in stage timing: per-stage percentiles are printed and saved to this file at the end of the run
+# (.json, or .prom for the Prometheus text format; set to None to disable)
+TIMING_REPORT_PATH = None  # e.g. csv_path + ".timing.json"
+
+# Optional profiler around the classification loop: None, "cprofile" or "torch"
+# (the profile is saved next to the CSV)
+PROFILER = None
+
+# Warm-start cache of the label names and text embeddings, built on the first run
+# (set to None to load the labels from the BioClip data files every time)
+WARM_START_DIR = os.path.join(output_folder, "warm_start")
+
+# Folder of the persistent image embedding cache (set to None to disable)
+# Re-runs with another family list only re-score the stored embeddings
+EMBEDDING_CACHE_DIR = os.path.join(output_folder, "embedding_cache")
+
+timer = StageTimer() if TIMING_REPORT_PATH else None
+
 # Step 1: Initialize the classifier
-classifier = TreeOfLifeClassifier()
+classifier = load_classifier(WARM_START_DIR, LABEL_BUNDLE_PATH)
+
+embedding_cache = EmbeddingCache(EMBEDDING_CACHE_DIR, classifier.model_str) if EMBEDDING_CACHE_DIR else None
+if embedding_cache is not None:
+    print(f"Embedding cache: {len(embedding_cache)} stored embeddings in {EMBEDDING_CACHE_DIR}")
 
 # Get valid families from BioClip
-label_data = classifier.get_label_data()
-valid_families = set(label_data[Rank.FAMILY.get_label()])
+valid_families = known_families(classifier)
 
 # Load and filter target families with detailed reporting
-with open("C:/Users/Almas/bioclip_test/MadHornet/gbif_families.txt", 'r') as f:
-    target_families = [line.strip() for line in f.readlines() if line.strip()]
-    # Find excluded families
-    excluded_families = [f for f in target_families if f not in valid_families]
-    valid_target_families = [f for f in target_families if f in valid_families]
-    
-    # Print detailed report
-    print(f"\nFamily validation report:")
-    print(f"Total families in input list: {len(target_families)}")
-    print(f"Valid families: {len(valid_target_families)}")
-    print(f"Excluded families: {len(excluded_families)}")
-    
-    if excluded_families:
-        print("\nThe following families were excluded:")
-        for family in sorted(excluded_families):
-            print(f"- {family}")
-    
-    print(f"\nProceeding with {len(valid_target_families)} valid families")
+# (gbif_families.txt, or the taxonomy_index.json family_explorer.py writes next to it)
+target_families = load_target_families("C:/Users/Almas/bioclip_test/MadHornet/gbif_families.txt")
+# Find excluded families (sets, so the check per image is a hash lookup)
+excluded_families = target_families - valid_families
+valid_target_families = target_families & valid_families
 
+# Print detailed report
+print(f"\nFamily validation report:")
+print(f"Total families in input list: {len(target_families)}")
+print(f"Valid families: {len(valid_target_families)}")
+print(f"Excluded families: {len(excluded_families)}")
+
+if excluded_families:
+    print("\nThe following families were excluded:")
+    for family in sorted(excluded_families):
+        print(f"- {family}")
+
+print(f"\nProceeding with {len(valid_target_families)} valid families")
+
+# Restricted vocabulary: score only against the target families plus an "other" bucket
+if LABEL_BUNDLE_PATH:
+    apply_restricted_vocabulary(classifier, valid_target_families, LABEL_BUNDLE_PATH)
+
+# Open the resume index that records discovered and already classified images
+resume_index = ResumeIndex(csv_path + ".index.sqlite")
+csv_exists = os.path.exists(csv_path)
+
+# Step 2: Classify images and save results to CSV
+# Only folders that changed since the last run are listed again
+with timed(timer, "discovery"):
+    new_images = resume_index.scan(main_folder)
+print(f"Found {new_images} new images in {main_folder}")
+
+if resume_index.is_new and csv_exists:
+    # First run with an index next to an existing CSV: read it once to mark its images as done
     try:
-        family_filter = classifier.create_taxa_filter(Rank.FAMILY, valid_target_families)
-        print(f"Successfully created filter for {len(valid_target_families)} families")
-    except ValueError as e:
-        print(f"Error creating filter: {e}")
-        print("Proceeding without filter...")
-        family_filter = None
-
-# Check if CSV already exists and load processed images
-processed_images = set()
-if os.path.exists(csv_path):
-    try:
-        # Read existing CSV to find processed images
-        previous_data = pd.read_csv(csv_path)
-        processed_images = set(previous_data['Image_Path'])
-        print(f"Found existing CSV with {len(processed_images)} processed images")
-        
+        previous_data = pd.read_csv(csv_path, usecols=['Image_Path'])
+        resume_index.mark_done(previous_data['Image_Path'])
+        print(f"Found existing CSV with {len(previous_data)} processed images")
+
         # Backup the existing file just in case
         import shutil
         backup_path = csv_path + '.backup'
@@ -73,33 +125,31 @@ if os.path.exists(csv_path):
     except Exception as e:
         print(f"Error reading existing CSV: {e}")
         print("Will start processing from beginning")
+        csv_exists = False
 
-# Step 2: Classify images and save results to CSV
-image_count = len(processed_images)  # Start count from processed images
-remaining_count = 0  # Count images that still need processing
-
-# First, count total images to process and identify remaining ones
-total_images = 0
-remaining_images = []
-for root, _, files in os.walk(main_folder):
-    for image_file in files:
-        if not image_file.lower().endswith((".jpg", ".jpeg", ".png")):
-            continue
-            
-        image_path = os.path.join(root, image_file)
-        total_images += 1
-        
-        if image_path not in processed_images:
-            remaining_images.append(image_path)
-            remaining_count += 1
-
-print(f"Total images: {total_images}")
+if not csv_exists:
+    # Without an output CSV nothing counts as processed
+    resume_index.reset_done()
+
+image_count = resume_index.count(done=True)  # Start count from processed images
+remaining_images = resume_index.remaining()
+remaining_count = len(remaining_images)  # Count images that still need processing
+
+print(f"Total images: {resume_index.count()}")
 print(f"Already processed: {image_count}")
 print(f"Remaining to process: {remaining_count}")
 
+# The CSV only needs the best family, the columnar output also stores the top-k families and orders
+if COLUMNAR_OUTPUT_DIR:
+    ranks, top_k = [Rank.FAMILY, Rank.ORDER], TOP_K
+    sink = ColumnarSink(COLUMNAR_OUTPUT_DIR, output_format=COLUMNAR_FORMAT)
+else:
+    ranks, top_k = [Rank.FAMILY], 1
+    sink = None
+
 # Open CSV file in append mode if it exists, otherwise create new
-file_mode = 'a' if os.path.exists(csv_path) and processed_images else 'w'
-with open(csv_path, file_mode, newline='') as csvfile:
+file_mode = 'a' if csv_exists and image_count else 'w'
+with profile_run(PROFILER, csv_path + ".profile"), open(csv_path, file_mode, newline='') as csvfile:
     writer = csv.writer(csvfile)
     
     # Write header only if creating a new file
@@ -108,30 +158,57 @@ with open(csv_path, file_mode, newline='') as csvfile:
 
     # Create progress bar for remaining images
     with tqdm(total=remaining_count, desc="Processing remaining images", unit="img") as pbar:
-        # Process only the remaining images
-        for image_path in remaining_images:
-            img_start_time = time.time()
-
-            # Get family prediction
-            family_predictions = classifier.predict(image_path, Rank.FAMILY)
-            
-            if not family_predictions:
-                classification_path = 'uncertain'
-                row_data = [image_path, '', 0, classification_path]
-            else:
-                best_family_prediction = max(family_predictions, key=lambda x: x["score"])
-                family_name = best_family_prediction["family"].replace(" ", "_")
-                family_score = best_family_prediction["score"]
-                
-                classification_path = family_name if family_name in valid_target_families else 'other_families'
-                row_data = [image_path, family_name, family_score, classification_path]
-
-            writer.writerow(row_data)
-            image_count += 1  # Update total count
-            
-            img_time = time.time() - img_start_time
-            pbar.set_postfix({"Last": f"{img_time:.2f}s"})
-            pbar.update(1)
+        # Process only the remaining images, one batch at a time
+        # Images are decoded in the background while the model classifies the current batch
+        batches = iter_rank_predictions(classifier, remaining_images, ranks, top_k, BATCH_SIZE,
+                                        cache=embedding_cache, num_workers=NUM_WORKERS, timer=timer)
+        batch_start_time = time.time()
+        for batch_paths, rank_predictions in batches:
+            with timed(timer, "write", len(batch_paths)):
+                batch_rows = []
+                for image_path, predictions in zip(batch_paths, rank_predictions):
+                    family_predictions = predictions[Rank.FAMILY]
+
+                    if not family_predictions:
+                        classification_path = 'uncertain'
+                        row_data = [image_path, '', 0, classification_path]
+                    else:
+                        best_family_prediction = family_predictions[0]
+                        family_name = best_family_prediction["family"].replace(" ", "_")
+                        family_score = best_family_prediction["score"]
+
+                        classification_path = family_name if family_name in valid_target_families else 'other_families'
+                        row_data = [image_path, family_name, family_score, classification_path]
+
+                    writer.writerow(row_data)
+                    batch_rows.append(row_data)
+                    image_count += 1  # Update total count
+
+                if sink is not None:
+                    rows = pd.DataFrame(batch_rows, columns=['Image_Path', 'Family', 'Family_Confidence',
+                                                             'Classification_Category'])
+                    sink.write_batch(rows.assign(**topk_columns(rank_predictions, ranks, top_k)))
+
+                # Make sure finished batches survive an interrupted run, then record them as done
+                csvfile.flush()
+                resume_index.mark_done(batch_paths)
+
+            img_time = (time.time() - batch_start_time) / len(batch_paths)
+            pbar.set_postfix({"Last": f"{img_time:.2f}s/img"})
+            pbar.update(len(batch_paths))
+            batch_start_time = time.time()
+
+# Write the embeddings that did not fill a whole shard yet
+if embedding_cache is not None:
+    embedding_cache.flush()
+if sink is not None:
+    sink.close()
+    print(f"Columnar results saved to {sink.path}")
+resume_index.close()
+
+if timer is not None:
+    timer.print_report()
+    timer.write_report(TIMING_REPORT_PATH, {"csv": os.path.basename(csv_path)})
 
 # Calculate overall processing time
 end_time = time.time()
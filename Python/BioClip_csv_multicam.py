@@ -0,0 +1,178 @@
+# script to classify the images of several cameras in one run with the TreeOfLifeClassifier
+# the model, the label data and the target family list are loaded once and shared by all cameras
+# writes one results csv per camera (same format as BioClip_csv_platforms.py) and optionally a combined csv
+import os
+import csv
+import glob
+import time
+from datetime import timedelta
+from embedding_cache import EmbeddingCache
+from label_bundle import apply_restricted_vocabulary
+from stage_timer import StageTimer
+from warm_start import load_classifier
+from BioClip_csv_platforms import load_valid_target_families, classify_camera
+
+# === PATH CONFIGURATION ===
+# Glob matching the camera folders containing the images to classify
+# CHANGE THIS to the folder where your camera folders are located
+camera_glob = "C:/Users/Almas/Desktop/Alma/seppi-cam*"
+
+# Path of the YOLO classification results of each camera, {camera} is replaced by the camera folder name
+yolo_results_template = "C:/Users/Almas/YOLOv5/yolov5-master/runs/predict-cls/{camera}/results/classification_results.csv"
+
+# Output folder where the results CSVs will be saved
+output_folder = "C:/Users/Almas/bioclip_test/BioClip_testrun"
+
+# CSV filename of each camera, {cam} is the camera folder name without the "seppi-" prefix
+csv_filename_template = "classifications_{cam}.csv"
+
+# Combined CSV with a camera column (set to None to only write the per-camera CSVs)
+combined_csv_filename = "classifications_all_cameras.csv"
+
+# Path to the text file containing target family names
+target_families_path = "C:/Users/Almas/bioclip_test/MadHornet/gbif_families.txt"
+
+# Number of images stacked into one forward pass of the model
+BATCH_SIZE = 32
+
+# Number of threads decoding and preprocessing images ahead of the model
+NUM_WORKERS = 4
+
+# Number of worker processes per camera (1 = classify in this process)
+NUM_SHARDS = 1
+
+# Restricted vocabulary label bundle (set to None to score against the full Tree-of-Life label set)
+LABEL_BUNDLE_PATH = None  # e.g. os.path.join(output_folder, "label_bundle.npz")
+
+# Optional columnar output: one Parquet dataset folder per camera next to its CSV (needs pyarrow)
+WRITE_COLUMNAR = False
+
+# YOLO gating, see BioClip_csv_platforms.py (set to None to classify every crop)
+YOLO_GATE = None  # e.g. {"skip_prefixes": ["none_"], "skip_min_prob": 0.9, "classify_below": None}
+
+# Track-level deduplication, see BioClip_csv_platforms.py (set to None to classify every crop)
+TRACK_DEDUP = None  # e.g. {"mode": "track", "per_group": 3}
+
+# Taxonomy index from family_explorer.py for the rolled-up order columns, see BioClip_csv_platforms.py
+TAXONOMY_INDEX_PATH = None  # e.g. "C:/Users/Almas/bioclip_test/MadHornet/taxonomy_index.json"
+
+# Opt-in stage timing: write a <csv name>.timing.json report per camera (use ".prom" for the
+# Prometheus text format, set to None to disable)
+TIMING_REPORT_EXTENSION = None  # e.g. ".timing.json"
+
+# Warm-start cache of the label names and text embeddings, built on the first run
+# (set to None to load the labels from the BioClip data files every time)
+WARM_START_DIR = os.path.join(output_folder, "warm_start")
+
+# Folder of the persistent image embedding cache, shared by all cameras (set to None to disable)
+EMBEDDING_CACHE_DIR = os.path.join(output_folder, "embedding_cache")
+
+
+def find_cameras(camera_glob, yolo_results_template):
+    """
+    Find the camera folders and their YOLO results files.
+
+    Args:
+        camera_glob (str): Glob matching the camera folders
+        yolo_results_template (str): YOLO results path with a {camera} placeholder
+
+    Returns:
+        list: (camera name, camera folder, YOLO results path) tuples sorted by camera name
+    """
+    cameras = []
+    for camera_folder in sorted(glob.glob(camera_glob)):
+        if not os.path.isdir(camera_folder):
+            continue
+        camera = os.path.basename(os.path.normpath(camera_folder))
+        cameras.append((camera, camera_folder, yolo_results_template.format(camera=camera)))
+    return cameras
+
+
+def combine_camera_csvs(camera_csvs, combined_csv_path):
+    """
+    Concatenate the per-camera results into one CSV with a camera column.
+
+    The rows are streamed, so the per-camera CSVs are never held in memory.
+    Columns missing from a camera's CSV are left empty.
+
+    Args:
+        camera_csvs (list): (camera name, CSV path) tuples
+        combined_csv_path (str): Output CSV path
+    """
+    camera_csvs = [(camera, csv_path) for camera, csv_path in camera_csvs if os.path.exists(csv_path)]
+    if not camera_csvs:
+        return
+
+    # Union of the headers in order of appearance (only the first line of every file is read)
+    fieldnames = ['camera']
+    for _, csv_path in camera_csvs:
+        with open(csv_path, 'r', newline='') as f:
+            header = next(csv.reader(f), [])
+        fieldnames.extend(name for name in header if name not in fieldnames)
+
+    with open(combined_csv_path, 'w', newline='') as out:
+        writer = csv.DictWriter(out, fieldnames=fieldnames)
+        writer.writeheader()
+        for camera, csv_path in camera_csvs:
+            with open(csv_path, 'r', newline='') as f:
+                for row in csv.DictReader(f):
+                    row['camera'] = camera
+                    writer.writerow(row)
+    print(f"Combined results of {len(camera_csvs)} cameras saved to {combined_csv_path}")
+
+
+def main():
+    # Start timing
+    start_time = time.time()
+    os.makedirs(output_folder, exist_ok=True)
+
+    cameras = find_cameras(camera_glob, yolo_results_template)
+    print(f"Found {len(cameras)} camera folders:")
+    for camera, camera_folder, yolo_results_path in cameras:
+        print(f"- {camera}: {camera_folder}")
+
+    # Step 1: Initialize the classifier once for all cameras
+    classifier = load_classifier(WARM_START_DIR, LABEL_BUNDLE_PATH)
+
+    embedding_cache = EmbeddingCache(EMBEDDING_CACHE_DIR, classifier.model_str) if EMBEDDING_CACHE_DIR else None
+    if embedding_cache is not None:
+        print(f"Embedding cache: {len(embedding_cache)} stored embeddings in {EMBEDDING_CACHE_DIR}")
+
+    valid_target_families = load_valid_target_families(classifier, target_families_path)
+    if LABEL_BUNDLE_PATH:
+        apply_restricted_vocabulary(classifier, valid_target_families, LABEL_BUNDLE_PATH)
+
+    # Step 2: Classify each camera with the shared model
+    image_count = 0
+    camera_csvs = []
+    for camera, camera_folder, yolo_results_path in cameras:
+        print(f"\n=== {camera} ===")
+        csv_path = os.path.join(output_folder, csv_filename_template.format(cam=camera.replace("seppi-", "")))
+        columnar_dir = os.path.splitext(csv_path)[0] + "_parquet" if WRITE_COLUMNAR else None
+        timer = StageTimer() if TIMING_REPORT_EXTENSION else None
+        image_count += classify_camera(classifier, camera_folder, yolo_results_path, csv_path, valid_target_families,
+                                       embedding_cache=embedding_cache, batch_size=BATCH_SIZE,
+                                       num_workers=NUM_WORKERS, num_shards=NUM_SHARDS,
+                                       label_bundle_path=LABEL_BUNDLE_PATH, columnar_dir=columnar_dir, timer=timer,
+                                       yolo_gate=YOLO_GATE, track_dedup=TRACK_DEDUP,
+                                       taxonomy_index_path=TAXONOMY_INDEX_PATH)
+        if timer is not None:
+            timer.print_report()
+            timer.write_report(os.path.splitext(csv_path)[0] + TIMING_REPORT_EXTENSION, {"camera": camera})
+        camera_csvs.append((camera, csv_path))
+
+    # Step 3: Optionally combine the per-camera results
+    if combined_csv_filename:
+        combine_camera_csvs(camera_csvs, os.path.join(output_folder, combined_csv_filename))
+
+    # Calculate overall processing time
+    end_time = time.time()
+    total_time = end_time - start_time
+    formatted_time = str(timedelta(seconds=int(total_time)))
+
+    print(f"\nProcessing complete. {image_count} images from {len(cameras)} cameras classified in {formatted_time} (total {total_time:.2f} seconds)")
+    print(f"Average time per image: {total_time/max(image_count, 1):.2f} seconds")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,15 +2,27 @@
 # store results in a csv file with target families from gbif_families.txt
 import os
 import csv
+import multiprocessing
 import re
+import shutil
 import time
 from datetime import timedelta
-from bioclip import TreeOfLifeClassifier, Rank
+from bioclip import Rank
 from tqdm import tqdm
 import pandas as pd
-
-# Start timing
-start_time = time.time()
+from bioclip_utils import iter_rank_predictions
+from embedding_cache import EmbeddingCache
+from resume_index import ResumeIndex
+from label_bundle import apply_restricted_vocabulary, apply_label_bundle, load_label_bundle, BundleClassifier
+from yolo_join import load_yolo_table, join_yolo
+from yolo_gate import gate_images, summarize_skips, SKIP_REASON_COLUMN, SKIPPED_CATEGORY
+from track_dedup import plan_dedup, iter_group_rows, DEDUP_COLUMNS
+from taxonomy_index import load_taxonomy_index, load_target_families, roll_up_to_order
+from result_sink import ColumnarSink, topk_columns
+from stage_timer import StageTimer, timed, profile_run
+from warm_start import load_classifier, known_families
+from sharding import shard_items, decode_workers_per_shard, threads_per_shard, worker_thread_env
+from sharding import configure_worker_threads, part_file_path, merge_part_files
 
 # === PATH CONFIGURATION ===
 # Input folder containing images to classify
@@ -21,13 +33,13 @@ main_folder = "C:/Users/Almas/Desktop/Alma/seppi-cam38"
 
 # You can keep this as is or change to your preferred location
 output_folder = "C:/Users/Almas/bioclip_test/BioClip_testrun"
-os.makedirs(output_folder, exist_ok=True)
 
 # CSV filename - customize this for each camera or batch
 # CHANGE THIS to a descriptive name for your dataset
 csv_filename = "classifications_cam38.csv"
 
 # Path to the YOLO classification results
+# Can also be a list of paths, or a dict run name -> path to join several YOLO runs
 yolo_results_path = "C:/Users/Almas/YOLOv5/yolov5-master/runs/predict-cls/seppi-cam38/results/classification_results.csv"
 
 # Full path where the output CSV will be saved
@@ -35,153 +47,632 @@ csv_path = os.path.join(output_folder, csv_filename)
 
 # Path to the text file containing target family names
 # This file should contain one family name per line
+# (or the taxonomy_index.json written by family_explorer.py next to it)
 target_families_path = "C:/Users/Almas/bioclip_test/MadHornet/gbif_families.txt"
 
-# Step 1: Initialize the classifier
-classifier = TreeOfLifeClassifier()
+# Number of images stacked into one forward pass of the model
+BATCH_SIZE = 32
+
+# Number of threads decoding and preprocessing images ahead of the model
+# (set to 0 to decode on the main thread)
+NUM_WORKERS = 4
+
+# Number of worker processes (1 = classify in this process)
+# On CPU-only nodes several workers with fewer threads each use the cores better
+NUM_SHARDS = 1
+
+# Restricted vocabulary: path of the label bundle with the text embeddings of the target
+# families plus an "other" bucket, built on the first run and reused afterwards
+# (set to None to score against the full Tree-of-Life label set)
+LABEL_BUNDLE_PATH = None  # e.g. os.path.join(output_folder, "label_bundle.npz")
+
+# Optional columnar output: folder of a Parquet/Arrow dataset with the top-k family and order
+# predictions and their scores (needs pyarrow, set to None to only write the CSV)
+COLUMNAR_OUTPUT_DIR = None  # e.g. os.path.join(output_folder, "classifications_cam38_parquet")
+COLUMNAR_FORMAT = "parquet"  # or "arrow"
+TOP_K = 3
+
+# YOLO gating: crops whose YOLO result already answers the question skip BioClip and get a
+# Skip_Reason_BioClip instead (set to None to classify every crop)
+# skip_prefixes / skip_min_prob: skip confident background classes, e.g. none_bg with top1_prob >= 0.9
+# classify_below: only run BioClip where the YOLO top1_prob is below this value (None = no limit)
+YOLO_GATE = None  # e.g. {"skip_prefixes": ["none_"], "skip_min_prob": 0.9, "classify_below": None}
+
+# Track-level deduplication: crops of the same InsectDetect track (and/or with near-identical perceptual
+# hashes) are grouped, only per_group representative frames are classified and their averaged scores
+# are written for every crop of the group, see track_dedup.group_crops() for the modes
+# (set to None to classify every crop; a deduplicated run classifies in this process even if NUM_SHARDS > 1)
+TRACK_DEDUP = None  # e.g. {"mode": "track", "per_group": 3, "max_gap_seconds": 60, "hash_threshold": 6}
+
+# Taxonomy index written by family_explorer.py: adds the order of each crop, rolled up from its
+# top ROLLUP_K family predictions (set to None to leave out the order columns)
+TAXONOMY_INDEX_PATH = None  # e.g. "C:/Users/Almas/bioclip_test/MadHornet/taxonomy_index.json"
+
+# Number of family predictions averaged over a track or rolled up to order
+ROLLUP_K = 5
+
+# Opt-in stage timing: per-stage percentiles are printed and saved to this file at the end of the run
+# (.json, or .prom for the Prometheus text format; set to None to disable)
+TIMING_REPORT_PATH = None  # e.g. csv_path + ".timing.json"
+
+# Optional profiler around the classification: None, "cprofile" or "torch" (saved next to the CSV)
+PROFILER = None
+
+# Warm-start cache of the label names and text embeddings, built on the first run
+# (set to None to load the labels from the BioClip data files every time)
+WARM_START_DIR = os.path.join(output_folder, "warm_start")
+
+# Folder of the persistent image embedding cache (set to None to disable)
+# Re-runs with another family list only re-score the stored embeddings
+EMBEDDING_CACHE_DIR = os.path.join(output_folder, "embedding_cache")
 
-# Get valid families from BioClip
-label_data = classifier.get_label_data()
-valid_families = set(label_data[Rank.FAMILY.get_label()])
+BIOCLIP_COLUMNS = ['Family_BioClip', 'Family_Confidence_BioClip', 'Classification_Category_BioClip']
+ORDER_COLUMNS = ['Order_BioClip', 'Order_Confidence_BioClip']
+
+
+def load_valid_target_families(classifier, target_families_path):
+    """
+    Load the target families and keep the ones BioClip knows.
+
+    Args:
+        classifier (TreeOfLifeClassifier): Initialized BioClip classifier
+        target_families_path (str): Text file with one family name per line, or a taxonomy index (.json)
+
+    Returns:
+        set: Valid target families
+    """
+    # Get valid families from BioClip
+    valid_families = known_families(classifier)
+
+    # Load target families
+    target_families = load_target_families(target_families_path)
+    excluded_families = target_families - valid_families
+    valid_target_families = target_families & valid_families
 
-# Load target families
-with open(target_families_path, 'r') as f:
-    target_families = [line.strip() for line in f.readlines() if line.strip()]
-    excluded_families = [f for f in target_families if f not in valid_families]
-    valid_target_families = [f for f in target_families if f in valid_families]
-    
     print(f"\nFamily validation report:")
     print(f"Total families in input list: {len(target_families)}")
     print(f"Valid families: {len(valid_target_families)}")
     print(f"Excluded families: {len(excluded_families)}")
-    
+
     if excluded_families:
         print("\nThe following families were excluded:")
         for family in sorted(excluded_families):
             print(f"- {family}")
-    
+
     print(f"\nProceeding with {len(valid_target_families)} valid families")
 
-    try:
-        family_filter = classifier.create_taxa_filter(Rank.FAMILY, valid_target_families)
-        print(f"Successfully created filter for {len(valid_target_families)} families")
-    except ValueError as e:
-        print(f"Error creating filter: {e}")
-        print("Proceeding without filter...")
-        family_filter = None
-
-# Check if CSV already exists and load processed images
-processed_images = set()
-if os.path.exists(csv_path):
-    try:
-        previous_data = pd.read_csv(csv_path)
-        processed_images = set(previous_data['Image_Path'])
-        print(f"Found existing CSV with {len(processed_images)} processed images")
-        
-        # Backup the existing file just in case
-        import shutil
-        backup_path = csv_path + '.backup'
-        shutil.copy2(csv_path, backup_path)
-        print(f"Created backup of existing CSV: {backup_path}")
-    except Exception as e:
-        print(f"Error reading existing CSV: {e}")
-        print("Will start processing from beginning")
-
-# Load YOLO classification results
-yolo_results = {}
-if os.path.exists(yolo_results_path):
-    try:
-        yolo_df = pd.read_csv(yolo_results_path)
-        print(f"Loaded YOLO classification results: {len(yolo_df)} entries")
-        
-        for _, row in yolo_df.iterrows():
-            img_name = row['img_name']
-            yolo_results[img_name] = row.to_dict()
-    except Exception as e:
-        print(f"Error loading YOLO results: {e}")
-else:
-    print(f"YOLO results file not found: {yolo_results_path}")
-
-# Step 2: Classify images and save results to CSV
-image_count = len(processed_images)
-remaining_count = 0
-remaining_images = []
-
-for root, _, files in os.walk(main_folder):
-    for image_file in files:
-        if not image_file.lower().endswith((".jpg", ".jpeg", ".png")):
-            continue
-            
-        image_path = os.path.join(root, image_file)
-        if image_path not in processed_images:
-            remaining_images.append(image_path)
-            remaining_count += 1
-
-print(f"Total images: {len(remaining_images) + image_count}")
-print(f"Already processed: {image_count}")
-print(f"Remaining to process: {remaining_count}")
-
-# Open CSV file in append mode if it exists, otherwise create new
-file_mode = 'a' if os.path.exists(csv_path) and processed_images else 'w'
-with open(csv_path, file_mode, newline='') as csvfile:
-    writer = csv.writer(csvfile)
-    
-    # Write header only if creating a new file
-    if file_mode == 'w':
-        writer.writerow(['img_name', 'top1', 'top1_prob', 'Family_BioClip', 'Family_Confidence_BioClip', 'Classification_Category_BioClip'])
-
-    # Create progress bar for remaining images
-    with tqdm(total=remaining_count, desc="Processing remaining images", unit="img") as pbar:
-        for image_path in remaining_images:
-            img_start_time = time.time()
-            img_filename = os.path.basename(image_path)
-            
-            # Get family prediction
-            family_predictions = classifier.predict(image_path, Rank.FAMILY)
-            
-            family_name = ''
-            family_score = 0
-            classification_category = 'uncertain'
-            
-            if family_predictions:
-                best_family_prediction = max(family_predictions, key=lambda x: x["score"])
-                family_name = best_family_prediction["family"].replace(" ", "_")
-                family_score = best_family_prediction["score"]
-                
-                if family_name in valid_target_families:
-                    classification_category = family_name
-                else:
-                    classification_category = 'other_families'
-            
-            # Get YOLO results if available
-            yolo_data = yolo_results.get(img_filename, {})
-            
-            # Create combined row
-            row_data = [
-                img_filename,
-                yolo_data.get('top1', ''),
-                yolo_data.get('top1_prob', ''),
-                family_name,
-                family_score,
-                classification_category
-            ]
-            
-            writer.writerow(row_data)
-            image_count += 1
-            
-            img_time = time.time() - img_start_time
-            pbar.set_postfix({"Last": f"{img_time:.2f}s"})
-            pbar.update(1)
-
-# Calculate overall processing time
-end_time = time.time()
-total_time = end_time - start_time
-formatted_time = str(timedelta(seconds=int(total_time)))
-
-print(f"\nClassification results saved to {csv_path}")
-print(f"Processing complete. {image_count} images classified in {formatted_time} (total {total_time:.2f} seconds)")
-print(f"Average time per image: {total_time/max(image_count, 1):.2f} seconds")
-print(f"\nClassification categories used:")
-print(f"- Valid target families from {target_families_path}")
-print(f"- 'other_families' for families not in the target list")
-print(f"- 'uncertain' for images with no family prediction")
+    return valid_target_families
+
+
+def make_rows(batch_paths, rank_predictions, yolo_table, valid_target_families, extra_columns=(),
+              extra_values=None, taxonomy_index=None):
+    """
+    Build the output rows of one classified batch.
+
+    Args:
+        batch_paths (list): Image paths of the batch
+        rank_predictions (list): One dict per image mapping each rank to its predictions, best first
+        yolo_table (pd.DataFrame): YOLO results indexed by img_name, see yolo_join.load_yolo_table()
+        valid_target_families (set): Target families known to BioClip
+        extra_columns (list): Optional columns of this run after the BioClip columns,
+                              e.g. the skip reason of a gated run
+        extra_values (dict, optional): Values of the extra columns, empty where missing
+        taxonomy_index (TaxonomyIndex, optional): Fills the ORDER_COLUMNS from the family predictions
+
+    Returns:
+        pd.DataFrame: One row per image with the csv_header() columns, missing YOLO values as NaN
+    """
+    family_names = []
+    family_scores = []
+    classification_categories = []
+    for predictions in rank_predictions:
+        family_predictions = predictions[Rank.FAMILY]
+
+        family_name = ''
+        family_score = 0
+        classification_category = 'uncertain'
+
+        if family_predictions:
+            best_family_prediction = family_predictions[0]
+            family_name = best_family_prediction["family"].replace(" ", "_")
+            family_score = best_family_prediction["score"]
+
+            if family_name in valid_target_families:
+                classification_category = family_name
+            else:
+                classification_category = 'other_families'
+
+        family_names.append(family_name)
+        family_scores.append(family_score)
+        classification_categories.append(classification_category)
+
+    # Join with the YOLO results of the whole batch at once
+    img_names = [os.path.basename(image_path) for image_path in batch_paths]
+    bioclip_columns = {
+        'Family_BioClip': family_names,
+        'Family_Confidence_BioClip': family_scores,
+        'Classification_Category_BioClip': classification_categories,
+    }
+    if taxonomy_index is not None:
+        extra_values = dict(extra_values or {}, **order_columns(rank_predictions, taxonomy_index))
+    for column in extra_columns:
+        # Missing values stay empty in the CSV (write_rows) and null in the columnar output
+        bioclip_columns[column] = (extra_values or {}).get(column, [None] * len(img_names))
+    return join_yolo(yolo_table, img_names, bioclip_columns, fill_missing=None)
+
+
+def order_columns(rank_predictions, taxonomy_index):
+    """
+    Best order per image, rolled up from its family predictions through the taxonomy index.
+
+    Returns:
+        dict: Values of the ORDER_COLUMNS
+    """
+    orders = []
+    scores = []
+    for predictions in rank_predictions:
+        rolled_up = roll_up_to_order(predictions[Rank.FAMILY], taxonomy_index)
+        order, score = rolled_up[0] if rolled_up else ('', 0)
+        orders.append(order)
+        scores.append(score)
+    return dict(zip(ORDER_COLUMNS, [orders, scores]))
+
+
+def make_skipped_rows(image_paths, skip_reasons, yolo_table, extra_columns=(SKIP_REASON_COLUMN,)):
+    """
+    Build the output rows of images that skip BioClip because of their YOLO result.
+
+    Returns:
+        pd.DataFrame: One row per image with the csv_header() columns of a gated run
+    """
+    img_names = [os.path.basename(image_path) for image_path in image_paths]
+    bioclip_columns = {
+        'Family_BioClip': [''] * len(img_names),
+        'Family_Confidence_BioClip': [0.0] * len(img_names),
+        'Classification_Category_BioClip': [SKIPPED_CATEGORY] * len(img_names),
+    }
+    # Missing values with the type of the classified rows, so the columnar output keeps one schema
+    # (the CSV writes all of them empty)
+    typed_missing = {
+        ORDER_COLUMNS[1]: lambda n: [float('nan')] * n,
+        DEDUP_COLUMNS[1]: lambda n: pd.array([pd.NA] * n, dtype="boolean"),
+    }
+    for column in extra_columns:
+        if column == SKIP_REASON_COLUMN:
+            bioclip_columns[column] = skip_reasons
+        else:
+            bioclip_columns[column] = typed_missing.get(column, lambda n: [None] * n)(len(img_names))
+    return join_yolo(yolo_table, img_names, bioclip_columns, fill_missing=None)
+
+
+def run_columns(yolo_gate=None, track_dedup=None, taxonomy_index_path=None):
+    """
+    Optional output columns of a run: the skip reason of a gated run, the group of a
+    deduplicated run and the rolled-up order of a run with a taxonomy index.
+    """
+    return (([SKIP_REASON_COLUMN] if yolo_gate is not None else [])
+            + (DEDUP_COLUMNS if track_dedup is not None else [])
+            + (ORDER_COLUMNS if taxonomy_index_path else []))
+
+
+def csv_header(yolo_table, extra_columns=()):
+    """
+    Output CSV header: img_name, the YOLO columns and the BioClip columns
+    (plus the optional columns of this run, see run_columns()).
+    """
+    return ['img_name'] + list(yolo_table.columns) + BIOCLIP_COLUMNS + list(extra_columns)
+
+
+def check_csv_header(csv_path, header):
+    """
+    Make sure an existing CSV has the header of this run before rows are appended to it.
+
+    Raises:
+        ValueError: If the columns differ (e.g. YOLO gating, deduplication or the YOLO runs were changed)
+    """
+    with open(csv_path, 'r', newline='') as f:
+        existing_header = next(csv.reader(f), None)
+    if existing_header != header:
+        raise ValueError(f"{csv_path} has other columns than this run ({existing_header} instead of {header}), "
+                         f"move it away or restore the previous settings to resume it")
+
+
+def write_rows(writer, rows):
+    # Missing YOLO values stay empty in the CSV
+    rows = rows.astype(object).where(rows.notna(), '')
+    writer.writerows(rows.itertuples(index=False, name=None))
+
+
+def output_ranks(columnar_dir, top_k):
+    """
+    Ranks and number of predictions per rank needed for the outputs.
+
+    The CSV only needs the best family, the columnar output also stores the
+    top-k families and orders (both come from the same image embedding).
+    """
+    if columnar_dir:
+        return [Rank.FAMILY, Rank.ORDER], top_k
+    return [Rank.FAMILY], 1
+
+
+def prediction_k(k, track_dedup=None, taxonomy_index_path=None):
+    """
+    Number of predictions per rank to request from the model.
+
+    Averaging over a track and rolling families up to order need more than the
+    k predictions written (the outputs only use the first k).
+    """
+    if track_dedup is not None or taxonomy_index_path:
+        return max(k, ROLLUP_K)
+    return k
+
+
+def classify_shard(shard_index, image_paths, part_path, yolo_results_path, valid_target_families,
+                   embedding_cache_dir, batch_size, num_threads, label_bundle_path=None,
+                   columnar_dir=None, columnar_part=None, columnar_format=COLUMNAR_FORMAT, top_k=TOP_K,
+                   warm_start_dir=None, extra_columns=(), taxonomy_index_path=None, num_workers=1):
+    """
+    Worker process of a sharded run: classify one slice of the images into its own part file.
+
+    Every worker loads its own classifier and limits torch to num_threads
+    threads and decoding to num_workers threads, so N workers together use
+    the cores of a CPU-only node. The embedding cache is only read, new
+    embeddings are not stored by workers.
+
+    Args:
+        shard_index (int): Number of this worker
+        image_paths (list): Images of this shard
+        part_path (str): Part CSV written by this worker
+        yolo_results_path (str): Path to the YOLO classification_results.csv
+        valid_target_families (set): Target families known to BioClip
+        embedding_cache_dir (str): Embedding cache folder or None
+        batch_size (int): Number of images per forward pass
+        num_threads (int): Number of torch intra-op threads
+        label_bundle_path (str, optional): Label bundle built by the parent process
+        columnar_dir (str, optional): Columnar dataset folder, every worker writes its own file
+        columnar_part (str, optional): File name of this worker in the columnar dataset
+        columnar_format (str): "parquet" or "arrow"
+        top_k (int): Number of family and order predictions stored in the columnar output
+        warm_start_dir (str, optional): Warm-start cache written by the parent process, the
+                                        memory-mapped label matrix is shared by all workers
+        extra_columns (list): Optional columns of this run, see run_columns()
+        taxonomy_index_path (str, optional): Taxonomy index for the order columns
+        num_workers (int): Number of decode threads of this worker
+
+    Returns:
+        int: Number of classified images
+    """
+    configure_worker_threads(num_threads)
+    # The parent process saved the label bundle, the workers never load the full label set
+    classifier = load_classifier(warm_start_dir, label_bundle_path)
+    if label_bundle_path and not isinstance(classifier, BundleClassifier):
+        apply_label_bundle(classifier, load_label_bundle(label_bundle_path))
+    embedding_cache = None
+    if embedding_cache_dir and os.path.exists(embedding_cache_dir):
+        embedding_cache = EmbeddingCache(embedding_cache_dir, classifier.model_str, read_only=True)
+    yolo_table = load_yolo_table(yolo_results_path)
+    ranks, k = output_ranks(columnar_dir, top_k)
+    sink = ColumnarSink(columnar_dir, columnar_part, columnar_format) if columnar_dir else None
+    taxonomy_index = load_taxonomy_index(taxonomy_index_path) if taxonomy_index_path else None
+
+    with open(part_path, 'w', newline='') as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow(csv_header(yolo_table, extra_columns))
+        with tqdm(total=len(image_paths), desc=f"Shard {shard_index}", unit="img", position=shard_index) as pbar:
+            batches = iter_rank_predictions(classifier, image_paths, ranks, prediction_k(k, None, taxonomy_index_path),
+                                            batch_size, cache=embedding_cache, num_workers=num_workers)
+            for batch_paths, rank_predictions in batches:
+                rows = make_rows(batch_paths, rank_predictions, yolo_table, valid_target_families, extra_columns,
+                                 taxonomy_index=taxonomy_index)
+                write_rows(writer, rows)
+                if sink is not None:
+                    sink.write_batch(rows.assign(**topk_columns(rank_predictions, ranks, k)))
+                pbar.update(len(batch_paths))
+
+    if sink is not None:
+        sink.close()
+    return len(image_paths)
+
+
+def _run_shard(shard_args):
+    # Pool helper: classify one shard and tell the parent which one finished
+    classify_shard(*shard_args)
+    return shard_args[0]
+
+
+def classify_sharded(remaining_images, csv_path, append, yolo_results_path, valid_target_families,
+                     embedding_cache_dir, batch_size, num_shards, label_bundle_path=None,
+                     columnar_dir=None, columnar_format=COLUMNAR_FORMAT, top_k=TOP_K, warm_start_dir=None,
+                     extra_columns=(), taxonomy_index_path=None, resume_index=None, num_workers=NUM_WORKERS):
+    """
+    Classify images with num_shards worker processes and merge their part files into csv_path.
+
+    The part file of a worker is merged as soon as the worker finishes and its images are marked
+    as done, so an interrupted run only classifies the unfinished shards again.
+
+    Args:
+        remaining_images (list): Sorted paths of the images still to classify
+        csv_path (str): Final CSV path
+        append (bool): Append to an existing CSV
+        yolo_results_path (str): Path to the YOLO classification_results.csv
+        valid_target_families (set): Target families known to BioClip
+        embedding_cache_dir (str): Embedding cache folder or None
+        batch_size (int): Number of images per forward pass
+        num_shards (int): Number of worker processes
+        label_bundle_path (str, optional): Label bundle applied in every worker
+        columnar_dir (str, optional): Columnar dataset folder, one file per worker
+        columnar_format (str): "parquet" or "arrow"
+        top_k (int): Number of family and order predictions stored in the columnar output
+        warm_start_dir (str, optional): Warm-start cache used by the workers
+        extra_columns (list): Optional columns of this run, see run_columns()
+        taxonomy_index_path (str, optional): Taxonomy index for the order columns
+        resume_index (ResumeIndex, optional): Index the images of every merged shard are marked done in
+        num_workers (int): Requested decode threads, capped per worker by decode_workers_per_shard()
+
+    Returns:
+        int: Number of merged rows
+    """
+    shards = shard_items(remaining_images, num_shards)
+    part_paths = [part_file_path(csv_path, i) for i in range(num_shards)]
+    decode_workers = decode_workers_per_shard(num_shards, num_workers)
+    num_threads = threads_per_shard(num_shards, decode_workers)
+    print(f"Running {num_shards} worker processes with {num_threads} torch threads "
+          f"and {decode_workers} decode threads each")
+    run_name = time.strftime("run-%Y%m%d-%H%M%S")
+
+    merged_count = 0
+    # spawn works the same on Windows and Linux and does not copy the parent's torch state
+    with worker_thread_env(num_threads), multiprocessing.get_context("spawn").Pool(num_shards) as pool:
+        finished = pool.imap_unordered(_run_shard, [
+            (i, shards[i], part_paths[i], yolo_results_path, valid_target_families,
+             embedding_cache_dir, batch_size, num_threads, label_bundle_path,
+             columnar_dir, f"{run_name}-shard{i:03d}", columnar_format, top_k, warm_start_dir, extra_columns,
+             taxonomy_index_path, decode_workers)
+            for i in range(num_shards)
+        ])
+        for i in finished:
+            # The part file of this worker is complete: merge it and record its images right away
+            expected_names = [os.path.basename(image_path) for image_path in shards[i]]
+            merged_count += merge_part_files([part_paths[i]], csv_path, 'img_name', expected_names, append)
+            append = True
+            if resume_index is not None:
+                resume_index.mark_done(shards[i])
+    return merged_count
+
+
+def classify_camera(classifier, main_folder, yolo_results_path, csv_path, valid_target_families,
+                    embedding_cache=None, batch_size=BATCH_SIZE, num_workers=NUM_WORKERS, num_shards=NUM_SHARDS,
+                    label_bundle_path=None, columnar_dir=None, columnar_format=COLUMNAR_FORMAT, top_k=TOP_K,
+                    timer=None, yolo_gate=None, track_dedup=None, taxonomy_index_path=None):
+    """
+    Classify the images of one camera folder and write (or resume) its results CSV.
+
+    Args:
+        classifier (TreeOfLifeClassifier): Initialized BioClip classifier
+        main_folder (str): Folder containing the images to classify
+        yolo_results_path (str, list or dict): YOLO classification_results.csv of this camera,
+                                               see yolo_join.load_yolo_table()
+        csv_path (str): Output CSV path
+        valid_target_families (set): Target families known to BioClip
+        embedding_cache (EmbeddingCache, optional): Embedding cache to read from and add to
+        batch_size (int): Number of images per forward pass
+        num_workers (int): Number of decode threads
+        num_shards (int): Number of worker processes, 1 classifies in this process
+        label_bundle_path (str, optional): Label bundle already applied to classifier,
+                                           handed to the worker processes of a sharded run
+        columnar_dir (str, optional): Folder of the optional Parquet/Arrow dataset
+        columnar_format (str): "parquet" or "arrow"
+        top_k (int): Number of family and order predictions stored in the columnar output
+        timer (StageTimer, optional): Records the time spent in each stage (the worker
+                                      processes of a sharded run are not timed per stage)
+        yolo_gate (dict, optional): Keyword arguments of yolo_gate.gate_images(), crops the
+                                    YOLO result already answers skip BioClip (None classifies all)
+        track_dedup (dict, optional): Keyword arguments of track_dedup.plan_dedup(), only
+                                      representative crops of each track are classified
+                                      (None classifies every crop)
+        taxonomy_index_path (str, optional): Taxonomy index from family_explorer.py, adds the
+                                             order rolled up from the family predictions
+
+    Returns:
+        int: Number of images classified (or skipped by the YOLO gate) in this run
+    """
+    # Open the resume index that records discovered and already classified images
+    resume_index = ResumeIndex(csv_path + ".index.sqlite")
+    csv_exists = os.path.exists(csv_path)
+
+    # Only folders that changed since the last run are listed again
+    with timed(timer, "discovery"):
+        new_images = resume_index.scan(main_folder)
+    print(f"Found {new_images} new images in {main_folder}")
+
+    if resume_index.is_new and csv_exists:
+        # First run with an index next to an existing CSV: read it once to mark its images as done
+        # (this CSV only stores file names, so images are matched by name)
+        try:
+            previous_data = pd.read_csv(csv_path, usecols=['img_name'])
+            resume_index.mark_done_by_name(previous_data['img_name'])
+            print(f"Found existing CSV with {len(previous_data)} processed images")
+
+            # Backup the existing file just in case
+            backup_path = csv_path + '.backup'
+            shutil.copy2(csv_path, backup_path)
+            print(f"Created backup of existing CSV: {backup_path}")
+        except Exception as e:
+            print(f"Error reading existing CSV: {e}")
+            print("Will start processing from beginning")
+            csv_exists = False
+
+    if not csv_exists:
+        # Without an output CSV nothing counts as processed
+        resume_index.reset_done()
+
+    # Step 2: Classify images and save results to CSV
+    image_count = resume_index.count(done=True)
+    remaining_images = resume_index.remaining()
+    remaining_count = len(remaining_images)
+
+    print(f"Total images: {resume_index.count()}")
+    print(f"Already processed: {image_count}")
+    print(f"Remaining to process: {remaining_count}")
+
+    # Open CSV file in append mode if it exists, otherwise create new
+    file_mode = 'a' if csv_exists and image_count else 'w'
+
+    # Load YOLO classification results
+    yolo_table = load_yolo_table(yolo_results_path)
+    extra_columns = run_columns(yolo_gate, track_dedup, taxonomy_index_path)
+    if file_mode == 'a':
+        check_csv_header(csv_path, csv_header(yolo_table, extra_columns))
+
+    # The columnar output gets the same rows as the CSV, including the crops skipped by the YOLO gate
+    ranks, k = output_ranks(columnar_dir, top_k)
+    sink = ColumnarSink(columnar_dir, output_format=columnar_format) if columnar_dir else None
+
+    processed_count = remaining_count
+    if yolo_gate is not None and remaining_count:
+        # Crops the YOLO result already answers are written right away and skip BioClip
+        skip_reasons = gate_images(yolo_table, [os.path.basename(p) for p in remaining_images], **yolo_gate)
+        summarize_skips(skip_reasons)
+        skipped_paths = [p for p, reason in zip(remaining_images, skip_reasons) if reason]
+        if skipped_paths:
+            with open(csv_path, file_mode, newline='') as csvfile:
+                writer = csv.writer(csvfile)
+                if file_mode == 'w':
+                    writer.writerow(csv_header(yolo_table, extra_columns))
+                skipped_rows = make_skipped_rows(skipped_paths, [r for r in skip_reasons if r], yolo_table,
+                                                 extra_columns)
+                write_rows(writer, skipped_rows)
+            if sink is not None:
+                # Skipped crops have no predictions, their top-k columns stay empty
+                sink.write_batch(skipped_rows.assign(**topk_columns([{}] * len(skipped_paths), ranks, k)))
+            resume_index.mark_done(skipped_paths)
+            file_mode = 'a'
+        remaining_images = [p for p, reason in zip(remaining_images, skip_reasons) if not reason]
+        remaining_count = len(remaining_images)
+
+    if track_dedup is not None and num_shards > 1:
+        # The scores of a group are averaged over its representatives in one place
+        print("Track deduplication classifies the representatives in this process, ignoring NUM_SHARDS")
+        num_shards = 1
+
+    if num_shards > 1 and remaining_count:
+        # Every worker writes its own columnar file, this one only holds the skipped crops
+        if sink is not None:
+            sink.close()
+        # Workers only read the embedding cache, write what is pending before they start
+        if embedding_cache is not None:
+            embedding_cache.flush()
+        cache_dir = embedding_cache.cache_dir if embedding_cache is not None else None
+        classify_sharded(remaining_images, csv_path, file_mode == 'a', yolo_results_path, valid_target_families,
+                         cache_dir, batch_size, num_shards, label_bundle_path,
+                         columnar_dir, columnar_format, top_k,
+                         # Workers use the same warm-start cache as this process, if any
+                         getattr(classifier, "warm_start_dir", None), extra_columns, taxonomy_index_path,
+                         resume_index, num_workers)
+        resume_index.close()
+        print(f"\nClassification results saved to {csv_path}")
+        return processed_count
+
+    taxonomy_index = load_taxonomy_index(taxonomy_index_path) if taxonomy_index_path else None
+    fetch_k = prediction_k(k, track_dedup, taxonomy_index_path)
+
+    if track_dedup is not None:
+        groups, classified_images, representatives = plan_dedup(remaining_images, num_workers=num_workers,
+                                                                **track_dedup)
+    else:
+        classified_images = remaining_images
+
+    with open(csv_path, file_mode, newline='') as csvfile:
+        writer = csv.writer(csvfile)
+
+        # Write header only if creating a new file
+        if file_mode == 'w':
+            writer.writerow(csv_header(yolo_table, extra_columns))
+
+        # Create progress bar for remaining images
+        with tqdm(total=remaining_count, desc="Processing remaining images", unit="img") as pbar:
+            # Images are decoded in the background while the model classifies the current batch
+            batches = iter_rank_predictions(classifier, classified_images, ranks, fetch_k, batch_size,
+                                            cache=embedding_cache, num_workers=num_workers, timer=timer)
+            if track_dedup is not None:
+                # Every finished group yields rows for all of its crops
+                batches = iter_group_rows(groups, representatives, batches, ranks, fetch_k)
+            else:
+                batches = ((batch_paths, rank_predictions, None) for batch_paths, rank_predictions in batches)
+            batch_start_time = time.time()
+            for batch_paths, rank_predictions, extra_values in batches:
+                with timed(timer, "write", len(batch_paths)):
+                    rows = make_rows(batch_paths, rank_predictions, yolo_table, valid_target_families,
+                                     extra_columns, extra_values, taxonomy_index)
+                    write_rows(writer, rows)
+                    if sink is not None:
+                        sink.write_batch(rows.assign(**topk_columns(rank_predictions, ranks, k)))
+
+                    # Make sure finished batches survive an interrupted run, then record them as done
+                    csvfile.flush()
+                    resume_index.mark_done(batch_paths)
+
+                img_time = (time.time() - batch_start_time) / len(batch_paths)
+                pbar.set_postfix({"Last": f"{img_time:.2f}s/img"})
+                pbar.update(len(batch_paths))
+                batch_start_time = time.time()
+
+    # Write the embeddings that did not fill a whole shard yet
+    if embedding_cache is not None:
+        embedding_cache.flush()
+    if sink is not None:
+        sink.close()
+        print(f"Columnar results saved to {sink.path}")
+    resume_index.close()
+
+    print(f"\nClassification results saved to {csv_path}")
+    return processed_count
+
+
+def main():
+    # Start timing
+    start_time = time.time()
+    os.makedirs(output_folder, exist_ok=True)
+
+    # Step 1: Initialize the classifier
+    classifier = load_classifier(WARM_START_DIR, LABEL_BUNDLE_PATH)
+
+    embedding_cache = EmbeddingCache(EMBEDDING_CACHE_DIR, classifier.model_str) if EMBEDDING_CACHE_DIR else None
+    if embedding_cache is not None:
+        print(f"Embedding cache: {len(embedding_cache)} stored embeddings in {EMBEDDING_CACHE_DIR}")
+
+    valid_target_families = load_valid_target_families(classifier, target_families_path)
+    if LABEL_BUNDLE_PATH:
+        apply_restricted_vocabulary(classifier, valid_target_families, LABEL_BUNDLE_PATH)
+
+    timer = StageTimer() if TIMING_REPORT_PATH else None
+    with profile_run(PROFILER, csv_path + ".profile"):
+        image_count = classify_camera(classifier, main_folder, yolo_results_path, csv_path, valid_target_families,
+                                      embedding_cache=embedding_cache, label_bundle_path=LABEL_BUNDLE_PATH,
+                                      columnar_dir=COLUMNAR_OUTPUT_DIR, timer=timer, yolo_gate=YOLO_GATE,
+                                      track_dedup=TRACK_DEDUP, taxonomy_index_path=TAXONOMY_INDEX_PATH)
+    if timer is not None:
+        timer.print_report()
+        timer.write_report(TIMING_REPORT_PATH, {"csv": os.path.basename(csv_path)})
+
+    # Calculate overall processing time
+    end_time = time.time()
+    total_time = end_time - start_time
+    formatted_time = str(timedelta(seconds=int(total_time)))
+
+    print(f"Processing complete. {image_count} images classified in {formatted_time} (total {total_time:.2f} seconds)")
+    print(f"Average time per image: {total_time/max(image_count, 1):.2f} seconds")
+    print(f"\nClassification categories used:")
+    print(f"- Valid target families from {target_families_path}")
+    print(f"- 'other_families' for families not in the target list")
+    print(f"- 'uncertain' for images with no family prediction")
+    if YOLO_GATE is not None:
+        print(f"- '{SKIPPED_CATEGORY}' for images skipped because of their YOLO result (see {SKIP_REASON_COLUMN})")
+    if TRACK_DEDUP is not None:
+        print(f"- Crops of one track share the averaged result of its representatives (see {DEDUP_COLUMNS[0]})")
+    if TAXONOMY_INDEX_PATH:
+        print(f"- {ORDER_COLUMNS[0]} rolled up from the top {ROLLUP_K} family predictions via {TAXONOMY_INDEX_PATH}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,55 +1,76 @@
 #script to classify images using the TreeOfLifeClassifier and organize them by order and family
 #.\env_bioclip\Scripts\activate
 import os
-import random
-import shutil
 import csv
 from bioclip import TreeOfLifeClassifier, Rank
+from bioclip_utils import predict_ranks
+from sorted_view import SortedView, recover_sorted_view
+from crop_sampler import sample_crops
+from yolo_join import load_yolo_table
+from taxonomy_index import load_target_families
 
 # Paths
 main_folder = "C:/Users/Almas/bioclip_test/test_subfolder_2"  # Adjust path
 output_folder = "C:/Users/Almas/bioclip_test/BioClip_testrun/test4"
 csv_path = os.path.join(output_folder, "classifications.csv")
 
+# Number of images encoded together in one forward pass
+BATCH_SIZE = 32
+
+# Crop sampling: up to SAMPLES_PER_STRATUM crops from every "folder", "camera", "date" or YOLO
+# "yolo_top1" class, drawn in one pass over main_folder
+SAMPLES_PER_STRATUM = 188
+STRATIFY_BY = "folder"
+
+# Seed of the sample, the same seed always selects the same crops
+SAMPLE_SEED = 0
+
+# YOLO classification_results.csv, only needed for STRATIFY_BY = "yolo_top1"
+YOLO_RESULTS_PATH = None
+
+# How the sorted folder tree is built: "hardlink" or "symlink" to the original crops, "copy", or
+# "manifest" to only list the sorted paths in sorted_view_manifest.csv (the crops are never moved)
+SORT_MODE = "hardlink"
+
+# What to do with a sorting run that was interrupted: "resume" it or "rollback" its folder tree
+INTERRUPTED_SORT = "resume"
+
 # Create the output folder if it doesn't exist
 os.makedirs(output_folder, exist_ok=True)
+recover_sorted_view(output_folder, INTERRUPTED_SORT)
 
-# Step 1: Traverse subfolders and randomly select images
-for root, dirs, files in os.walk(main_folder):
-    image_files = [f for f in files if f.lower().endswith((".jpg", ".jpeg", ".png"))]
-    
-    # Randomly select up to 15 images
-    selected_images = random.sample(image_files, min(len(image_files), 188))
-    
-    for image in selected_images:
-        src_path = os.path.join(root, image)
-        dest_path = os.path.join(output_folder, image)
-        shutil.copy(src_path, dest_path)
+# Step 1: Randomly select images from every stratum (they stay where they are)
+yolo_top1 = None
+if STRATIFY_BY == "yolo_top1":
+    yolo_top1 = load_yolo_table(YOLO_RESULTS_PATH)['top1'].to_dict()
+sample = sample_crops(main_folder, SAMPLES_PER_STRATUM, STRATIFY_BY, SAMPLE_SEED, yolo_top1)
+image_paths = [image_path for stratum in sorted(sample) for image_path in sample[stratum]]
 
 # Step 2: Initialize the classifier
 classifier = TreeOfLifeClassifier(device='cuda')
 
-# Load target families from file
-with open("C:/Users/Almas/bioclip_test/MadHornet/gbif_families.txt", 'r') as f:
-    target_families = [line.strip() for line in f.readlines()]
+# Load target families from file (gbif_families.txt or taxonomy_index.json) as a set for fast lookups
+target_families = load_target_families("C:/Users/Almas/bioclip_test/MadHornet/gbif_families.txt")
 
 # Step 3: Classify images and organize by family
 with open(csv_path, 'w', newline='') as csvfile:
     writer = csv.writer(csvfile)
     writer.writerow(['Image', 'Order', 'Order_Confidence', 'Family', 'Family_Confidence', 'Classification_Path'])
 
-    for image_file in os.listdir(output_folder):
-        if not image_file.lower().endswith((".jpg", ".jpeg", ".png")):
-            continue
+    image_files = [os.path.basename(image_path) for image_path in image_paths]
+    sorted_view = SortedView(output_folder, SORT_MODE)
 
-        image_path = os.path.join(output_folder, image_file)
+    # Encode every image once and read CLASS, ORDER and FAMILY from the same embedding
+    rank_predictions = predict_ranks(classifier, image_paths, [Rank.CLASS, Rank.ORDER, Rank.FAMILY],
+                                     k=5, batch_size=BATCH_SIZE)
 
+    for image_file, image_path, predictions in zip(image_files, image_paths, rank_predictions):
         # First check if image contains insects
-        class_predictions = classifier.predict(image_path, Rank.CLASS)
+        class_predictions = predictions[Rank.CLASS]
         
         if not class_predictions or not any(pred["class"] == "Insecta" for pred in class_predictions):
             classification_path = 'non_insect_images'
-            target_folder = os.path.join(output_folder, "non_insect_images")
+            target_folder = "non_insect_images"
             # Set empty values for insect-specific classifications
             family_name = ''
             family_score = 0
@@ -57,8 +78,8 @@ with open(csv_path, 'w', newline='') as csvfile:
             order_score = 0
         else:
             # Existing family classification logic
-            family_predictions = classifier.predict(image_path, Rank.FAMILY)
-            order_predictions = classifier.predict(image_path, Rank.ORDER)
+            family_predictions = predictions[Rank.FAMILY]
+            order_predictions = predictions[Rank.ORDER]
 
             # Initialize values
             family_name = ''
@@ -67,30 +88,27 @@ with open(csv_path, 'w', newline='') as csvfile:
             order_score = 0
             classification_path = ''
 
-            # Get the best family prediction
-            best_family_prediction = max(family_predictions, key=lambda x: x["score"])
+            # Get the best family prediction (predictions are sorted best first)
+            best_family_prediction = family_predictions[0]
             family_name = best_family_prediction["family"].replace(" ", "_")
             family_score = best_family_prediction["score"]
 
             # Get order information if available
             if order_predictions:
-                best_order_prediction = max(order_predictions, key=lambda x: x["score"])
+                best_order_prediction = order_predictions[0]
                 order_name = best_order_prediction["order"].replace(" ", "_")
                 order_score = best_order_prediction["score"]
 
             # Check if the predicted family is in our target families
             if family_name in target_families:
-                target_folder = os.path.join(output_folder, family_name)
+                target_folder = family_name
                 classification_path = family_name
             else:
-                target_folder = os.path.join(output_folder, "other_families")
+                target_folder = "other_families"
                 classification_path = 'other_families'
 
-        # Create the target folder if it doesn't exist
-        os.makedirs(target_folder, exist_ok=True)
-
-        # Move the image to the appropriate folder
-        shutil.move(image_path, os.path.join(target_folder, image_file))
+        # Plan the image in its folder, the folders and links are created together below
+        sorted_view.add(image_path, target_folder, image_file)
 
         # Write to CSV
         writer.writerow([
@@ -102,5 +120,9 @@ with open(csv_path, 'w', newline='') as csvfile:
             classification_path
         ])
 
+# Create all folders once, then link (or copy) every image into place
+sorted_count = sorted_view.commit()
+
 print(f"Classification results saved to {csv_path}")
+print(f"{sorted_count} images sorted into {output_folder} ({SORT_MODE})")
 print("Processing complete. Images have been classified and organized.")
\ No newline at end of file
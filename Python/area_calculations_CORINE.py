@@ -1,6 +1,4 @@
-import processing
 import csv
-from qgis.core import QgsProject, QgsVectorLayer
 
 # === User-defined file paths ===
 # Path to the CORINE 2018 raster 
@@ -13,69 +11,126 @@ output_csv = 'C:/Users/Almas/QGIS_proj/CORINE_u2018_clc2018_v2020_20u1_raster100
 # === Define valid CORINE land cover categories ===
 valid_categories = [1, 2, 3, 11, 12, 18, 23, 24, 26, 29, 35]
 
-# === Step 1. Convert CORINE Raster to Vector (Polygonize) ===
-print("Converting CORINE raster to polygons...")
-polygonize_params = {
-    'INPUT': input_raster,
-    'BAND': 1,
-    'FIELD': 'DN',  # Field to store the raster pixel value (land cover class)
-    'EIGHT_CONNECTEDNESS': False,
-    'EXTRA': '',
-    'OUTPUT': 'TEMPORARY_OUTPUT'
-}
-polygonize_result = processing.run("gdal:polygonize", polygonize_params)
-landcover_vector = polygonize_result['OUTPUT']
-
-# === Step 2. Load Buffer Zones Vector Layer ===
-print("Loading buffer zones...")
-buffer_layer = QgsVectorLayer(buffer_file, "buffer_zones", "ogr")
-if not buffer_layer.isValid():
-    raise Exception("Buffer layer failed to load. Check the file path and layer name.")
-
-# === Step 3. Clip (Intersect) Land Cover with Buffer Zones ===
-print("Computing intersections between buffer zones and CORINE land cover polygons...")
-intersection_params = {
-    'INPUT': buffer_layer,
-    'OVERLAY': landcover_vector,
-    'OUTPUT': 'TEMPORARY_OUTPUT'
-}
-intersection_result = processing.run("native:intersection", intersection_params)
-intersection_layer = intersection_result['OUTPUT']
-
-# === Step 4. Calculate Area per CORINE Land Cover Type Within Each Buffer ===
-# Results dictionary structure:
-# { buffer_zone_name: { land_cover_value: total_area, ... }, ... }
-print("Calculating areas for each buffer and CORINE land cover type...")
-results = {}
-for feature in intersection_layer.getFeatures():
-    # Retrieve the buffer zone name from the "Name" field
-    zone_name = feature['Name']
-    # Retrieve the CORINE land cover value from the polygonized output field ("DN")
-    land_cover = feature['DN']
-    
-    # Filter out any features that do not belong to the valid CORINE categories
-    if land_cover not in valid_categories:
-        continue
-    
-    # Calculate the area of the intersected geometry (assumes CRS units in meters)
-    area = feature.geometry().area()
-    
-    # Aggregate the area by buffer zone and land cover type
-    if zone_name not in results:
-        results[zone_name] = {}
-    if land_cover not in results[zone_name]:
-        results[zone_name][land_cover] = 0.0
-    results[zone_name][land_cover] += area
-
-# === Step 5. Write the Output Table to a CSV File ===
-print("Writing results to CSV...")
-with open(output_csv, 'w', newline='') as csvfile:
-    writer = csv.writer(csvfile)
-    # Write header row
-    writer.writerow(["Buffer", "LandCover", "Area_m2"])
-    # Write one row for each combination of buffer zone and land cover type
-    for zone, landcover_dict in results.items():
-        for land_cover, area in landcover_dict.items():
-            writer.writerow([zone, land_cover, area])
-
-print("CSV output saved to:", output_csv)
+# === Mode ===
+# "raster": read only the raster windows covering the buffers and count the pixels per class
+#           (headless, no QGIS needed, requires rasterio and fiona, see corine_zonal.py)
+# "polygonize": polygonize the raster and intersect it with the buffers (run in the QGIS Python console)
+# "landscape": composition around the site points for several radii at once, see landscape_metrics.py
+MODE = "raster"
+
+# === Landscape mode ===
+# Site points: CSV with SITE, Latitude and Longitude (mean per site) or a point layer with a "SITE" field
+sites_file = 'C:/Users/Almas/BusyBee/data/field_weather_data.csv'
+# Buffer radii in m
+RADII = [250, 500, 1000, 2000]
+# Also compute the Shannon diversity of the classes and the edge density (m/ha)
+EXTRA_METRICS = True
+# One corine_data.csv-style table per radius, the class areas of all radii go to output_csv
+composition_csv_pattern = 'C:/Users/Almas/QGIS_proj/CORINE_u2018_clc2018_v2020_20u1_raster100m/corine_data_{radius}m.csv'
+
+
+def polygonize_areas(input_raster, buffer_file, valid_categories):
+    """
+    Area per buffer zone and land cover class from the polygonized raster (needs QGIS).
+
+    Returns:
+        dict: { buffer_zone_name: { land_cover_value: total_area, ... }, ... }
+    """
+    import processing
+    from qgis.core import QgsVectorLayer
+
+    # === Step 1. Convert CORINE Raster to Vector (Polygonize) ===
+    print("Converting CORINE raster to polygons...")
+    polygonize_params = {
+        'INPUT': input_raster,
+        'BAND': 1,
+        'FIELD': 'DN',  # Field to store the raster pixel value (land cover class)
+        'EIGHT_CONNECTEDNESS': False,
+        'EXTRA': '',
+        'OUTPUT': 'TEMPORARY_OUTPUT'
+    }
+    polygonize_result = processing.run("gdal:polygonize", polygonize_params)
+    landcover_vector = polygonize_result['OUTPUT']
+
+    # === Step 2. Load Buffer Zones Vector Layer ===
+    print("Loading buffer zones...")
+    buffer_layer = QgsVectorLayer(buffer_file, "buffer_zones", "ogr")
+    if not buffer_layer.isValid():
+        raise Exception("Buffer layer failed to load. Check the file path and layer name.")
+
+    # === Step 3. Clip (Intersect) Land Cover with Buffer Zones ===
+    print("Computing intersections between buffer zones and CORINE land cover polygons...")
+    intersection_params = {
+        'INPUT': buffer_layer,
+        'OVERLAY': landcover_vector,
+        'OUTPUT': 'TEMPORARY_OUTPUT'
+    }
+    intersection_result = processing.run("native:intersection", intersection_params)
+    intersection_layer = intersection_result['OUTPUT']
+
+    # === Step 4. Calculate Area per CORINE Land Cover Type Within Each Buffer ===
+    # Results dictionary structure:
+    # { buffer_zone_name: { land_cover_value: total_area, ... }, ... }
+    print("Calculating areas for each buffer and CORINE land cover type...")
+    results = {}
+    for feature in intersection_layer.getFeatures():
+        # Retrieve the buffer zone name from the "Name" field
+        zone_name = feature['Name']
+        # Retrieve the CORINE land cover value from the polygonized output field ("DN")
+        land_cover = feature['DN']
+        
+        # Filter out any features that do not belong to the valid CORINE categories
+        if land_cover not in valid_categories:
+            continue
+        
+        # Calculate the area of the intersected geometry (assumes CRS units in meters)
+        area = feature.geometry().area()
+        
+        # Aggregate the area by buffer zone and land cover type
+        if zone_name not in results:
+            results[zone_name] = {}
+        if land_cover not in results[zone_name]:
+            results[zone_name][land_cover] = 0.0
+        results[zone_name][land_cover] += area
+    return results
+
+
+def write_area_csv(results, output_csv):
+    """
+    Write the { buffer_zone_name: { land_cover_value: total_area } } results as Buffer, LandCover, Area_m2.
+    """
+    # === Step 5. Write the Output Table to a CSV File ===
+    print("Writing results to CSV...")
+    with open(output_csv, 'w', newline='') as csvfile:
+        writer = csv.writer(csvfile)
+        # Write header row
+        writer.writerow(["Buffer", "LandCover", "Area_m2"])
+        # Write one row for each combination of buffer zone and land cover type
+        for zone, landcover_dict in results.items():
+            for land_cover, area in landcover_dict.items():
+                writer.writerow([zone, land_cover, area])
+
+
+def main():
+    # Worker processes of the landscape mode import this file again, only run from here
+    if MODE == "raster":
+        from corine_zonal import zonal_areas
+        print("Counting CORINE land cover pixels inside each buffer zone...")
+        write_area_csv(zonal_areas(input_raster, buffer_file, valid_categories), output_csv)
+    elif MODE == "polygonize":
+        write_area_csv(polygonize_areas(input_raster, buffer_file, valid_categories), output_csv)
+    elif MODE == "landscape":
+        from landscape_metrics import landscape_metrics, composition_table, write_area_table, write_composition_tables
+        print(f"Computing the landscape composition for radii {RADII}...")
+        landscape = landscape_metrics(input_raster, sites_file, RADII, EXTRA_METRICS)
+        # Same table with an added Radius_m column
+        write_area_table(landscape, output_csv, valid_categories)
+        write_composition_tables(composition_table(landscape), composition_csv_pattern)
+    else:
+        raise ValueError(f"Unknown mode {MODE}, use 'raster', 'polygonize' or 'landscape'")
+
+    print("CSV output saved to:", output_csv)
+
+
+if __name__ == "__main__":
+    main()
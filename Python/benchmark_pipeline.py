@@ -0,0 +1,286 @@
+# benchmark of the BioClip classification pipeline
+# generates a synthetic folder of crops, runs the BioClip_csv.py pipeline (scan, decode, embed, score,
+# write the CSV) on it for every combination of batch size, decode threads and embedding cache, and
+# prints images/sec, peak memory and startup time as a comparison table
+# runs offline on a CPU-only machine: the default stub classifier has the same interface as the
+# TreeOfLifeClassifier but a small random model, set USE_REAL_MODEL = True to benchmark BioClip itself
+# (needs the model weights in the local Hugging Face cache)
+import os
+import csv
+import json
+import time
+import shutil
+import tempfile
+import itertools
+import multiprocessing
+import numpy as np
+import pandas as pd
+import PIL.Image
+
+# === BENCHMARK CONFIGURATION ===
+# Folder for the synthetic crops, the benchmark CSVs and the report
+BENCHMARK_DIR = os.path.join(tempfile.gettempdir(), "bioclip_benchmark")
+
+# Synthetic dataset: number of crops, their size range in pixels and the number of camera/date folders
+NUM_IMAGES = 512
+IMAGE_SIZE_RANGE = (96, 480)
+NUM_FOLDERS = 8
+JPEG_QUALITY = 90
+SEED = 0
+
+# Classifier: False = stub model (offline, seconds to load), True = the real TreeOfLifeClassifier on the CPU
+USE_REAL_MODEL = False
+
+# Number of labels of the stub classifier (BioClip has about 450,000)
+STUB_NUM_LABELS = 20000
+
+# Settings swept by the benchmark, every combination is measured
+BATCH_SIZES = [8, 32]
+WORKER_COUNTS = [0, 4]
+CACHE_SETTINGS = [False, True]  # True runs twice: "cold" (empty cache) and "warm" (every embedding cached)
+
+# Comparison table (CSV)
+REPORT_PATH = os.path.join(BENCHMARK_DIR, "benchmark_report.csv")
+
+
+class StubClassifier:
+    """
+    Stand-in for the TreeOfLifeClassifier with the interface used by bioclip_utils.
+
+    Preprocessing and the forward pass do real work of a similar shape (resize
+    to 224 x 224, a small convolutional encoder, scoring against a label matrix
+    with a synthetic taxonomy), so the pipeline around the model is exercised
+    the same way, but no weights have to be downloaded.
+    """
+
+    def __init__(self, num_labels=STUB_NUM_LABELS, embedding_dim=512, seed=SEED):
+        import torch
+
+        torch.manual_seed(seed)
+        self.model_str = f"stub-{num_labels}"
+        self.device = torch.device("cpu")
+        self.model = torch.nn.Sequential(
+            torch.nn.Conv2d(3, 64, kernel_size=16, stride=16),
+            torch.nn.ReLU(),
+            torch.nn.Flatten(),
+            torch.nn.Linear(64 * 14 * 14, embedding_dim),
+        ).eval()
+        # open_clip models expose the image tower as encode_image()
+        self.model.encode_image = self.model.forward
+        self.txt_embeddings = torch.nn.functional.normalize(torch.randn(embedding_dim, num_labels), dim=0)
+
+        # Synthetic taxonomy: 1 kingdom, 1 phylum, 4 classes, 40 orders, 400 families
+        self.txt_names = []
+        for i in range(num_labels):
+            family = i % 400
+            order = family % 40
+            taxon = ["Animalia", "Arthropoda", f"Class{order % 4}", f"Order{order}", f"Family{family}",
+                     f"Genus{i % 4000}", f"species{i}"]
+            self.txt_names.append([taxon, f"common name {i}"])
+        self._subset_txt_embeddings = None
+        self._subset_txt_names = None
+
+    def preprocess(self, img):
+        import torch
+
+        img = img.resize((224, 224), PIL.Image.BICUBIC)
+        tensor = torch.from_numpy(np.asarray(img, dtype=np.float32) / 255).permute(2, 0, 1)
+        return (tensor - 0.5) / 0.25
+
+    def get_txt_embeddings(self):
+        if self._subset_txt_embeddings is not None:
+            return self._subset_txt_embeddings
+        return self.txt_embeddings
+
+    def get_current_txt_names(self):
+        if self._subset_txt_names is not None:
+            return self._subset_txt_names
+        return self.txt_names
+
+    def create_probabilities(self, img_features, txt_features):
+        logits = (100.0 * img_features @ txt_features)
+        return logits.softmax(dim=-1)
+
+
+def make_synthetic_crops(image_folder, num_images=NUM_IMAGES, size_range=IMAGE_SIZE_RANGE,
+                         num_folders=NUM_FOLDERS, quality=JPEG_QUALITY, seed=SEED):
+    """
+    Write random JPEG crops into camera/date subfolders, or reuse them if they exist with the same settings.
+
+    Args:
+        image_folder (str): Output folder
+        num_images (int): Number of crops
+        size_range (tuple): Smallest and largest side length in pixels
+        num_folders (int): Number of subfolders the crops are spread over
+        quality (int): JPEG quality
+        seed (int): Random seed, the same settings always give the same files
+
+    Returns:
+        int: Number of bytes written
+    """
+    settings = {"num_images": num_images, "size_range": list(size_range), "num_folders": num_folders,
+                "quality": quality, "seed": seed}
+    settings_path = os.path.join(image_folder, "settings.json")
+    if os.path.exists(settings_path):
+        with open(settings_path) as f:
+            if json.load(f) == settings:
+                print(f"Reusing synthetic crops in {image_folder}")
+                return sum(os.path.getsize(os.path.join(folder, name))
+                           for folder, _, names in os.walk(image_folder) for name in names if name.endswith(".jpg"))
+        shutil.rmtree(image_folder)
+
+    print(f"Writing {num_images} synthetic crops to {image_folder}")
+    rng = np.random.default_rng(seed)
+    total_bytes = 0
+    for i in range(num_images):
+        folder = os.path.join(image_folder, f"cam{i % num_folders:02d}", "20250101")
+        os.makedirs(folder, exist_ok=True)
+        width, height = rng.integers(size_range[0], size_range[1] + 1, size=2)
+        # Smooth colour blobs compress like real crops, unlike white noise
+        small = rng.integers(0, 256, size=(max(height // 16, 2), max(width // 16, 2), 3), dtype=np.uint8)
+        img = PIL.Image.fromarray(small).resize((int(width), int(height)), PIL.Image.BILINEAR)
+        path = os.path.join(folder, f"crop_{i:06d}.jpg")
+        img.save(path, quality=quality)
+        total_bytes += os.path.getsize(path)
+
+    with open(settings_path, 'w') as f:
+        json.dump(settings, f)
+    return total_bytes
+
+
+def load_classifier(use_real_model):
+    if use_real_model:
+        from bioclip import TreeOfLifeClassifier
+        return TreeOfLifeClassifier(device="cpu")
+    return StubClassifier()
+
+
+def run_pipeline(classifier, image_folder, csv_path, batch_size, num_workers, cache=None, timer=None):
+    """
+    Classify every image below image_folder into a fresh CSV, the same way BioClip_csv.py does.
+
+    Returns:
+        int: Number of classified images
+    """
+    from bioclip import Rank
+    from bioclip_utils import iter_rank_predictions
+    from resume_index import ResumeIndex
+    from stage_timer import timed
+
+    index_path = csv_path + ".index.sqlite"
+    if os.path.exists(index_path):
+        os.remove(index_path)
+    resume_index = ResumeIndex(index_path)
+    with timed(timer, "discovery"):
+        resume_index.scan(image_folder)
+    image_paths = resume_index.remaining()
+
+    with open(csv_path, 'w', newline='') as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow(['Image_Path', 'Family', 'Family_Confidence', 'Classification_Category'])
+        batches = iter_rank_predictions(classifier, image_paths, [Rank.FAMILY], 1, batch_size,
+                                        cache=cache, num_workers=num_workers, timer=timer)
+        for batch_paths, rank_predictions in batches:
+            with timed(timer, "write", len(batch_paths)):
+                for image_path, predictions in zip(batch_paths, rank_predictions):
+                    best = predictions[Rank.FAMILY][0]
+                    writer.writerow([image_path, best["family"], best["score"], 'other_families'])
+                csvfile.flush()
+                resume_index.mark_done(batch_paths)
+    resume_index.close()
+    return len(image_paths)
+
+
+def peak_rss_mb():
+    """
+    Peak resident memory of this process in MB (None where the resource module is missing, e.g. Windows).
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def benchmark_config(image_folder, work_dir, batch_size, num_workers, use_cache, use_real_model):
+    """
+    Measure one setting in a fresh process (runs in a spawned worker, so startup and peak memory are per setting).
+
+    Returns:
+        list: One result dict per measured pass ("off", or "cold" and "warm" with the cache)
+    """
+    # Startup includes importing torch and bioclip and loading the model
+    start_time = time.perf_counter()
+    import bioclip_utils  # noqa: F401 (imports torch and bioclip)
+    from embedding_cache import EmbeddingCache
+    from stage_timer import StageTimer
+
+    classifier = load_classifier(use_real_model)
+    # Touch the label matrix once, like the first batch of a real run would
+    classifier.get_txt_embeddings()
+    startup_seconds = time.perf_counter() - start_time
+
+    name = f"b{batch_size}_w{num_workers}_{'cache' if use_cache else 'nocache'}"
+    csv_path = os.path.join(work_dir, name + ".csv")
+    cache = None
+    passes = ["off"]
+    if use_cache:
+        cache_dir = os.path.join(work_dir, name + "_cache")
+        shutil.rmtree(cache_dir, ignore_errors=True)
+        cache = EmbeddingCache(cache_dir, classifier.model_str)
+        passes = ["cold", "warm"]
+
+    results = []
+    for cache_pass in passes:
+        timer = StageTimer()
+        pass_start = time.perf_counter()
+        image_count = run_pipeline(classifier, image_folder, csv_path, batch_size, num_workers, cache, timer)
+        if cache is not None:
+            cache.flush()
+        run_seconds = time.perf_counter() - pass_start
+
+        stages = timer.summary()["stages"]
+        peak_rss = peak_rss_mb()
+        results.append({
+            "model": classifier.model_str,
+            "batch_size": batch_size,
+            "num_workers": num_workers,
+            "cache": cache_pass,
+            "images": image_count,
+            "startup_s": round(startup_seconds, 2),
+            "run_s": round(run_seconds, 2),
+            "img_per_s": round(image_count / run_seconds, 1),
+            "peak_rss_mb": round(peak_rss, 1) if peak_rss is not None else None,
+            "forward_ms_per_img": stages.get("forward", {}).get("ms_per_item", 0.0),
+            "decode_wait_ms_per_img": stages.get("decode_wait", {}).get("ms_per_item", 0.0),
+        })
+    return results
+
+
+def main():
+    image_folder = os.path.join(BENCHMARK_DIR, "crops")
+    work_dir = os.path.join(BENCHMARK_DIR, "runs")
+    os.makedirs(work_dir, exist_ok=True)
+
+    dataset_bytes = make_synthetic_crops(image_folder)
+    print(f"Dataset: {NUM_IMAGES} crops, {dataset_bytes / 1e6:.1f} MB, sizes {IMAGE_SIZE_RANGE[0]}-{IMAGE_SIZE_RANGE[1]} px")
+    print(f"Classifier: {'TreeOfLifeClassifier (CPU)' if USE_REAL_MODEL else 'stub'}, {os.cpu_count()} CPUs")
+
+    # Every setting runs in its own process, so memory and startup are not shared between settings
+    ctx = multiprocessing.get_context("spawn")
+    results = []
+    for batch_size, num_workers, use_cache in itertools.product(BATCH_SIZES, WORKER_COUNTS, CACHE_SETTINGS):
+        print(f"- batch size {batch_size}, {num_workers} decode threads, cache {'on' if use_cache else 'off'}")
+        with ctx.Pool(1) as pool:
+            results.extend(pool.apply(benchmark_config, (image_folder, work_dir, batch_size, num_workers,
+                                                         use_cache, USE_REAL_MODEL)))
+
+    report = pd.DataFrame(results)
+    print("\n" + report.to_string(index=False))
+    report.to_csv(REPORT_PATH, index=False)
+    print(f"\nBenchmark report saved to {REPORT_PATH}")
+
+
+if __name__ == "__main__":
+    main()
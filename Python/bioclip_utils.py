@@ -0,0 +1,303 @@
+# helper functions shared by the BioClip classification scripts
+
+import io
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import PIL.Image
+import torch
+import torch.nn.functional as F
+from bioclip import Rank
+from embedding_cache import bytes_hash
+from stage_timer import timed
+
+# Cache of (group index, group labels) per classifier, label set and rank
+_rank_groups_cache = {}
+
+
+def load_image(source, draft_size=(224, 224)):
+    """
+    Open an image as RGB, letting the JPEG decoder skip detail the model never sees.
+
+    For JPEGs, PIL's draft mode decodes at 1/2, 1/4 or 1/8 scale as long as the
+    result stays at least draft_size. Crops that are already small are decoded
+    at full size as before.
+
+    Args:
+        source (str or file object): Image path or open binary file
+        draft_size (tuple): Smallest (width, height) the decoded image may have
+
+    Returns:
+        PIL.Image.Image: RGB image
+    """
+    img = PIL.Image.open(source)
+    if img.format == "JPEG" and draft_size:
+        img.draft("RGB", draft_size)
+    return img.convert("RGB")
+
+
+def prepare_image(classifier, image_path, cache=None, timer=None):
+    """
+    Read, decode and preprocess one image (runs on the prefetch threads).
+
+    Args:
+        classifier (TreeOfLifeClassifier): Initialized BioClip classifier
+        image_path (str): Image path
+        cache (EmbeddingCache, optional): If given, images already in the cache are not decoded
+        timer (StageTimer, optional): Records the "decode" and "preprocess" stages
+
+    Returns:
+        tuple: (content hash or None without cache, preprocessed image tensor or
+                None if the embedding is already cached)
+    """
+    content_hash = None
+    with timed(timer, "decode"):
+        if cache is None:
+            img = load_image(image_path)
+        else:
+            with open(image_path, 'rb') as f:
+                data = f.read()
+            content_hash = bytes_hash(data)
+            if content_hash in cache:
+                return content_hash, None
+            img = load_image(io.BytesIO(data))
+    with timed(timer, "preprocess"):
+        return content_hash, classifier.preprocess(img)
+
+
+def iter_prepared_batches(classifier, image_paths, batch_size=32, cache=None, num_workers=4, prefetch=2,
+                          timer=None):
+    """
+    Decode and preprocess batches of images ahead of the model.
+
+    A thread pool prepares up to `prefetch` batches while the model works on the
+    current one. Decoding in PIL and the torchvision transforms release the GIL,
+    so threads are enough to keep the model busy. Batches are yielded in the
+    order of image_paths regardless of which thread finishes first.
+
+    Args:
+        classifier (TreeOfLifeClassifier): Initialized BioClip classifier
+        image_paths (list): Image paths
+        batch_size (int): Number of images per batch
+        cache (EmbeddingCache, optional): Embedding cache, cached images are not decoded
+        num_workers (int): Number of decode threads, 0 decodes on the calling thread
+        prefetch (int): Number of batches prepared ahead (bounds the memory used)
+        timer (StageTimer, optional): Records decoding, preprocessing and the time spent
+                                      waiting for a prepared batch ("decode_wait")
+
+    Yields:
+        tuple: (batch image paths, list of (content hash, preprocessed tensor) per image)
+    """
+    batches = [image_paths[i:i + batch_size] for i in range(0, len(image_paths), batch_size)]
+
+    if num_workers <= 0:
+        for batch_paths in batches:
+            yield batch_paths, [prepare_image(classifier, image_path, cache, timer) for image_path in batch_paths]
+        return
+
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        pending = deque()
+        next_batch = 0
+        try:
+            while next_batch < len(batches) or pending:
+                # Keep the queue of prepared batches full
+                while next_batch < len(batches) and len(pending) <= prefetch:
+                    batch_paths = batches[next_batch]
+                    futures = [executor.submit(prepare_image, classifier, image_path, cache, timer)
+                               for image_path in batch_paths]
+                    pending.append((batch_paths, futures))
+                    next_batch += 1
+
+                batch_paths, futures = pending.popleft()
+                with timed(timer, "decode_wait", len(batch_paths)):
+                    prepared = [future.result() for future in futures]
+                yield batch_paths, prepared
+        finally:
+            # Do not decode the rest of the queue if the consumer stops early
+            for _, futures in pending:
+                for future in futures:
+                    future.cancel()
+
+
+@torch.no_grad()
+def encode_prepared(classifier, prepared, cache=None, timer=None):
+    """
+    Run the BioClip image encoder on a batch of preprocessed images.
+
+    Args:
+        classifier (TreeOfLifeClassifier): Initialized BioClip classifier
+        prepared (list): (content hash, preprocessed tensor) per image, as
+                         yielded by iter_prepared_batches()
+        cache (EmbeddingCache, optional): Embedding cache to read from and add to
+        timer (StageTimer, optional): Records the "forward" stage
+
+    Returns:
+        torch.Tensor: Normalized image embeddings, one row per image
+    """
+    missing = [i for i, (_, tensor) in enumerate(prepared) if tensor is not None]
+    new_features = None
+    if missing:
+        with timed(timer, "forward", len(missing)):
+            image_tensor = torch.stack([prepared[i][1] for i in missing]).to(classifier.device)
+            new_features = F.normalize(classifier.model.encode_image(image_tensor), dim=-1)
+            if timer is not None and new_features.is_cuda:
+                # CUDA runs asynchronously, wait for the result so the forward pass is timed correctly
+                torch.cuda.synchronize()
+
+    # Same dtype as the label embeddings, whether the embeddings were computed or read from the cache
+    dtype = classifier.get_txt_embeddings().dtype
+    if cache is None:
+        return new_features.to(dtype=dtype)
+
+    if missing:
+        # A read-only cache (sharded workers) does not keep the new embeddings, so they are not read back
+        cache.add([prepared[i][0] for i in missing], new_features.float().cpu().numpy())
+        # Round them through float16 like the stored ones, so an image scores the same on every run
+        new_features = F.normalize(new_features.half().float(), dim=-1).to(dtype=dtype)
+    hits = [i for i, (_, tensor) in enumerate(prepared) if tensor is None]
+    if not hits:
+        return new_features
+
+    # float16 storage slightly changes the norm, so normalize again
+    cached = F.normalize(torch.from_numpy(cache.get([prepared[i][0] for i in hits])), dim=-1)
+    cached = cached.to(device=classifier.device, dtype=dtype)
+    if not missing:
+        return cached
+    features = torch.empty(len(prepared), cached.shape[1], device=classifier.device, dtype=dtype)
+    features[hits] = cached
+    features[missing] = new_features
+    return features
+
+
+def rank_groups(classifier, rank):
+    """
+    Map every label of the classifier to its taxon at the given rank.
+
+    Args:
+        classifier (TreeOfLifeClassifier): Initialized BioClip classifier
+        rank (Rank): Taxonomic rank to group by
+
+    Returns:
+        tuple: (LongTensor with the group index of every label,
+                list of taxon name tuples from kingdom down to rank)
+    """
+    txt_names = classifier.get_current_txt_names()
+    cache_key = (id(classifier), id(txt_names), rank)
+    if cache_key not in _rank_groups_cache:
+        group_ids = {}
+        group_index = []
+        for name_ary in txt_names:
+            taxon = tuple(name_ary[0][:rank.value + 1])
+            group_index.append(group_ids.setdefault(taxon, len(group_ids)))
+        _rank_groups_cache[cache_key] = (torch.tensor(group_index, dtype=torch.long), list(group_ids))
+    return _rank_groups_cache[cache_key]
+
+
+def group_probabilities(classifier, probs, rank):
+    """
+    Sum label probabilities into taxa of a higher rank.
+
+    Args:
+        classifier (TreeOfLifeClassifier): Initialized BioClip classifier
+        probs (torch.Tensor): Label probabilities, one row per image
+        rank (Rank): Taxonomic rank to sum up to
+
+    Returns:
+        tuple: (probabilities per taxon, one row per image, list of taxon name tuples)
+    """
+    group_index, group_labels = rank_groups(classifier, rank)
+    grouped = torch.zeros(probs.shape[0], len(group_labels), dtype=probs.dtype, device=probs.device)
+    grouped.index_add_(1, group_index.to(probs.device), probs)
+    return grouped, group_labels
+
+
+def format_rank_predictions(image_key, grouped_probs, group_labels, k=1):
+    """
+    Turn the grouped probabilities of one image into prediction dicts.
+
+    The dicts have the same keys as the ones returned by classifier.predict(),
+    e.g. "file_name", "kingdom", ..., "family" and "score".
+    """
+    k = min(k, grouped_probs.shape[0])
+    topk = grouped_probs.topk(k)
+    predictions = []
+    for idx, score in zip(topk.indices.tolist(), topk.values.tolist()):
+        prediction = {"file_name": image_key}
+        for rank_value, name in enumerate(group_labels[idx]):
+            prediction[Rank(rank_value).get_label()] = name
+        prediction["score"] = score
+        predictions.append(prediction)
+    return predictions
+
+
+@torch.no_grad()
+def rank_predictions_from_features(classifier, image_keys, img_features, ranks, k=1):
+    """
+    Score image embeddings against the labels and sum the probabilities up to each rank.
+
+    Args:
+        classifier (TreeOfLifeClassifier): Initialized BioClip classifier
+        image_keys (list): Key stored as "file_name" in the predictions, one per embedding
+        img_features (torch.Tensor): Normalized image embeddings
+        ranks (list): Ranks above SPECIES to predict
+        k (int): Number of top predictions to keep per rank
+
+    Returns:
+        list: One dict per image mapping each rank to its list of top-k predictions, best first
+    """
+    probs = classifier.create_probabilities(img_features, classifier.get_txt_embeddings())
+
+    results = [{} for _ in image_keys]
+    for rank in ranks:
+        grouped, group_labels = group_probabilities(classifier, probs, rank)
+        grouped = grouped.cpu()
+        for i, image_key in enumerate(image_keys):
+            results[i][rank] = format_rank_predictions(image_key, grouped[i], group_labels, k)
+    return results
+
+
+def iter_rank_predictions(classifier, image_paths, ranks, k=1, batch_size=32, cache=None, num_workers=4,
+                          timer=None):
+    """
+    Predict several taxonomic ranks from a single embedding per image, batch by batch.
+
+    Every image is encoded once. The label probabilities are then summed up to
+    each requested rank, so asking for CLASS, ORDER and FAMILY costs one model
+    forward pass instead of three.
+
+    Args:
+        classifier (TreeOfLifeClassifier): Initialized BioClip classifier
+        image_paths (list): Image paths
+        ranks (list): Ranks above SPECIES to predict, e.g. [Rank.CLASS, Rank.ORDER, Rank.FAMILY]
+        k (int): Number of top predictions to keep per rank
+        batch_size (int): Number of images per forward pass
+        cache (EmbeddingCache, optional): Embedding cache to read from and add to
+        num_workers (int): Number of decode threads
+        timer (StageTimer, optional): Records the time spent in each stage
+
+    Yields:
+        tuple: (batch image paths, list with one dict per image mapping each
+                rank to its list of top-k predictions, best first)
+    """
+    batches = iter_prepared_batches(classifier, image_paths, batch_size, cache, num_workers, timer=timer)
+    for batch_paths, prepared in batches:
+        img_features = encode_prepared(classifier, prepared, cache, timer)
+        with timed(timer, "postprocess", len(batch_paths)):
+            rank_predictions = rank_predictions_from_features(classifier, batch_paths, img_features, ranks, k)
+        yield batch_paths, rank_predictions
+
+
+def predict_ranks(classifier, image_paths, ranks, k=1, batch_size=32, cache=None, num_workers=4):
+    """
+    Predict several taxonomic ranks from a single embedding per image.
+
+    See iter_rank_predictions() for the arguments.
+
+    Returns:
+        list: One dict per image (same order as image_paths) mapping each rank
+              to its list of top-k predictions, best first
+    """
+    results = []
+    for _, rank_predictions in iter_rank_predictions(classifier, image_paths, ranks, k, batch_size,
+                                                     cache, num_workers):
+        results.extend(rank_predictions)
+    return results
@@ -0,0 +1,127 @@
+# streaming stratified sampling of crops
+# walks the crop archive once with os.scandir and keeps at most k crops per stratum (folder, camera, date
+# or YOLO top1 class), so the memory used does not grow with the size of the archive. Every crop gets a
+# seeded pseudo-random priority from its path and each stratum keeps the k lowest priorities (bottom-k
+# reservoir), which makes the sample reproducible for a seed regardless of the order the file system
+# lists the files in.
+
+import os
+import re
+import heapq
+import hashlib
+from resume_index import IMAGE_EXTENSIONS
+
+STRATIFY_OPTIONS = ("folder", "camera", "date", "yolo_top1")
+
+# e.g. "seppi-cam31" in the path
+CAMERA_PATTERN = re.compile(r"cam(\d+)", re.IGNORECASE)
+# e.g. "2024-07-24_16-15-16-941965_ID7187_crop.jpg" or a "20240724" folder
+DATE_PATTERN = re.compile(r"(20\d{2})-?(\d{2})-?(\d{2})")
+
+
+def iter_image_files(root_folder, extensions=IMAGE_EXTENSIONS):
+    """
+    Yield the image files below root_folder one by one.
+
+    Args:
+        root_folder (str): Folder to walk recursively
+        extensions (tuple): Lower-case file extensions counted as images
+
+    Yields:
+        tuple: (path, folder, file name)
+    """
+    stack = [root_folder]
+    while stack:
+        folder = stack.pop()
+        try:
+            with os.scandir(folder) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.name.lower().endswith(extensions):
+                        yield entry.path, folder, entry.name
+        except (FileNotFoundError, PermissionError) as e:
+            print(f"Skipping folder {folder}: {e}")
+
+
+def stratum_function(stratify_by, root_folder, yolo_top1=None):
+    """
+    Build the function giving the stratum of a crop.
+
+    Args:
+        stratify_by (str): "folder" (every folder separately), "camera" (camN
+            in the path, otherwise the first folder below root_folder), "date"
+            (date in the file name, otherwise in the path) or "yolo_top1"
+        root_folder (str): Folder the crops are sampled from
+        yolo_top1 (dict, optional): img_name -> YOLO top1 class, needed for "yolo_top1"
+
+    Returns:
+        function: (path, folder, file name) -> stratum name
+    """
+    if stratify_by == "folder":
+        return lambda path, folder, name: folder
+
+    if stratify_by == "camera":
+        def camera_stratum(path, folder, name):
+            match = CAMERA_PATTERN.search(folder)
+            if match:
+                return f"cam{match.group(1)}"
+            relative = os.path.relpath(folder, root_folder)
+            return relative.split(os.sep)[0] if relative != "." else os.path.basename(root_folder)
+        return camera_stratum
+
+    if stratify_by == "date":
+        def date_stratum(path, folder, name):
+            match = DATE_PATTERN.search(name) or DATE_PATTERN.search(folder)
+            return "-".join(match.groups()) if match else "unknown"
+        return date_stratum
+
+    if stratify_by == "yolo_top1":
+        if yolo_top1 is None:
+            raise ValueError("Stratifying by yolo_top1 needs the YOLO results (yolo_top1)")
+        return lambda path, folder, name: yolo_top1.get(name, "unknown")
+
+    raise ValueError(f"Unknown stratification {stratify_by}, use one of {', '.join(STRATIFY_OPTIONS)}")
+
+
+def _priority(seed, path):
+    # Seeded pseudo-random number in [0, 2**64) that only depends on the path
+    digest = hashlib.blake2b(f"{seed}\0{path}".encode("utf-8", "surrogateescape"), digest_size=8).digest()
+    return int.from_bytes(digest, "big")
+
+
+def sample_crops(root_folder, per_stratum, stratify_by="folder", seed=0, yolo_top1=None,
+                 extensions=IMAGE_EXTENSIONS):
+    """
+    Draw up to per_stratum random crops from every stratum in a single pass.
+
+    Args:
+        root_folder (str): Folder to sample from (walked recursively)
+        per_stratum (int): Maximum number of crops per stratum
+        stratify_by (str): "folder", "camera", "date" or "yolo_top1", see stratum_function()
+        seed (int): Random seed, the same seed and files always give the same sample
+        yolo_top1 (dict, optional): img_name -> YOLO top1 class, needed for "yolo_top1"
+        extensions (tuple): Lower-case file extensions counted as images
+
+    Returns:
+        dict: Stratum name -> sorted list of sampled crop paths
+    """
+    stratum_of = stratum_function(stratify_by, root_folder, yolo_top1)
+    # One max-heap of (-priority, relative path, path) per stratum holding its per_stratum lowest priorities
+    reservoirs = {}
+    seen = 0
+    for path, folder, name in iter_image_files(root_folder, extensions):
+        seen += 1
+        # Relative paths keep the sample the same if the archive is mounted somewhere else
+        relative = os.path.relpath(path, root_folder).replace(os.sep, "/")
+        item = (-_priority(seed, relative), relative, path)
+        reservoir = reservoirs.setdefault(stratum_of(path, folder, name), [])
+        if len(reservoir) < per_stratum:
+            heapq.heappush(reservoir, item)
+        elif reservoir and item > reservoir[0]:
+            heapq.heapreplace(reservoir, item)
+
+    sample = {stratum: sorted(path for _, _, path in reservoir) for stratum, reservoir in reservoirs.items()}
+    print(f"Sampled {sum(len(paths) for paths in sample.values())} of {seen} crops "
+          f"from {len(sample)} strata ({stratify_by})")
+    return sample
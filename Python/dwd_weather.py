@@ -0,0 +1,395 @@
+# indexed loader for the DWD daily climate data (produkt_klima_tag_*.txt)
+# every DWD file (or DWD zip, e.g. tageswerte_KL_00722_akt.zip) is parsed once into typed NumPy columns
+# and cached as an .npz file next to the data; later runs only parse the files that are new or changed
+# (size and modification time), so adding a station or a year is dropping its file into the folder.
+# the sites are matched to their nearest stations with a spatial index over the station coordinates
+# (DWD station list KL_Tageswerte_Beschreibung_Stationen.txt or the Metadaten_Geographie_*.txt files of
+# the DWD zips), and the weather of many (site, date) pairs is looked up at once. If the nearest station
+# has no data on a date, the next nearest one is used, like the hand-built join of dwd_weather_data.csv
+
+import os
+import io
+import re
+import json
+import zipfile
+import numpy as np
+import pandas as pd
+
+# Paths
+weather_folder = "C:/Users/Almas/Desktop/UNI_LEIPSI/Thesis/Thesis_Rproject/Weather"
+field_weather_csv = "C:/Users/Almas/Desktop/UNI_LEIPSI/Thesis/Thesis_Rproject/data/field_weather_data.csv"
+output_csv = "C:/Users/Almas/Desktop/UNI_LEIPSI/Thesis/Thesis_Rproject/data/dwd_weather_data.csv"
+
+# DWD station list with the station coordinates (from the kl/recent folder of the DWD open data server),
+# None uses the Metadaten_Geographie_*.txt files found in weather_folder (they come with the DWD zips)
+STATION_LIST_PATH = None
+
+# Number of nearest stations tried per site, and the largest distance of a station to a site in km
+NEAREST_STATIONS = 3
+MAX_DISTANCE_KM = 100
+
+# Columns left out of the output, like the daily snow depth in Weather.Rmd
+DROP_COLUMNS = ["SHK_TAG"]
+
+CACHE_FOLDER_NAME = "dwd_cache"
+CACHE_VERSION = 1
+
+# Missing values in the DWD files
+MISSING_VALUE = -999
+
+EARTH_RADIUS_KM = 6371.0
+
+PRODUCT_PATTERN = re.compile(r"produkt_klima_tag_.*\.txt$")
+GEOGRAPHY_PATTERN = re.compile(r"Metadaten_Geographie_.*\.txt$")
+
+
+def _read_dwd_table(f):
+    # Semicolon-separated with padded fields and a trailing "eor" (end of record) column
+    table = pd.read_csv(f, sep=';', skipinitialspace=True, na_values=[MISSING_VALUE], dtype=str,
+                        encoding='latin-1')
+    table.columns = [column.strip() for column in table.columns]
+    return table.drop(columns=["eor"], errors='ignore')
+
+
+def parse_dwd_daily(f):
+    """
+    Parse one DWD daily climate file into typed columns.
+
+    Args:
+        f: Path or open binary file of a produkt_klima_tag_*.txt file
+
+    Returns:
+        dict: Column name -> np.ndarray, STATIONS_ID as int32, MESS_DATUM as datetime64[D]
+              and every other column as float32 (NaN where the DWD file has -999)
+    """
+    table = _read_dwd_table(f)
+    columns = {"STATIONS_ID": table["STATIONS_ID"].str.strip().astype(np.int32).to_numpy(),
+               "MESS_DATUM": pd.to_datetime(table["MESS_DATUM"].str.strip(), format="%Y%m%d")
+                               .to_numpy().astype("datetime64[D]")}
+    for column in table.columns:
+        if column not in columns:
+            values = pd.to_numeric(table[column].str.strip(), errors='coerce').to_numpy(np.float32)
+            values[values == MISSING_VALUE] = np.nan
+            columns[column] = values
+    return columns
+
+
+def _source_files(weather_dir):
+    # produkt_klima_tag_*.txt files and DWD zips anywhere below weather_dir
+    sources = []
+    for root, dirs, files in os.walk(weather_dir):
+        dirs[:] = [d for d in dirs if d != CACHE_FOLDER_NAME]
+        for file in files:
+            if PRODUCT_PATTERN.match(file) or (file.lower().endswith(".zip") and file.startswith("tageswerte_KL_")):
+                sources.append(os.path.join(root, file))
+    return sorted(sources)
+
+
+def _parse_source(path):
+    # One table per source, the product file inside a DWD zip is read without extracting it
+    if not path.lower().endswith(".zip"):
+        return parse_dwd_daily(path)
+    with zipfile.ZipFile(path) as archive:
+        names = [name for name in archive.namelist() if PRODUCT_PATTERN.match(os.path.basename(name))]
+        if not names:
+            raise ValueError(f"{path} has no produkt_klima_tag file")
+        with archive.open(names[0]) as f:
+            return parse_dwd_daily(io.BytesIO(f.read()))
+
+
+def load_dwd_daily(weather_dir, cache_dir=None):
+    """
+    Load all DWD daily files below a folder, parsing only the files that are not cached yet.
+
+    Args:
+        weather_dir (str): Folder with the produkt_klima_tag_*.txt files or DWD zips (subfolders included)
+        cache_dir (str, optional): Cache folder, defaults to dwd_cache inside weather_dir
+
+    Returns:
+        pd.DataFrame: All days of all stations, one row per station and date
+    """
+    cache_dir = cache_dir or os.path.join(weather_dir, CACHE_FOLDER_NAME)
+    os.makedirs(cache_dir, exist_ok=True)
+    manifest_path = os.path.join(cache_dir, "manifest.json")
+    manifest = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        if manifest.get("version") != CACHE_VERSION:
+            manifest = {}
+    entries = manifest.get("files", {})
+
+    sources = {os.path.relpath(path, weather_dir).replace(os.sep, "/"): path for path in _source_files(weather_dir)}
+    parsed = 0
+    for name, path in sources.items():
+        stat = os.stat(path)
+        key = [stat.st_size, stat.st_mtime]
+        entry = entries.get(name)
+        if entry and entry["key"] == key and os.path.exists(os.path.join(cache_dir, entry["npz"])):
+            continue
+        npz_name = re.sub(r"[^\w.-]", "_", name) + ".npz"
+        np.savez(os.path.join(cache_dir, npz_name), **_parse_source(path))
+        entries[name] = {"key": key, "npz": npz_name}
+        parsed += 1
+
+    # Forget the files that are gone
+    for name in [name for name in entries if name not in sources]:
+        npz_path = os.path.join(cache_dir, entries.pop(name)["npz"])
+        if os.path.exists(npz_path):
+            os.remove(npz_path)
+    if parsed or len(entries) != len(manifest.get("files", {})) or not os.path.exists(manifest_path):
+        tmp_path = manifest_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({"version": CACHE_VERSION, "files": entries}, f)
+        os.replace(tmp_path, manifest_path)
+    print(f"{len(sources)} DWD files, {parsed} parsed, {len(sources) - parsed} from the cache")
+
+    tables = []
+    for name in sorted(entries):
+        with np.load(os.path.join(cache_dir, entries[name]["npz"])) as data:
+            tables.append(pd.DataFrame({column: data[column] for column in data.files}))
+    if not tables:
+        return pd.DataFrame(columns=["STATIONS_ID", "MESS_DATUM"])
+    data = pd.concat(tables, ignore_index=True)
+
+    # Historical and recent files of a station overlap, keep the day with the best quality level
+    quality = data["QN_4"].fillna(-1) if "QN_4" in data.columns else pd.Series(0, index=data.index)
+    data = data.assign(_quality=quality).sort_values(["STATIONS_ID", "MESS_DATUM", "_quality"])
+    data = data.drop_duplicates(["STATIONS_ID", "MESS_DATUM"], keep='last').drop(columns="_quality")
+    return data.reset_index(drop=True)
+
+
+def _current_position(table):
+    # Metadaten_Geographie_*.txt: history of the station position, the last row is the current one
+    row = table.iloc[-1]
+    return pd.DataFrame({"STATIONS_ID": [int(row["Stations_id"])],
+                         "STATION": [str(row["Stationsname"]).strip()],
+                         "Latitude": [float(row["Geogr.Breite"])],
+                         "Longitude": [float(row["Geogr.Laenge"])]})
+
+
+def read_station_list(station_list_path):
+    """
+    Read the station coordinates from a DWD station list or a Metadaten_Geographie_*.txt file.
+
+    Returns:
+        pd.DataFrame: STATIONS_ID, STATION (name), Latitude, Longitude, one row per station
+    """
+    if GEOGRAPHY_PATTERN.match(os.path.basename(station_list_path)):
+        return _current_position(_read_dwd_table(station_list_path))
+
+    # Fixed-width list: Stations_id von_datum bis_datum Stationshoehe geoBreite geoLaenge Stationsname
+    # Bundesland Abgabe, the station names may contain single spaces
+    rows = []
+    with open(station_list_path, 'r', encoding='latin-1') as f:
+        for line in f:
+            fields = line.split(None, 6)
+            if len(fields) < 7 or not fields[0].isdigit():
+                continue
+            name = re.split(r"\s{2,}", fields[6].strip())[0]
+            rows.append((int(fields[0]), name, float(fields[4]), float(fields[5])))
+    return pd.DataFrame(rows, columns=["STATIONS_ID", "STATION", "Latitude", "Longitude"])
+
+
+def find_station_files(weather_dir):
+    """
+    Metadaten_Geographie_*.txt files below weather_dir, including the ones inside DWD zips.
+
+    Returns:
+        pd.DataFrame: Station coordinates, see read_station_list()
+    """
+    tables = []
+    for root, dirs, files in os.walk(weather_dir):
+        dirs[:] = [d for d in dirs if d != CACHE_FOLDER_NAME]
+        for file in files:
+            path = os.path.join(root, file)
+            if GEOGRAPHY_PATTERN.match(file):
+                tables.append(read_station_list(path))
+            elif file.lower().endswith(".zip") and file.startswith("tageswerte_KL_"):
+                with zipfile.ZipFile(path) as archive:
+                    for name in archive.namelist():
+                        if GEOGRAPHY_PATTERN.match(os.path.basename(name)):
+                            with archive.open(name) as f:
+                                tables.append(_current_position(_read_dwd_table(io.BytesIO(f.read()))))
+    if not tables:
+        return pd.DataFrame(columns=["STATIONS_ID", "STATION", "Latitude", "Longitude"])
+    return pd.concat(tables, ignore_index=True).drop_duplicates("STATIONS_ID", keep='last')
+
+
+def read_sites(field_weather_path, name_field="SITE", lat_field="Latitude", lon_field="Longitude"):
+    """
+    Site positions from field_weather_data.csv, the mean position of the transects of each site.
+
+    Returns:
+        pd.DataFrame: Latitude and Longitude indexed by site
+    """
+    field_data = pd.read_csv(field_weather_path, dtype={lat_field: float, lon_field: float})
+    return field_data.groupby(name_field)[[lat_field, lon_field]].mean().rename(
+        columns={lat_field: "Latitude", lon_field: "Longitude"})
+
+
+def _unit_vectors(latitudes, longitudes):
+    # Points on the unit sphere, the straight-line distance between them grows with the great-circle distance
+    lat = np.radians(np.asarray(latitudes, dtype=np.float64))
+    lon = np.radians(np.asarray(longitudes, dtype=np.float64))
+    return np.column_stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)])
+
+
+class StationIndex:
+    """
+    Nearest-station search over the station coordinates.
+
+    Uses a k-d tree of the stations on the unit sphere if SciPy is installed, otherwise compares all
+    stations at once with NumPy (fast enough for the about 1100 DWD climate stations).
+    """
+
+    def __init__(self, stations):
+        self.stations = stations.reset_index(drop=True)
+        self._points = _unit_vectors(self.stations["Latitude"], self.stations["Longitude"])
+        try:
+            from scipy.spatial import cKDTree
+            self._tree = cKDTree(self._points)
+        except ImportError:
+            self._tree = None
+
+    def nearest(self, latitudes, longitudes, k=NEAREST_STATIONS):
+        """
+        The k nearest stations of every point.
+
+        Returns:
+            tuple: (distances in km, station rows), both arrays of shape (points, k), nearest first
+        """
+        k = min(k, len(self.stations))
+        points = _unit_vectors(latitudes, longitudes)
+        if self._tree is not None:
+            chords, rows = self._tree.query(points, k=k)
+            chords, rows = chords.reshape(len(points), k), rows.reshape(len(points), k)
+        else:
+            squared = ((points[:, None, :] - self._points[None, :, :]) ** 2).sum(axis=2)
+            rows = np.argsort(squared, axis=1)[:, :k]
+            chords = np.sqrt(np.take_along_axis(squared, rows, axis=1))
+        # Chord length on the unit sphere -> great-circle distance
+        distances = 2 * EARTH_RADIUS_KM * np.arcsin(np.clip(chords / 2, 0, 1))
+        return distances, rows
+
+
+class WeatherIndex:
+    """
+    Daily DWD weather of the nearest station for (site, date) pairs.
+    """
+
+    def __init__(self, data, stations, sites, k=NEAREST_STATIONS, max_distance_km=MAX_DISTANCE_KM):
+        """
+        Args:
+            data (pd.DataFrame): Daily data from load_dwd_daily()
+            stations (pd.DataFrame): Station coordinates, see read_station_list()
+            sites (pd.DataFrame): Site coordinates indexed by site, see read_sites()
+            k (int): Number of nearest stations tried per site
+            max_distance_km (float): Stations farther away are never used
+        """
+        # Only stations with data can be matched
+        stations = stations[stations["STATIONS_ID"].isin(data["STATIONS_ID"].unique())]
+        if stations.empty:
+            raise ValueError("None of the DWD files has station coordinates, set STATION_LIST_PATH")
+        self.stations = StationIndex(stations)
+        self.data = data.set_index(["STATIONS_ID", "MESS_DATUM"]).sort_index()
+        self.sites = sites
+
+        distances, rows = self.stations.nearest(sites["Latitude"], sites["Longitude"], k)
+        station_ids = self.stations.stations["STATIONS_ID"].to_numpy()[rows]
+        station_ids[distances > max_distance_km] = -1
+        self._site_pos = {site: i for i, site in enumerate(sites.index)}
+        self._station_ids = station_ids
+        self._distances = distances
+
+    def nearest_stations(self):
+        """
+        Candidate stations of every site, nearest first.
+
+        Returns:
+            pd.DataFrame: SITE, rank, STATIONS_ID, STATION, DISTANCE (km)
+        """
+        names = self.stations.stations.set_index("STATIONS_ID")["STATION"]
+        rows = []
+        for site, i in self._site_pos.items():
+            for rank, (station_id, distance) in enumerate(zip(self._station_ids[i], self._distances[i])):
+                if station_id >= 0:
+                    rows.append((site, rank, int(station_id), names[station_id], round(float(distance), 1)))
+        return pd.DataFrame(rows, columns=["SITE", "rank", "STATIONS_ID", "STATION", "DISTANCE"])
+
+    def lookup(self, sites, dates, columns=None):
+        """
+        Weather of the nearest station with data for every (site, date) pair.
+
+        Args:
+            sites (list): Site names
+            dates (list): Dates (anything pd.to_datetime() understands), one per site
+            columns (list, optional): DWD columns to return (None returns all)
+
+        Returns:
+            pd.DataFrame: SITE, STATION, DISTANCE, STATIONS_ID, MESS_DATUM and the weather columns, one
+                          row per pair in the given order (NaN where no station within reach has data)
+        """
+        columns = list(self.data.columns) if columns is None else list(columns)
+        unknown = sorted(set(sites) - set(self._site_pos))
+        if unknown:
+            raise KeyError(f"Sites without coordinates: {unknown}")
+        dates = pd.to_datetime(pd.Series(dates)).to_numpy().astype("datetime64[D]")
+        site_rows = np.array([self._site_pos[site] for site in sites], dtype=np.int64)
+        values = self.data[columns].to_numpy(np.float64)
+
+        # Try the candidate stations nearest first, filling the pairs that have no data yet
+        found = np.full(len(site_rows), -1, dtype=np.int64)
+        chosen = np.full(len(site_rows), -1, dtype=np.int64)
+        for rank in range(self._station_ids.shape[1]):
+            todo = np.flatnonzero(found < 0)
+            if todo.size == 0:
+                break
+            station_ids = self._station_ids[site_rows[todo], rank]
+            keys = pd.MultiIndex.from_arrays([station_ids, dates[todo].astype("datetime64[ns]")])
+            positions = self.data.index.get_indexer(keys)
+            has_data = (positions >= 0) & (station_ids >= 0)
+            has_data[has_data] = ~np.isnan(values[positions[has_data]]).all(axis=1)
+            found[todo[has_data]] = positions[has_data]
+            chosen[todo[has_data]] = rank
+
+        result = np.full((len(site_rows), len(columns)), np.nan)
+        result[found >= 0] = values[found[found >= 0]]
+        hit = found >= 0
+        station_ids = np.where(hit, self._station_ids[site_rows, np.maximum(chosen, 0)], -1)
+        names = self.stations.stations.set_index("STATIONS_ID")["STATION"]
+        table = pd.DataFrame({
+            "SITE": list(sites),
+            "STATION": [names[s] if s >= 0 else '' for s in station_ids],
+            "DISTANCE": np.where(hit, self._distances[site_rows, np.maximum(chosen, 0)].round(1), np.nan),
+            "STATIONS_ID": pd.Series(station_ids).where(hit).astype("Int32"),
+            "MESS_DATUM": dates,
+        })
+        return pd.concat([table, pd.DataFrame(result, columns=columns)], axis=1)
+
+
+def main():
+    # Weather of every sampled (site, date) pair of the field data, like dwd_weather_data.csv
+    data = load_dwd_daily(weather_folder)
+    if STATION_LIST_PATH:
+        stations = read_station_list(STATION_LIST_PATH)
+    else:
+        stations = find_station_files(weather_folder)
+    sites = read_sites(field_weather_csv)
+    index = WeatherIndex(data, stations, sites)
+    print(index.nearest_stations().to_string(index=False))
+
+    pairs = pd.read_csv(field_weather_csv)[["SITE", "date"]].drop_duplicates()
+    columns = [column for column in data.columns if column not in ["STATIONS_ID", "MESS_DATUM"] + DROP_COLUMNS]
+    weather = index.lookup(pairs["SITE"].tolist(), pairs["date"].tolist(), columns)
+    weather["MESS_DATUM"] = pd.to_datetime(weather["MESS_DATUM"]).dt.strftime("%Y%m%d")
+    missing = weather["STATION"] == ''
+    if missing.any():
+        print(f"No station data for {int(missing.sum())} site days: "
+              f"{weather.loc[missing, ['SITE', 'MESS_DATUM']].values.tolist()}")
+    weather.to_csv(output_csv, index=False, float_format="%.6g")
+    print(f"Saved {output_csv}")
+
+
+if __name__ == "__main__":
+    main()
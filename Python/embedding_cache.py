@@ -0,0 +1,181 @@
+# persistent store for BioClip image embeddings, keyed by the hash of the image file content
+# re-running a classification with other target families or another rank then only needs
+# a matrix multiply over the stored vectors, no image decoding and no model forward pass
+
+import os
+import json
+import hashlib
+import numpy as np
+
+INDEX_FILE = "index.txt"
+META_FILE = "meta.json"
+
+
+def file_hash(file_path, chunk_size=1 << 20):
+    """
+    Hash the content of a file.
+
+    Args:
+        file_path (str): Path to the file
+        chunk_size (int): Number of bytes read at a time
+
+    Returns:
+        str: Hex digest of the file content
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def bytes_hash(data):
+    """
+    Hash file content that was already read into memory, same digest as file_hash().
+
+    Args:
+        data (bytes): File content
+
+    Returns:
+        str: Hex digest of the content
+    """
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    On-disk embedding store made of memory-mapped NumPy shards plus a text index.
+
+    Every flush writes the new embeddings as one shard_XXXXX.npy file and appends
+    one "hash shard row" line per embedding to index.txt, so the store is
+    append-only and an interrupted run loses at most the unflushed embeddings.
+    Vectors are stored as float16 to halve the disk space.
+    """
+
+    def __init__(self, cache_dir, model_name, flush_every=1024, read_only=False):
+        """
+        Open (or create) an embedding cache.
+
+        Args:
+            cache_dir (str): Folder holding the shards and the index
+            model_name (str): Name of the model the embeddings come from, a cache
+                              built with another model is refused
+            flush_every (int): Number of new embeddings kept in memory before
+                               they are written as a new shard
+            read_only (bool): Only look up embeddings, new ones are not stored.
+                              Used by parallel worker processes, only one
+                              process may write to a cache at a time
+        """
+        self.cache_dir = cache_dir
+        self.flush_every = flush_every
+        self.read_only = read_only
+        if not read_only:
+            os.makedirs(cache_dir, exist_ok=True)
+
+        meta_path = os.path.join(cache_dir, META_FILE)
+        if os.path.exists(meta_path):
+            with open(meta_path, 'r') as f:
+                meta = json.load(f)
+            if meta.get("model") != model_name:
+                raise ValueError(f"Embedding cache {cache_dir} was built with model {meta.get('model')}, not {model_name}")
+        elif not read_only:
+            with open(meta_path, 'w') as f:
+                json.dump({"model": model_name}, f)
+
+        # hash -> (shard number, row in shard)
+        self.index = {}
+        self.shard_count = 0
+        index_path = os.path.join(cache_dir, INDEX_FILE)
+        if os.path.exists(index_path):
+            with open(index_path, 'r') as f:
+                for line in f:
+                    parts = line.split()
+                    if len(parts) != 3:
+                        continue  # partially written line from an interrupted flush
+                    shard, row = int(parts[1]), int(parts[2])
+                    self.index[parts[0]] = (shard, row)
+                    self.shard_count = max(self.shard_count, shard + 1)
+
+        self._shards = {}
+        self._pending_hashes = []
+        self._pending_vectors = []
+        self._pending_lookup = {}
+
+    def __len__(self):
+        return len(self.index) + len(self._pending_hashes)
+
+    def __contains__(self, content_hash):
+        return content_hash in self.index or content_hash in self._pending_lookup
+
+    def _shard_path(self, shard):
+        return os.path.join(self.cache_dir, f"shard_{shard:05d}.npy")
+
+    def _load_shard(self, shard):
+        if shard not in self._shards:
+            self._shards[shard] = np.load(self._shard_path(shard), mmap_mode='r')
+        return self._shards[shard]
+
+    def get(self, content_hashes):
+        """
+        Look up stored embeddings.
+
+        Args:
+            content_hashes (list): Hashes as returned by file_hash()
+
+        Returns:
+            np.ndarray: float32 array with one row per hash
+        """
+        rows = []
+        for content_hash in content_hashes:
+            if content_hash in self._pending_lookup:
+                rows.append(self._pending_vectors[self._pending_lookup[content_hash]])
+            else:
+                shard, row = self.index[content_hash]
+                rows.append(self._load_shard(shard)[row])
+        return np.asarray(rows, dtype=np.float32)
+
+    def add(self, content_hashes, embeddings):
+        """
+        Add new embeddings to the cache. They are written to disk on flush().
+
+        Args:
+            content_hashes (list): Hashes of the images
+            embeddings (np.ndarray): One embedding per hash
+        """
+        if self.read_only:
+            return
+        for content_hash, embedding in zip(content_hashes, embeddings):
+            if content_hash in self:
+                continue
+            self._pending_lookup[content_hash] = len(self._pending_vectors)
+            self._pending_hashes.append(content_hash)
+            self._pending_vectors.append(np.asarray(embedding, dtype=np.float16))
+
+        if len(self._pending_hashes) >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        """
+        Write the pending embeddings as a new shard and append them to the index.
+        """
+        if not self._pending_hashes:
+            return
+
+        shard = self.shard_count
+        # Write the shard under a temporary name first so the index never points to a half-written file
+        tmp_path = self._shard_path(shard) + ".tmp"
+        with open(tmp_path, 'wb') as f:
+            np.save(f, np.stack(self._pending_vectors))
+        os.replace(tmp_path, self._shard_path(shard))
+
+        with open(os.path.join(self.cache_dir, INDEX_FILE), 'a') as f:
+            for row, content_hash in enumerate(self._pending_hashes):
+                f.write(f"{content_hash} {shard} {row}\n")
+                self.index[content_hash] = (shard, row)
+            f.flush()
+            os.fsync(f.fileno())
+
+        self.shard_count += 1
+        self._pending_hashes = []
+        self._pending_vectors = []
+        self._pending_lookup = {}
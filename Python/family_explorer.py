@@ -1,5 +1,58 @@
 import pandas as pd
 import os
+import csv
+import json
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from taxonomy_index import build_taxonomy_index, save_taxonomy_index, TAXONOMY_INDEX_NAME
+
+# Only these columns of the GBIF occurrence downloads are read
+TAXONOMY_COLUMNS = ['class', 'order', 'family']
+
+# Occurrences per row of a GBIF species list download, without it every row counts once
+OCCURRENCE_COLUMN = 'numberOfOccurrences'
+
+# Rows read at once, keeps the memory bounded for multi-GB downloads
+CHUNK_SIZE = 200_000
+
+# Number of files processed in parallel
+NUM_WORKERS = min(4, os.cpu_count() or 1)
+
+# Per-file results, reused while the size and modification time of a file do not change
+CACHE_NAME = "family_cache.json"
+CACHE_VERSION = 2
+
+def extract_taxonomy(file_path, chunk_size=CHUNK_SIZE):
+    """
+    Count the occurrences per taxon in a GBIF download, reading it in chunks.
+
+    Species list downloads have one row per species with its numberOfOccurrences, these are
+    summed. Downloads without that column (occurrence downloads) count one occurrence per row.
+
+    Args:
+        file_path (str): Path to the tab-separated GBIF file
+        chunk_size (int): Number of rows read at once
+
+    Returns:
+        Counter: (class, order, family) -> number of occurrences with a family
+    """
+    counts = Counter()
+    read_columns = TAXONOMY_COLUMNS + [OCCURRENCE_COLUMN]
+    # GBIF downloads are tab-separated without quoting, a stray quote must not swallow the following rows
+    chunks = pd.read_csv(file_path, sep='\t', usecols=lambda column: column in read_columns, dtype=str,
+                         quoting=csv.QUOTE_NONE, chunksize=chunk_size, on_bad_lines='skip')
+    for chunk in chunks:
+        if 'family' not in chunk.columns:
+            raise ValueError(f"{file_path} has no family column")
+        if OCCURRENCE_COLUMN in chunk.columns:
+            occurrences = pd.to_numeric(chunk[OCCURRENCE_COLUMN], errors='coerce').fillna(0).astype('int64')
+        else:
+            occurrences = pd.Series(1, index=chunk.index)
+        chunk = chunk.reindex(columns=TAXONOMY_COLUMNS).assign(occurrences=occurrences)
+        chunk = chunk.dropna(subset=['family']).fillna('')
+        sums = chunk.groupby(TAXONOMY_COLUMNS, sort=False)['occurrences'].sum()
+        counts.update({taxon: int(count) for taxon, count in sums.items()})
+    return counts
 
 def extract_families(file_path):
     """
@@ -12,33 +65,77 @@ def extract_families(file_path):
         list: Sorted list of unique family names
     """
     try:
-        # Read CSV file
-        df = pd.read_csv(file_path, sep='\t')
-        
-        # Extract unique families, remove NaN values and sort
-        families = sorted(df['family'].dropna().unique())
-        
-        return families
+        return sorted({family for _, _, family in extract_taxonomy(file_path)})
     
     except Exception as e:
         print(f"Error processing file: {e}")
         return []
 
+def _file_key(file_path):
+    stat = os.stat(file_path)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "version": CACHE_VERSION}
+
+def _extract_for_cache(file_path):
+    # Worker process: taxon counts of one file as JSON-friendly rows, None on errors
+    try:
+        return [list(taxon) + [count] for taxon, count in extract_taxonomy(file_path).items()]
+    except Exception as e:
+        print(f"Error processing file {os.path.basename(file_path)}: {e}")
+        return None
+
+def load_taxonomy_counts(data_dir, file_names, num_workers=NUM_WORKERS):
+    """
+    Taxon counts of every file, read from the cache or extracted in parallel.
+
+    Args:
+        data_dir (str): Directory of the GBIF files and the cache
+        file_names (list): GBIF files to process
+        num_workers (int): Number of worker processes
+
+    Returns:
+        dict: File name -> Counter of (class, order, family) occurrences
+    """
+    cache_path = os.path.join(data_dir, CACHE_NAME)
+    cache = {}
+    if os.path.exists(cache_path):
+        with open(cache_path, 'r', encoding='utf-8') as f:
+            cache = json.load(f)
+
+    keys = {name: _file_key(os.path.join(data_dir, name)) for name in file_names}
+    stale = [name for name in file_names if cache.get(name, {}).get("key") != keys[name]]
+    print(f"{len(file_names) - len(stale)} of {len(file_names)} files unchanged since the last run")
+
+    if stale:
+        with ProcessPoolExecutor(max_workers=max(1, min(num_workers, len(stale)))) as executor:
+            paths = [os.path.join(data_dir, name) for name in stale]
+            for name, rows in zip(stale, executor.map(_extract_for_cache, paths)):
+                if rows is not None:
+                    cache[name] = {"key": keys[name], "taxa": rows}
+        # Forget files that are gone, then write the cache next to the data
+        cache = {name: entry for name, entry in cache.items() if name in keys}
+        tmp_path = cache_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(cache, f)
+        os.replace(tmp_path, cache_path)
+
+    return {name: Counter({tuple(row[:-1]): row[-1] for row in cache[name]["taxa"]})
+            for name in file_names if name in cache}
+
 def main():
     # Directory containing GBIF data files
     data_dir = os.path.join(os.path.dirname(__file__), "MadHornet")
     
     # Find all CSV files in the directory
-    csv_files = [f for f in os.listdir(data_dir) if f.endswith('.csv')]
+    csv_files = sorted(f for f in os.listdir(data_dir) if f.endswith('.csv'))
     
     all_families = set()
     
-    # Process each CSV file
+    # Process the files in parallel, unchanged files come from the cache
+    file_counts = load_taxonomy_counts(data_dir, csv_files)
     for csv_file in csv_files:
-        file_path = os.path.join(data_dir, csv_file)
         print(f"\nProcessing: {csv_file}")
         
-        families = extract_families(file_path)
+        families = {family for _, _, family in file_counts.get(csv_file, {})}
         all_families.update(families)
         
         print(f"Found {len(families)} families in this file")
@@ -59,6 +156,12 @@ def main():
         f.write("\n".join(all_families))
     
     print(f"\nResults have been saved to {output_file}")
+    
+    # Family -> order -> class index with the occurrences per download (region) for the classifiers
+    index_file = os.path.join(data_dir, TAXONOMY_INDEX_NAME)
+    region_counts = {os.path.splitext(name)[0]: counts for name, counts in file_counts.items()}
+    save_taxonomy_index(build_taxonomy_index(region_counts), index_file)
+    print(f"Taxonomy index has been saved to {index_file}")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,98 @@
+# background image prefetching for the review tools
+# the images after the current one are opened, decoded and resized on a worker thread and kept in a
+# small LRU cache, so showing the next image does not wait on the disk or the JPEG decoder. Only the
+# ready PIL images are prepared in the background: Tk objects like ImageTk.PhotoImage have to be created
+# on the Tk main thread, which takes about a millisecond for a 500x500 image.
+
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+
+
+def load_display_image(image_path, size=(500, 500)):
+    """
+    Open an image and resize it for display.
+
+    JPEGs are decoded at reduced resolution if they are much larger than the display size.
+    """
+    img = Image.open(image_path)
+    if img.format == "JPEG":
+        img.draft("RGB", size)
+    return img.convert("RGB").resize(size)
+
+
+class ImagePrefetcher:
+    """
+    Bounded LRU cache of display-ready images, filled ahead of the reviewer by a worker thread.
+    """
+
+    def __init__(self, loader=load_display_image, ahead=8, capacity=32, num_threads=1):
+        """
+        Args:
+            loader (function): image path -> ready image, e.g. load_display_image
+            ahead (int): Number of upcoming images decoded in the background
+            capacity (int): Maximum number of images kept in memory (at least ahead + 1)
+            num_threads (int): Number of decoding threads
+        """
+        self.loader = loader
+        self.ahead = ahead
+        self.capacity = max(capacity, ahead + 1)
+        self._cache = OrderedDict()
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=num_threads)
+
+    def _load(self, image_path):
+        try:
+            img = self.loader(image_path)
+        except Exception:
+            # get() raises the error again if the image is actually shown
+            with self._lock:
+                self._pending.pop(image_path, None)
+            raise
+        with self._lock:
+            self._pending.pop(image_path, None)
+            self._store(image_path, img)
+        return img
+
+    def _store(self, image_path, img):
+        # Called with the lock held, drops the least recently used images
+        self._cache[image_path] = img
+        self._cache.move_to_end(image_path)
+        while len(self._cache) > self.capacity:
+            self._cache.popitem(last=False)
+
+    def get(self, image_path):
+        """
+        Ready image of image_path, waiting for it if it is still being decoded (or decoding it now).
+        """
+        with self._lock:
+            if image_path in self._cache:
+                self._cache.move_to_end(image_path)
+                return self._cache[image_path]
+            future = self._pending.get(image_path)
+        if future is not None:
+            return future.result()
+        img = self.loader(image_path)
+        with self._lock:
+            self._store(image_path, img)
+        return img
+
+    def prefetch(self, image_paths):
+        """
+        Decode the next images in the background, the first ones first.
+
+        Args:
+            image_paths (list): Upcoming image paths, only the first `ahead` are prefetched
+        """
+        with self._lock:
+            for image_path in image_paths[:self.ahead]:
+                if image_path not in self._cache and image_path not in self._pending:
+                    self._pending[image_path] = self._executor.submit(self._load, image_path)
+
+    def close(self):
+        """
+        Stop the worker thread, skipping the images not started yet.
+        """
+        self._executor.shutdown(wait=False, cancel_futures=True)
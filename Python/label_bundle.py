@@ -0,0 +1,221 @@
+# restricted vocabulary for the BioClip classifiers
+# instead of scoring every image against the full Tree-of-Life label set, the images are scored against
+# the species of the target families plus an explicit "other" bucket (one centroid per class of the
+# remaining species). The reduced label matrix is saved as a label bundle and reused by later runs: a
+# BundleClassifier reads it in place of the full label set, which is then never loaded.
+
+import os
+import json
+import numpy as np
+import torch
+import torch.nn.functional as F
+from bioclip import TreeOfLifeClassifier, Rank
+
+# Name used for every rank below the bucket rank of the "other" labels
+OTHER_LABEL = "other"
+BUNDLE_VERSION = 2
+
+
+def build_label_bundle(classifier, target_families, other_rank=Rank.CLASS):
+    """
+    Build the reduced label matrix for a list of target families.
+
+    Species of the target families keep their own text embedding. All other
+    species are merged into one normalized centroid per taxon at other_rank
+    (e.g. "Insecta, other family"), so images of non-target taxa still have
+    somewhere to go instead of being forced into a target family.
+
+    Args:
+        classifier (TreeOfLifeClassifier): Initialized BioClip classifier
+        target_families (list): Families to keep at species resolution
+        other_rank (Rank): Rank at which the remaining species are bucketed
+
+    Returns:
+        dict: Bundle with "embeddings" (dim x labels float32 array), "names"
+              (label names in the classifier.txt_names format) and "meta" (including
+              the families of the full label set, to validate target families later)
+    """
+    target_set = set(target_families)
+    family_idx = Rank.FAMILY.value
+    txt_embeddings = classifier.txt_embeddings.float().cpu()
+
+    keep_idx = []
+    other_groups = {}
+    all_families = set()
+    for idx, name_ary in enumerate(classifier.txt_names):
+        taxon = name_ary[0]
+        all_families.add(taxon[family_idx])
+        if taxon[family_idx] in target_set:
+            keep_idx.append(idx)
+        else:
+            other_groups.setdefault(tuple(taxon[:other_rank.value + 1]), []).append(idx)
+
+    columns = [txt_embeddings[:, keep_idx]]
+    names = [classifier.txt_names[idx] for idx in keep_idx]
+    for group, idx in other_groups.items():
+        centroid = F.normalize(txt_embeddings[:, idx].mean(dim=1), dim=0)
+        columns.append(centroid.unsqueeze(1))
+        taxon = list(group) + [OTHER_LABEL] * (len(classifier.txt_names[0][0]) - len(group))
+        names.append([taxon, OTHER_LABEL])
+
+    meta = {
+        "version": BUNDLE_VERSION,
+        "model": classifier.model_str,
+        "target_families": sorted(target_set),
+        "other_rank": other_rank.name,
+        "known_families": sorted(all_families),
+    }
+    return {"embeddings": torch.cat(columns, dim=1).numpy(), "names": names, "meta": meta}
+
+
+def save_label_bundle(bundle, bundle_path):
+    """
+    Save a label bundle as a single .npz file.
+    """
+    with open(bundle_path, 'wb') as f:
+        np.savez(f, embeddings=bundle["embeddings"], names=json.dumps(bundle["names"]),
+                 meta=json.dumps(bundle["meta"]))
+
+
+def load_label_bundle(bundle_path):
+    """
+    Load a label bundle saved with save_label_bundle().
+
+    Returns:
+        dict: Bundle with "embeddings", "names" and "meta"
+    """
+    with np.load(bundle_path) as data:
+        return {
+            "embeddings": data["embeddings"],
+            "names": json.loads(str(data["names"])),
+            "meta": json.loads(str(data["meta"])),
+        }
+
+
+class BundleClassifier(TreeOfLifeClassifier):
+    """
+    TreeOfLifeClassifier whose labels are a saved label bundle.
+
+    The bundle replaces the full Tree-of-Life label set in get_txt_emb() and
+    get_txt_names(), so the full label matrix and names are never loaded.
+    """
+
+    def __init__(self, bundle, **kwargs):
+        """
+        Args:
+            bundle (dict): Label bundle from load_label_bundle()
+            **kwargs: Passed to TreeOfLifeClassifier, e.g. device
+        """
+        self.bundle = bundle
+        # TreeOfLifeClassifier.__init__ calls get_txt_emb() and get_txt_names() below
+        super().__init__(**kwargs)
+
+    def get_txt_emb(self):
+        return torch.from_numpy(self.bundle["embeddings"])
+
+    def get_txt_names(self):
+        return self.bundle["names"]
+
+    def known_taxa(self, rank):
+        """
+        Set of all family names of the full label set, stored in the bundle.
+        """
+        if rank != Rank.FAMILY:
+            raise ValueError("A label bundle only stores the families of the full label set")
+        return set(self.bundle["meta"]["known_families"])
+
+    def load_full_labels(self):
+        """
+        Load the full label set after all, e.g. to rebuild a bundle for other target families.
+        """
+        self.txt_embeddings = TreeOfLifeClassifier.get_txt_emb(self).to(self.device)
+        self.txt_names = TreeOfLifeClassifier.get_txt_names(self)
+
+
+def load_bundle_classifier(bundle_path, **kwargs):
+    """
+    Create a BundleClassifier from a saved label bundle.
+
+    Returns:
+        BundleClassifier: Classifier with the bundle labels, or None if there is no
+                          bundle of this version (the full label set is needed to build it)
+    """
+    if not os.path.exists(bundle_path):
+        return None
+    bundle = load_label_bundle(bundle_path)
+    if bundle["meta"].get("version") != BUNDLE_VERSION:
+        return None
+    return BundleClassifier(bundle, **kwargs)
+
+
+def apply_label_bundle(classifier, bundle, release_full_labels=True):
+    """
+    Make the classifier score images against the label bundle only.
+
+    Uses the same subset attributes as classifier.apply_filter(), so both
+    classifier.predict() and the bioclip_utils functions see the reduced labels.
+
+    Args:
+        classifier (TreeOfLifeClassifier): Initialized BioClip classifier
+        bundle (dict): Label bundle
+        release_full_labels (bool): Drop the full Tree-of-Life embedding matrix to
+                                    free memory (apply_filter() can not be used afterwards)
+    """
+    embeddings = torch.from_numpy(bundle["embeddings"])
+    dtype = classifier.get_txt_embeddings().dtype
+    classifier._subset_txt_embeddings = embeddings.to(device=classifier.device, dtype=dtype)
+    classifier._subset_txt_names = bundle["names"]
+    if release_full_labels:
+        classifier.txt_embeddings = None
+
+
+def apply_restricted_vocabulary(classifier, target_families, bundle_path, other_rank=Rank.CLASS):
+    """
+    Load the label bundle for the target families, or build and save it on the first run, and apply it.
+
+    A saved bundle is only reused if it was built with the same model, the
+    same target families and the same other_rank. A BundleClassifier already
+    holding a matching bundle is left as it is.
+
+    Args:
+        classifier (TreeOfLifeClassifier): Initialized BioClip classifier
+        target_families (list): Families to keep at species resolution
+        bundle_path (str): Path of the .npz label bundle
+        other_rank (Rank): Rank at which the remaining species are bucketed
+
+    Returns:
+        dict: The applied label bundle
+    """
+    expected_meta = {
+        "version": BUNDLE_VERSION,
+        "model": classifier.model_str,
+        "target_families": sorted(set(target_families)),
+        "other_rank": other_rank.name,
+    }
+
+    def matches(bundle):
+        return {key: bundle["meta"].get(key) for key in expected_meta} == expected_meta
+
+    bundle = None
+    if isinstance(classifier, BundleClassifier):
+        if matches(classifier.bundle):
+            print(f"Restricted vocabulary: {len(classifier.bundle['names'])} labels from {bundle_path}")
+            return classifier.bundle
+        print(f"Label bundle {bundle_path} was built for other settings, loading the full label set to rebuild it")
+        classifier.load_full_labels()
+    elif os.path.exists(bundle_path):
+        bundle = load_label_bundle(bundle_path)
+        if not matches(bundle):
+            print(f"Label bundle {bundle_path} was built for other settings, rebuilding it")
+            bundle = None
+
+    if bundle is None:
+        bundle = build_label_bundle(classifier, target_families, other_rank)
+        save_label_bundle(bundle, bundle_path)
+        print(f"Saved label bundle to {bundle_path}")
+
+    apply_label_bundle(classifier, bundle)
+    if isinstance(classifier, BundleClassifier):
+        classifier.bundle = bundle
+    print(f"Restricted vocabulary: {len(bundle['names'])} labels instead of {len(classifier.txt_names)}")
+    return bundle
@@ -0,0 +1,257 @@
+# multi-radius, multi-site landscape composition from the CORINE raster
+# computes the land cover around every site for several buffer radii at once: the raster window around
+# each site is read for the largest radius only (sites close to each other share one read), and all
+# smaller radii are circles inside the same window. Per site and radius the class areas, the
+# corine_data.csv groups (percent of the buffer area inside the raster, majority class) and optionally
+# the Shannon diversity of the classes and the edge density are computed. Requires rasterio (and fiona
+# for point layers), see corine_zonal.py
+
+import os
+import csv
+import math
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from corine_zonal import class_areas, _require_rasterio
+
+# CORINE raster classes of the corine_data.csv groups
+LANDCOVER_GROUPS = {
+    "agri": [12],                # non-irrigated arable land
+    "grass": [18, 26],           # pastures, natural grasslands
+    "snh": [29],                 # transitional woodland-shrub (semi-natural habitat)
+    "forest": [23, 24],          # broad-leaved and coniferous forest
+    "urban": [1, 2, 3, 11],      # urban fabric, industrial units, sport and leisure facilities
+    "water": [35],               # inland marshes
+}
+
+# Sub-pixels per pixel side used for the buffer edges, like corine_zonal.SUPERSAMPLE
+SUPERSAMPLE = 8
+
+# Sites whose windows are closer than this many pixels are read together
+MERGE_GAP_PIXELS = 50
+
+NUM_WORKERS = min(4, os.cpu_count() or 1)
+
+
+def read_sites(sites_path, dst_crs, name_field="SITE", lat_field="Latitude", lon_field="Longitude"):
+    """
+    Read the site points in the raster CRS.
+
+    Args:
+        sites_path (str): CSV with one or more lat/lon rows per site (e.g. field_weather_data.csv,
+                          the mean position of the rows of a site is used) or a point layer
+        dst_crs: Raster CRS
+        name_field (str): Column or attribute holding the site name
+        lat_field (str): Latitude column of a CSV (WGS84)
+        lon_field (str): Longitude column of a CSV (WGS84)
+
+    Returns:
+        list: (site name, x, y) per site
+    """
+    rasterio, fiona = _require_rasterio()
+    from rasterio.warp import transform
+    if sites_path.lower().endswith(".csv"):
+        points = pd.read_csv(sites_path).groupby(name_field)[[lon_field, lat_field]].mean()
+        xs, ys = transform("EPSG:4326", dst_crs, points[lon_field].tolist(), points[lat_field].tolist())
+        return list(zip(points.index, xs, ys))
+
+    sites = []
+    with fiona.open(sites_path) as layer:
+        for feature in layer:
+            x, y = feature["geometry"]["coordinates"][:2]
+            if layer.crs and layer.crs != dst_crs:
+                (x,), (y,) = transform(layer.crs, dst_crs, [x], [y])
+            sites.append((feature["properties"][name_field], x, y))
+    return sites
+
+
+def site_windows(sites, transform, shape, max_radius):
+    """
+    Group the sites into raster windows that are read at once.
+
+    Returns:
+        list: ((row_start, row_stop, col_start, col_stop), [sites]) per read, clipped to the raster
+    """
+    inverse = ~transform
+    boxes = []
+    for site in sites:
+        _, x, y = site
+        col_min, row_min = inverse * (x - max_radius, y + max_radius)
+        col_max, row_max = inverse * (x + max_radius, y - max_radius)
+        boxes.append([math.floor(row_min), math.ceil(row_max), math.floor(col_min), math.ceil(col_max), [site]])
+
+    # Merge windows that overlap or nearly touch, until no two windows are close anymore
+    merged = True
+    while merged:
+        merged = False
+        boxes.sort(key=lambda b: (b[0], b[2]))
+        result = []
+        for box in boxes:
+            for other in result:
+                if (box[0] <= other[1] + MERGE_GAP_PIXELS and other[0] <= box[1] + MERGE_GAP_PIXELS
+                        and box[2] <= other[3] + MERGE_GAP_PIXELS and other[2] <= box[3] + MERGE_GAP_PIXELS):
+                    other[:4] = [min(box[0], other[0]), max(box[1], other[1]),
+                                 min(box[2], other[2]), max(box[3], other[3])]
+                    other[4].extend(box[4])
+                    merged = True
+                    break
+            else:
+                result.append(box)
+        boxes = result
+
+    rows, cols = shape
+    return [((max(b[0], 0), min(b[1], rows), max(b[2], 0), min(b[3], cols)), b[4]) for b in boxes
+            if b[0] < rows and b[1] > 0 and b[2] < cols and b[3] > 0]
+
+
+def edge_density(data, inside, cell_size, area_m2, nodata=None):
+    """
+    Length of the borders between different classes inside the buffer per hectare (m/ha).
+
+    Only borders between two pixels inside the buffer count, not the buffer outline.
+    """
+    inside = inside if nodata is None else inside & (data != nodata)
+    horizontal = (data[:, 1:] != data[:, :-1]) & inside[:, 1:] & inside[:, :-1]
+    vertical = (data[1:, :] != data[:-1, :]) & inside[1:, :] & inside[:-1, :]
+    return (horizontal.sum() + vertical.sum()) * cell_size / (area_m2 / 10_000)
+
+
+def shannon_diversity(areas):
+    """
+    Shannon diversity index of the class areas, -sum(p * ln p).
+    """
+    total = sum(areas.values())
+    if total <= 0:
+        return 0.0
+    proportions = np.array([area / total for area in areas.values() if area > 0])
+    return float(-(proportions * np.log(proportions)).sum())
+
+
+def _window_metrics(raster_path, window, sites, radii, supersample, extra_metrics):
+    # Worker: read one window and compute every site and radius inside it
+    rasterio, _ = _require_rasterio()
+    row_start, row_stop, col_start, col_stop = window
+    with rasterio.open(raster_path) as src:
+        data = src.read(1, window=((row_start, row_stop), (col_start, col_stop)))
+        transform, nodata = src.transform, src.nodata
+    cell_size = abs(transform.a)
+    cell_area = abs(transform.a * transform.e)
+    inverse = ~transform
+    offsets = (np.arange(supersample) + 0.5) / supersample
+
+    results = []
+    for site_name, x, y in sites:
+        # Part of the window covered by the largest buffer of this site
+        col_min, row_min = inverse * (x - radii[-1], y + radii[-1])
+        col_max, row_max = inverse * (x + radii[-1], y - radii[-1])
+        r0, r1 = max(math.floor(row_min), row_start), min(math.ceil(row_max), row_stop)
+        c0, c1 = max(math.floor(col_min), col_start), min(math.ceil(col_max), col_stop)
+        site_data = data[r0 - row_start:r1 - row_start, c0 - col_start:c1 - col_start]
+        rows, cols = site_data.shape
+
+        # Squared distance of every sub-pixel center to the site, shared by all radii
+        xs = transform.c + ((c0 + np.arange(cols))[:, None] + offsets).ravel() * transform.a
+        ys = transform.f + ((r0 + np.arange(rows))[:, None] + offsets).ravel() * transform.e
+        squared_distance = (ys[:, None] - y) ** 2 + (xs[None, :] - x) ** 2
+
+        for radius in radii:
+            inside = (squared_distance <= radius ** 2).reshape(rows, supersample, cols, supersample)
+            coverage = inside.mean(axis=(1, 3), dtype=np.float32)
+            areas = class_areas(site_data, coverage, cell_area, nodata)
+            # Buffers at the raster edge are clipped, only the part inside the raster is measured
+            covered_area = float(coverage.sum(dtype=np.float64)) * cell_area
+            metrics = {"Site": site_name, "Radius_m": radius, "areas": areas, "covered_area": covered_area}
+            if extra_metrics:
+                metrics["shannon"] = shannon_diversity(areas)
+                metrics["edge_density"] = (edge_density(site_data, coverage >= 0.5, cell_size, covered_area, nodata)
+                                           if covered_area > 0 else 0.0)
+            results.append(metrics)
+    return results
+
+
+def landscape_metrics(raster_path, sites_path, radii, extra_metrics=False, num_workers=NUM_WORKERS,
+                      supersample=SUPERSAMPLE, **site_fields):
+    """
+    Land cover of every site for every buffer radius, reading each part of the raster once.
+
+    Args:
+        raster_path (str): CORINE raster (projected CRS in meters)
+        sites_path (str): Site points, see read_sites()
+        radii (list): Buffer radii in m, e.g. [250, 500, 1000, 2000]
+        extra_metrics (bool): Also compute the Shannon diversity and the edge density
+        num_workers (int): Number of worker processes
+        supersample (int): Sub-pixels per pixel side for the buffer edges
+        **site_fields: Column names passed to read_sites()
+
+    Returns:
+        list: One dict per site and radius with "Site", "Radius_m", "areas"
+              (land cover class -> m2), "covered_area" (m2 of the buffer inside
+              the raster) and optionally "shannon" and "edge_density"
+    """
+    rasterio, _ = _require_rasterio()
+    radii = sorted(radii)
+    with rasterio.open(raster_path) as src:
+        sites = read_sites(sites_path, src.crs, **site_fields)
+        windows = site_windows(sites, src.transform, (src.height, src.width), radii[-1])
+    print(f"{len(sites)} sites x {len(radii)} radii from {len(windows)} raster reads")
+
+    with ProcessPoolExecutor(max_workers=max(1, min(num_workers, len(windows)))) as executor:
+        futures = [executor.submit(_window_metrics, raster_path, window, window_sites, radii, supersample,
+                                   extra_metrics)
+                   for window, window_sites in windows]
+        results = [metrics for future in futures for metrics in future.result()]
+    return sorted(results, key=lambda m: (m["Radius_m"], str(m["Site"])))
+
+
+def composition_table(results, groups=LANDCOVER_GROUPS):
+    """
+    corine_data.csv-style table: percent of the buffer area per group and the majority group.
+
+    The percentages refer to the part of the buffer inside the raster. Buffers
+    clipped by the raster edge have a buffer_coverage below 100.
+
+    Returns:
+        pd.DataFrame: Site, Radius_m, one column per group, majority_class, buffer_coverage
+                      (percent of the buffer inside the raster, plus shannon and edge_density if computed)
+    """
+    rows = []
+    for metrics in results:
+        covered_area = metrics["covered_area"]
+        row = {"Site": metrics["Site"], "Radius_m": metrics["Radius_m"]}
+        for group, classes in groups.items():
+            group_area = sum(metrics["areas"].get(c, 0.0) for c in classes)
+            row[group] = round(100 * group_area / covered_area, 3) if covered_area > 0 else 0.0
+        row["majority_class"] = max(groups, key=lambda group: row[group])
+        row["buffer_coverage"] = round(100 * covered_area / (math.pi * metrics["Radius_m"] ** 2), 1)
+        for extra in ("shannon", "edge_density"):
+            if extra in metrics:
+                row[extra] = round(metrics[extra], 3)
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+
+def write_area_table(results, output_csv, valid_categories=None):
+    """
+    Long table of the class areas like corine_area_by_buffer.csv, with the radius added.
+    """
+    with open(output_csv, 'w', newline='') as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow(["Buffer", "Radius_m", "LandCover", "Area_m2"])
+        for metrics in results:
+            for land_cover, area in sorted(metrics["areas"].items()):
+                if valid_categories is None or land_cover in valid_categories:
+                    writer.writerow([metrics["Site"], metrics["Radius_m"], land_cover, area])
+
+
+def write_composition_tables(table, output_pattern):
+    """
+    Write one corine_data.csv-style file per radius.
+
+    Args:
+        table (pd.DataFrame): From composition_table()
+        output_pattern (str): Output path with a {radius} field, e.g. "corine_data_{radius}m.csv"
+    """
+    for radius, radius_table in table.groupby("Radius_m"):
+        output_csv = output_pattern.format(radius=radius)
+        radius_table.drop(columns="Radius_m").to_csv(output_csv, index=False, quoting=csv.QUOTE_NONNUMERIC)
+        print(f"Saved {output_csv}")
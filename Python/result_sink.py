@@ -0,0 +1,130 @@
+# optional columnar output for the classification scripts
+# writes the results in row groups to Parquet (or Arrow IPC) files, including the top-k family and order
+# predictions with their scores, so the R notebooks can load only the columns they need
+# requires pyarrow (pip install pyarrow), the CSV output does not
+
+import os
+import time
+import numpy as np
+import pandas as pd
+
+OUTPUT_FORMATS = {"parquet": ".parquet", "arrow": ".arrow"}
+
+
+def topk_columns(rank_predictions, ranks, k):
+    """
+    Spread the top-k predictions of each rank over numeric and name columns.
+
+    Args:
+        rank_predictions (list): One dict per image mapping each rank to its
+                                 predictions, as yielded by iter_rank_predictions()
+        ranks (list): Ranks to export, e.g. [Rank.FAMILY, Rank.ORDER]
+        k (int): Number of predictions per rank
+
+    Returns:
+        dict: Column name -> list of values, e.g. "Family_top2" and
+              "Family_score_top2" (None / NaN where fewer than k predictions exist)
+    """
+    columns = {}
+    for rank in ranks:
+        label = rank.get_label()
+        title = label.capitalize()
+        for i in range(k):
+            names = []
+            scores = []
+            for predictions in rank_predictions:
+                rank_preds = predictions.get(rank, [])
+                if i < len(rank_preds):
+                    names.append(rank_preds[i][label])
+                    scores.append(rank_preds[i]["score"])
+                else:
+                    names.append(None)
+                    scores.append(np.nan)
+            columns[f"{title}_top{i + 1}"] = names
+            columns[f"{title}_score_top{i + 1}"] = np.asarray(scores, dtype=np.float32)
+    return columns
+
+
+class ColumnarSink:
+    """
+    Buffer result batches and write them as row groups to a Parquet or Arrow IPC file.
+
+    Every run writes a new file into the output folder (Parquet and Arrow files
+    can not be appended to), so the folder can be read as one dataset, e.g.
+    with arrow::open_dataset() in R or pandas.read_parquet() on the folder.
+    """
+
+    def __init__(self, output_dir, part_name=None, output_format="parquet", row_group_size=10000):
+        """
+        Args:
+            output_dir (str): Dataset folder the file is written into
+            part_name (str, optional): File name without extension, defaults to run-<timestamp>
+            output_format (str): "parquet" or "arrow"
+            row_group_size (int): Number of rows buffered before a row group is written
+        """
+        try:
+            import pyarrow
+        except ImportError:
+            raise ImportError("The columnar output needs pyarrow, install it with: pip install pyarrow")
+        if output_format not in OUTPUT_FORMATS:
+            raise ValueError(f"Unknown output format {output_format}, use one of {', '.join(OUTPUT_FORMATS)}")
+
+        os.makedirs(output_dir, exist_ok=True)
+        part_name = part_name or time.strftime("run-%Y%m%d-%H%M%S")
+        self.path = os.path.join(output_dir, part_name + OUTPUT_FORMATS[output_format])
+        self.output_format = output_format
+        self.row_group_size = row_group_size
+        self._buffer = []
+        self._buffered_rows = 0
+        self._writer = None
+        self._schema = None
+        self.rows_written = 0
+
+    def write_batch(self, frame):
+        """
+        Add the rows of one batch.
+
+        Args:
+            frame (pd.DataFrame): Result rows, missing values as NaN / None
+        """
+        self._buffer.append(frame)
+        self._buffered_rows += len(frame)
+        if self._buffered_rows >= self.row_group_size:
+            self._write_row_group()
+
+    def _write_row_group(self):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        if not self._buffer:
+            return
+        frame = pd.concat(self._buffer, ignore_index=True)
+        self._buffer = []
+        self._buffered_rows = 0
+
+        if self._writer is None:
+            schema = pa.Table.from_pandas(frame, preserve_index=False).schema
+            # Columns that are empty in the first row group would be typed as null, assume text
+            for i, field in enumerate(schema):
+                if pa.types.is_null(field.type):
+                    schema = schema.set(i, field.with_type(pa.string()))
+            self._schema = schema.remove_metadata()
+            table = pa.Table.from_pandas(frame, schema=self._schema, preserve_index=False)
+            if self.output_format == "parquet":
+                self._writer = pq.ParquetWriter(self.path, self._schema)
+            else:
+                self._writer = pa.ipc.new_file(self.path, self._schema)
+        else:
+            table = pa.Table.from_pandas(frame, schema=self._schema, preserve_index=False)
+
+        self._writer.write_table(table)
+        self.rows_written += len(frame)
+
+    def close(self):
+        """
+        Write the remaining rows and close the file.
+        """
+        self._write_row_group()
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
@@ -0,0 +1,168 @@
+# checkpoint index for the BioClip CSV scripts
+# keeps track of the images found under the input folder and of the ones already written to the
+# output CSV in a small SQLite file, so a restart does not need to re-read the whole CSV and only
+# re-lists folders whose modification time changed since the last run
+
+import os
+import sqlite3
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+
+
+class ResumeIndex:
+    """
+    SQLite index of discovered and processed images.
+
+    Tables:
+        images: one row per image file (path, folder, file name, done flag)
+        dirs:   one row per scanned folder with its mtime and its subfolders
+    """
+
+    def __init__(self, db_path, timeout=5.0):
+        """
+        Open (or create) a resume index.
+
+        Args:
+            db_path (str): Path of the SQLite file, e.g. next to the output CSV
+            timeout (float): Seconds to wait for a lock held by another connection to the same file
+        """
+        self.db_path = db_path
+        self.is_new = not os.path.exists(db_path)
+        self.conn = sqlite3.connect(db_path, timeout=timeout)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS images (
+                path TEXT PRIMARY KEY,
+                dir TEXT NOT NULL,
+                name TEXT NOT NULL,
+                done INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE INDEX IF NOT EXISTS images_todo ON images(path) WHERE done = 0;
+            CREATE INDEX IF NOT EXISTS images_dir ON images(dir);
+            CREATE INDEX IF NOT EXISTS images_name ON images(name);
+            CREATE TABLE IF NOT EXISTS dirs (
+                path TEXT PRIMARY KEY,
+                mtime INTEGER NOT NULL,
+                subdirs TEXT NOT NULL
+            );
+        """)
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    def scan(self, root_folder, extensions=IMAGE_EXTENSIONS):
+        """
+        Add new images below root_folder to the index.
+
+        Folders whose mtime did not change since the last scan are not listed
+        again (adding or removing a file changes the mtime of its folder), only
+        their known subfolders are visited.
+
+        Args:
+            root_folder (str): Folder to scan recursively
+            extensions (tuple): Lower-case file extensions counted as images
+
+        Returns:
+            int: Number of images added to the index
+        """
+        known_dirs = {path: (mtime, subdirs) for path, mtime, subdirs
+                      in self.conn.execute("SELECT path, mtime, subdirs FROM dirs")}
+        added = 0
+
+        stack = [root_folder]
+        while stack:
+            folder = stack.pop()
+            try:
+                mtime = os.stat(folder).st_mtime_ns
+            except FileNotFoundError:
+                continue
+
+            known = known_dirs.get(folder)
+            if known is not None and known[0] == mtime:
+                stack.extend(p for p in known[1].split("\n") if p)
+                continue
+
+            files = []
+            subdirs = []
+            with os.scandir(folder) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(entry.path)
+                    elif entry.name.lower().endswith(extensions):
+                        files.append((entry.path, folder, entry.name))
+
+            cursor = self.conn.executemany("INSERT OR IGNORE INTO images (path, dir, name) VALUES (?, ?, ?)", files)
+            added += max(cursor.rowcount, 0)
+
+            if known is not None:
+                # Forget images and subfolders that disappeared but were never processed
+                current_files = {path for path, _, _ in files}
+                for (path,) in self.conn.execute("SELECT path FROM images WHERE dir = ? AND done = 0",
+                                                 (folder,)).fetchall():
+                    if path not in current_files:
+                        self.conn.execute("DELETE FROM images WHERE path = ?", (path,))
+                for old_subdir in set(p for p in known[1].split("\n") if p) - set(subdirs):
+                    prefix = old_subdir + os.sep
+                    self.conn.execute("DELETE FROM images WHERE done = 0 AND (dir = ? OR substr(dir, 1, ?) = ?)",
+                                      (old_subdir, len(prefix), prefix))
+                    self.conn.execute("DELETE FROM dirs WHERE path = ? OR substr(path, 1, ?) = ?",
+                                      (old_subdir, len(prefix), prefix))
+
+            self.conn.execute("INSERT OR REPLACE INTO dirs (path, mtime, subdirs) VALUES (?, ?, ?)",
+                              (folder, mtime, "\n".join(subdirs)))
+            stack.extend(subdirs)
+
+        self.conn.commit()
+        return added
+
+    def count(self, done=None):
+        """
+        Count indexed images.
+
+        Args:
+            done (bool, optional): Only count processed (True) or unprocessed (False) images
+
+        Returns:
+            int: Number of images
+        """
+        if done is None:
+            return self.conn.execute("SELECT COUNT(*) FROM images").fetchone()[0]
+        return self.conn.execute("SELECT COUNT(*) FROM images WHERE done = ?", (int(done),)).fetchone()[0]
+
+    def remaining(self):
+        """
+        Get the images that were not processed yet.
+
+        Returns:
+            list: Image paths, sorted so the processing order is reproducible
+        """
+        return [path for (path,) in self.conn.execute("SELECT path FROM images WHERE done = 0 ORDER BY path")]
+
+    def mark_done(self, image_paths):
+        """
+        Record images as processed. Call after their CSV rows were flushed.
+
+        Args:
+            image_paths (list): Paths of the processed images
+        """
+        self.conn.executemany("UPDATE images SET done = 1 WHERE path = ?", ((p,) for p in image_paths))
+        self.conn.commit()
+
+    def mark_done_by_name(self, image_names):
+        """
+        Record images as processed by file name, for CSVs that only store the file name.
+
+        Args:
+            image_names (iterable): File names of the processed images
+        """
+        self.conn.executemany("UPDATE images SET done = 1 WHERE name = ?", ((n,) for n in image_names))
+        self.conn.commit()
+
+    def reset_done(self):
+        """
+        Mark every image as unprocessed again, e.g. when the output CSV was deleted.
+        """
+        self.conn.execute("UPDATE images SET done = 0 WHERE done = 1")
+        self.conn.commit()
@@ -0,0 +1,162 @@
+# persistent review queue for verificator.py
+# the images to review are kept in a SQLite index that is refreshed incrementally (see resume_index.py:
+# only folders whose mtime changed are listed again), and the verdicts are stored in the same file. A
+# verdict and the "bookmark" (the image leaving the queue) are written in one transaction, buffered and
+# committed in batches. Every committed batch is appended to the results CSV right away (one write per
+# batch), so the CSV keeps its rows in review order and stays current if the tool is killed.
+
+import os
+import io
+import csv
+import time
+import zlib
+from resume_index import ResumeIndex, IMAGE_EXTENSIONS
+
+RESULT_HEADER = ["image_path", "predicted_class", "image_name", "verdict", "seconds"]
+
+
+def shard_of(image_path, num_shards):
+    """
+    Shard of an image, stable for the same path no matter which images are still in the queue.
+    """
+    return zlib.crc32(image_path.encode("utf-8", "surrogateescape")) % num_shards
+
+
+class ReviewIndex(ResumeIndex):
+    """
+    Resume index of the review queue plus the verdicts of the reviewers.
+
+    An image counts as done once it has a verdict. Additional table:
+        verdicts: one row per reviewed image (path, class, name, verdict, seconds, reviewer, time)
+    """
+
+    def __init__(self, db_path, reviewer="", flush_every=20, flush_seconds=30, results_csv=None):
+        """
+        Args:
+            db_path (str): Path of the SQLite file, shared by all reviewers
+            reviewer (str): Name stored with the verdicts of this session
+            flush_every (int): Commit after this many buffered verdicts
+            flush_seconds (float): Or when the oldest buffered verdict is this old
+            results_csv (str, optional): Results CSV every committed batch is appended to
+        """
+        # Wait for the other reviewer's commits instead of failing, already while the tables are set up
+        super().__init__(db_path, timeout=10)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS verdicts (
+                path TEXT PRIMARY KEY,
+                predicted_class TEXT NOT NULL,
+                name TEXT NOT NULL,
+                verdict TEXT NOT NULL,
+                seconds REAL NOT NULL,
+                reviewer TEXT NOT NULL,
+                reviewed_at REAL NOT NULL
+            )
+        """)
+        self.conn.commit()
+        self.reviewer = reviewer
+        self.results_csv = results_csv
+        self.flush_every = flush_every
+        self.flush_seconds = flush_seconds
+        self._buffer = []
+        self._buffer_start = None
+
+    def refresh(self, root_folders, skip_folder=None, extensions=IMAGE_EXTENSIONS):
+        """
+        Add new images below the given folders to the queue.
+
+        Args:
+            root_folders (list): Folders to scan, only changed folders are listed again
+            skip_folder (function, optional): folder name -> True to leave the folder out of the queue
+            extensions (tuple): Lower-case file extensions counted as images
+
+        Returns:
+            int: Number of images added
+        """
+        added = sum(self.scan(folder, extensions) for folder in root_folders if os.path.exists(folder))
+        if skip_folder is not None:
+            skipped = [(d,) for (d,) in self.conn.execute("SELECT DISTINCT dir FROM images WHERE done = 0")
+                       if skip_folder(os.path.basename(d))]
+            # Skipped folders stay in the dirs table, so they are not listed again
+            cursor = self.conn.executemany("DELETE FROM images WHERE dir = ? AND done = 0", skipped)
+            self.conn.commit()
+            added -= max(cursor.rowcount, 0)
+        return added
+
+    def queue(self, shard=0, num_shards=1):
+        """
+        Images of one shard still to review, in a reproducible order.
+
+        Returns:
+            list: (image path, predicted class, image name) per image, like get_image_list()
+        """
+        return [(path, os.path.basename(folder), name) for path, folder, name
+                in self.conn.execute("SELECT path, dir, name FROM images WHERE done = 0 ORDER BY path")
+                if num_shards == 1 or shard_of(path, num_shards) == shard]
+
+    def record(self, image_path, predicted_class, image_name, verdict, seconds):
+        """
+        Buffer the verdict of one image, committed with the next flush().
+        """
+        if not self._buffer:
+            self._buffer_start = time.time()
+        self._buffer.append((image_path, predicted_class, image_name, verdict, round(seconds, 2),
+                             self.reviewer, time.time()))
+        if len(self._buffer) >= self.flush_every or time.time() - self._buffer_start >= self.flush_seconds:
+            self.flush()
+
+    def flush(self):
+        """
+        Commit the buffered verdicts and remove their images from the queue in one transaction,
+        then append them to the results CSV.
+        """
+        if not self._buffer:
+            return
+        with self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO verdicts VALUES (?, ?, ?, ?, ?, ?, ?)", self._buffer)
+            self.conn.executemany("UPDATE images SET done = 1 WHERE path = ?", ((row[0],) for row in self._buffer))
+        if self.results_csv:
+            # One write per batch, so the rows of reviewers appending at the same time do not interleave
+            lines = io.StringIO()
+            csv.writer(lines).writerows(row[:len(RESULT_HEADER)] for row in self._buffer)
+            with open(self.results_csv, 'a', newline='') as f:
+                f.write(lines.getvalue())
+        self._buffer = []
+
+    def import_results(self, csv_path):
+        """
+        Load the verdicts of a results CSV written before the index existed.
+
+        Returns:
+            int: Number of imported verdicts
+        """
+        rows = []
+        with open(csv_path, 'r', newline='') as f:
+            for row in csv.reader(f):
+                if len(row) == len(RESULT_HEADER) and row != RESULT_HEADER:
+                    seconds = float(row[4]) if row[4] else 0.0
+                    rows.append((row[0], row[1], row[2], row[3], seconds, "", 0.0))
+        with self.conn:
+            self.conn.executemany("INSERT OR IGNORE INTO verdicts VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+            self.conn.executemany("UPDATE images SET done = 1 WHERE path = ?", ((row[0],) for row in rows))
+        return len(rows)
+
+    def export_results(self, csv_path):
+        """
+        Write the verdicts of all reviewers to a new results CSV, e.g. to rebuild a lost one.
+
+        Rows are written in the order they entered the index (imported rows first, in their file
+        order). The file is written next to the target and then renamed over it, so a reader never
+        sees a half-written file.
+        """
+        self.flush()
+        tmp_path = f"{csv_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            # Same columns as the CSV appended by earlier versions (no header)
+            writer.writerows(self.conn.execute(
+                "SELECT path, predicted_class, name, verdict, seconds FROM verdicts ORDER BY rowid"))
+        os.replace(tmp_path, csv_path)
+
+    def close(self):
+        self.flush()
+        super().close()
@@ -81,28 +81,47 @@
 
 # ------------------------------------------
 import os
-import random
-import shutil
 from bioclip import TreeOfLifeClassifier, Rank
+from bioclip_utils import predict_ranks
+from sorted_view import SortedView, recover_sorted_view
+from crop_sampler import sample_crops
+from yolo_join import load_yolo_table
 
 # Paths
 main_folder = "C:/Users/Almas/YOLOv5/yolov5-master/runs/predict-cls/seppi-cam31/top1_classes/prob_0.8-1.0"  # Adjust path
 output_folder = "C:/Users/Almas/bioclip_test/BioClip_testrun/cam31"
 
+# Number of images encoded together in one forward pass
+BATCH_SIZE = 32
+
+# Crop sampling: up to SAMPLES_PER_STRATUM crops from every "folder", "camera", "date" or YOLO
+# "yolo_top1" class, drawn in one pass over main_folder
+SAMPLES_PER_STRATUM = 15
+STRATIFY_BY = "folder"
+
+# Seed of the sample, the same seed always selects the same crops
+SAMPLE_SEED = 0
+
+# YOLO classification_results.csv, only needed for STRATIFY_BY = "yolo_top1"
+YOLO_RESULTS_PATH = None
+
+# How the sorted folder tree is built: "hardlink" or "symlink" to the original crops, "copy", or
+# "manifest" to only list the sorted paths in sorted_view_manifest.csv (the crops are never moved)
+SORT_MODE = "hardlink"
+
+# What to do with a sorting run that was interrupted: "resume" it or "rollback" its folder tree
+INTERRUPTED_SORT = "resume"
+
 # Create the output folder if it doesn't exist
 os.makedirs(output_folder, exist_ok=True)
+recover_sorted_view(output_folder, INTERRUPTED_SORT)
 
-# Step 1: Traverse subfolders and randomly select images
-for root, dirs, files in os.walk(main_folder):
-    image_files = [f for f in files if f.lower().endswith((".jpg", ".jpeg", ".png"))]
-    
-    # Randomly select up to 15 images
-    selected_images = random.sample(image_files, min(len(image_files), 15))
-    
-    for image in selected_images:
-        src_path = os.path.join(root, image)
-        dest_path = os.path.join(output_folder, image)
-        shutil.copy(src_path, dest_path)
+# Step 1: Randomly select images from every stratum (they stay where they are)
+yolo_top1 = None
+if STRATIFY_BY == "yolo_top1":
+    yolo_top1 = load_yolo_table(YOLO_RESULTS_PATH)['top1'].to_dict()
+sample = sample_crops(main_folder, SAMPLES_PER_STRATUM, STRATIFY_BY, SAMPLE_SEED, yolo_top1)
+image_paths = [image_path for stratum in sorted(sample) for image_path in sample[stratum]]
 
 # Step 2: Initialize the classifier
 classifier = TreeOfLifeClassifier()
@@ -111,53 +130,54 @@ classifier = TreeOfLifeClassifier()
 target_orders = ["Hymenoptera", "Diptera", "Lepidoptera", "Coleoptera"]
 
 # Step 3: Classify images and organize by order and family
-for image_file in os.listdir(output_folder):
-    image_path = os.path.join(output_folder, image_file)
+image_files = [os.path.basename(image_path) for image_path in image_paths]
+sorted_view = SortedView(output_folder, SORT_MODE)
 
-    if not os.path.isfile(image_path):
-        continue
+# Encode every image once and read ORDER and FAMILY from the same embedding
+rank_predictions = predict_ranks(classifier, image_paths, [Rank.ORDER, Rank.FAMILY], batch_size=BATCH_SIZE)
 
+for image_file, image_path, predictions in zip(image_files, image_paths, rank_predictions):
     # Predict taxa classification at ORDER level
-    order_predictions = classifier.predict(image_path, Rank.ORDER)
+    order_predictions = predictions[Rank.ORDER]
 
     if not order_predictions:
         print(f"No predictions for {image_file}")
         continue
 
     # Get the best order prediction
-    best_order_prediction = max(order_predictions, key=lambda x: x["score"])
+    best_order_prediction = order_predictions[0]
     order_name = best_order_prediction["order"].replace(" ", "_")  # Normalize folder names
     prediction_score = best_order_prediction["score"]
 
-    # If confidence is low, move to "uncertain_0.3"
+    # If confidence is low, sort into "uncertain_0.3"
     if prediction_score < 0.3:
-        target_folder = os.path.join(output_folder, "uncertain_0.3")
+        target_folder = "uncertain_0.3"
 
     elif order_name in target_orders:
         # Merge the selected orders into one folder called "HyCoDiLe"
-        target_folder = os.path.join(output_folder, "HyCoDiLe")
+        target_folder = "HyCoDiLe"
 
-        # Classify further by FAMILY
-        family_predictions = classifier.predict(image_path, Rank.FAMILY)
+        # Classify further by FAMILY (from the same embedding, no second model call)
+        family_predictions = predictions[Rank.FAMILY]
 
         if not family_predictions:
             print(f"No family-level predictions for {image_file}")
             continue
 
         # Get the best family prediction
-        best_family_prediction = max(family_predictions, key=lambda x: x["score"])
+        best_family_prediction = family_predictions[0]
         family_name = best_family_prediction["family"].replace(" ", "_")
 
         target_folder = os.path.join(target_folder, family_name)  # HyCoDiLe → Family
 
     else:
-        # If order is not in the selected four, move to "Other" → Order
-        target_folder = os.path.join(output_folder, "Other", order_name)
+        # If order is not in the selected four, sort into "Other" → Order
+        target_folder = os.path.join("Other", order_name)
 
-    # Create the target folder if it doesn't exist
-    os.makedirs(target_folder, exist_ok=True)
+    # Plan the image in its folder, the folders and links are created together below
+    sorted_view.add(image_path, target_folder, image_file)
 
-    # Move the image to the appropriate folder
-    shutil.move(image_path, os.path.join(target_folder, image_file))
+# Create all folders once, then link (or copy) every image into place
+sorted_count = sorted_view.commit()
 
-print("Processing complete. Images have been classified and organized.")
+print(f"Processing complete. {sorted_count} images have been classified and organized ({SORT_MODE}).")
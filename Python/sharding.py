@@ -0,0 +1,161 @@
+# helpers to split a classification run over several worker processes
+# every worker writes its own part file, the parts are merged into the final csv afterwards
+
+import os
+import csv
+from collections import Counter
+from contextlib import contextmanager
+
+
+def shard_items(items, num_shards):
+    """
+    Split a list into deterministic round-robin shards.
+
+    The same input list always gives the same shards, so a rerun with the same
+    number of shards assigns every image to the same worker.
+
+    Args:
+        items (list): Items to split, e.g. the sorted remaining image paths
+        num_shards (int): Number of shards
+
+    Returns:
+        list: num_shards lists, shard i holds items[i], items[i + num_shards], ...
+    """
+    return [items[i::num_shards] for i in range(num_shards)]
+
+
+def decode_workers_per_shard(num_shards, num_workers):
+    """
+    Number of decode threads each worker should use.
+
+    Decoding gets at most half of the cores of a worker, the forward pass needs the rest.
+
+    Args:
+        num_shards (int): Number of worker processes
+        num_workers (int): Requested decode threads, 0 decodes on the worker's main thread
+
+    Returns:
+        int: Decode threads per worker
+    """
+    if num_workers <= 0:
+        return 0
+    cores = max(1, (os.cpu_count() or 1) // num_shards)
+    return min(num_workers, max(1, cores // 2))
+
+
+def threads_per_shard(num_shards, decode_workers=0):
+    """
+    Number of intra-op threads each worker should use so the workers together use every core once.
+
+    Args:
+        num_shards (int): Number of worker processes
+        decode_workers (int): Decode threads per worker, they take their share of the cores
+
+    Returns:
+        int: Threads per worker (at least 1)
+    """
+    return max(1, (os.cpu_count() or 1) // num_shards - decode_workers)
+
+
+@contextmanager
+def worker_thread_env(num_threads):
+    """
+    Set OMP_NUM_THREADS and MKL_NUM_THREADS for the worker processes started inside the block.
+
+    OpenMP and MKL read them once, when torch is imported. A spawned worker imports
+    torch before any of our code runs in it, so they are set in the parent and inherited.
+
+    Args:
+        num_threads (int): Number of threads per worker
+    """
+    names = ("OMP_NUM_THREADS", "MKL_NUM_THREADS")
+    previous = {name: os.environ.get(name) for name in names}
+    os.environ.update({name: str(num_threads) for name in names})
+    try:
+        yield
+    finally:
+        for name, value in previous.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+
+def configure_worker_threads(num_threads):
+    """
+    Limit the intra-op and inter-op threads used by torch in a worker process.
+
+    Args:
+        num_threads (int): Number of intra-op threads
+    """
+    import torch
+    torch.set_num_threads(num_threads)
+    try:
+        # Inference in eager mode runs no independent ops side by side, one inter-op thread is enough
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        # Only possible before torch ran its first parallel operation in this process
+        pass
+
+
+def part_file_path(csv_path, shard_index):
+    """
+    Path of the part file written by one worker.
+    """
+    return f"{csv_path}.part{shard_index:03d}"
+
+
+def merge_part_files(part_paths, csv_path, key_column, expected_keys, append):
+    """
+    Merge worker part files into the final CSV after checking that every image is present exactly once.
+
+    The final CSV is only touched if the check passes, otherwise the part files
+    are kept so the problem can be inspected.
+
+    Args:
+        part_paths (list): Part files, each with a header row
+        csv_path (str): Final CSV path
+        key_column (str): Column identifying an image, e.g. 'img_name'
+        expected_keys (list): Keys of all images handed to the workers
+        append (bool): Append to an existing CSV (without repeating the header)
+
+    Returns:
+        int: Number of merged rows
+
+    Raises:
+        ValueError: If images are missing, duplicated or unexpected in the part files
+    """
+    header = None
+    rows = []
+    for part_path in part_paths:
+        with open(part_path, 'r', newline='') as f:
+            reader = csv.reader(f)
+            part_header = next(reader, None)
+            if part_header is None:
+                continue
+            if header is None:
+                header = part_header
+            elif part_header != header:
+                raise ValueError(f"Part file {part_path} has a different header: {part_header}")
+            rows.extend(reader)
+
+    key_idx = header.index(key_column) if header else 0
+    # Compare counts rather than sets, the same file name may occur in several folders
+    found = Counter(row[key_idx] for row in rows)
+    expected = Counter(expected_keys)
+    missing = expected - found
+    extra = found - expected
+    if missing or extra:
+        examples = sorted(missing or extra)[:3]
+        raise ValueError(f"Part files do not match the sharded images: {sum(missing.values())} missing, "
+                         f"{sum(extra.values())} duplicated or unexpected (e.g. {examples})")
+
+    with open(csv_path, 'a' if append else 'w', newline='') as f:
+        writer = csv.writer(f)
+        if not append and header:
+            writer.writerow(header)
+        writer.writerows(rows)
+
+    for part_path in part_paths:
+        os.remove(part_path)
+    return len(rows)
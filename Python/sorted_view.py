@@ -0,0 +1,221 @@
+# sorted views of classified images
+# instead of copying the sampled crops into the output folder and then moving each one into its class
+# folder, the class folder tree is built from hardlinks or symlinks to the original crops (or only
+# described in a manifest), so sorting a run does not rewrite the JPEGs. The planned operations are
+# written to a journal before the tree is touched, so an interrupted run can be resumed or rolled back.
+
+import os
+import csv
+import shutil
+
+SORT_MODES = ("hardlink", "symlink", "copy", "manifest")
+JOURNAL_NAME = "sorted_view.journal"
+MANIFEST_NAME = "sorted_view_manifest.csv"
+MANIFEST_HEADER = ["mode", "source", "view_path"]
+# The journal also records whether the run creates an entry or finds it already in place
+JOURNAL_HEADER = MANIFEST_HEADER + ["created"]
+
+
+def _is_placed(mode, src, dest):
+    # True if dest already is the view entry of src (e.g. placed before an interruption)
+    if not os.path.lexists(dest):
+        return False
+    if mode == "symlink":
+        return os.path.islink(dest) and os.readlink(dest) == os.path.abspath(src)
+    if os.path.islink(dest) or not os.path.exists(src):
+        return False
+    if mode == "hardlink":
+        return os.path.samefile(src, dest)
+    src_stat, dest_stat = os.stat(src), os.stat(dest)
+    return src_stat.st_size == dest_stat.st_size and int(src_stat.st_mtime) == int(dest_stat.st_mtime)
+
+
+def _place(mode, src, dest):
+    if mode == "hardlink":
+        os.link(src, dest)
+    elif mode == "symlink":
+        os.symlink(os.path.abspath(src), dest)
+    else:
+        # copy2 keeps the mtime, which _is_placed() compares
+        shutil.copy2(src, dest)
+
+
+def _apply(rows):
+    """
+    Create the view entries of journal rows, skipping the ones already in place.
+
+    Returns:
+        list: The rows with the mode actually used (links fall back to copies
+              where the file system does not support them)
+    """
+    # Create every target folder once instead of once per image
+    for folder in sorted({os.path.dirname(dest) for mode, _, dest, _ in rows if mode != "manifest"}):
+        os.makedirs(folder, exist_ok=True)
+
+    applied = []
+    fallback = None
+    for mode, src, dest, created in rows:
+        if mode != "manifest":
+            mode = fallback or mode
+            if not _is_placed(mode, src, dest):
+                if os.path.lexists(dest):
+                    # A partial copy left by the interrupted run, add() never plans an occupied path
+                    os.remove(dest)
+                try:
+                    _place(mode, src, dest)
+                except OSError as e:
+                    if mode == "copy":
+                        raise
+                    # e.g. hardlinks across drives, or symlinks on Windows without developer mode
+                    print(f"Could not create {mode} ({e}), copying the remaining images instead")
+                    fallback = mode = "copy"
+                    _place(mode, src, dest)
+        applied.append((mode, src, dest, created))
+    return applied
+
+
+def _read_journal(journal_path):
+    with open(journal_path, 'r', newline='', encoding="utf-8") as f:
+        reader = csv.reader(f)
+        next(reader, None)
+        return [(row[0], row[1], row[2], row[3] != "0") for row in reader if len(row) == 4]
+
+
+class SortedView:
+    """
+    Folder tree of classified images built from links to the original files.
+
+    Images are added with add() and placed all at once by commit(). Images
+    with the same file name in one class folder get a numbered file name
+    instead of replacing each other or the entries of earlier runs.
+    """
+
+    def __init__(self, output_folder, mode="hardlink"):
+        """
+        Args:
+            output_folder (str): Root folder of the sorted tree
+            mode (str): "hardlink", "symlink", "copy", or "manifest" to only
+                        list the planned view paths in the manifest
+        """
+        if mode not in SORT_MODES:
+            raise ValueError(f"Unknown sort mode {mode}, use one of {', '.join(SORT_MODES)}")
+        self.output_folder = output_folder
+        self.mode = mode
+        self.journal_path = os.path.join(output_folder, JOURNAL_NAME)
+        self.manifest_path = os.path.join(output_folder, MANIFEST_NAME)
+        self._rows = []
+        # Source of every planned view path
+        self._planned = {}
+
+    def _can_use(self, src_path, dest):
+        # True if dest is free for src_path or already is its entry
+        if dest in self._planned:
+            return self._planned[dest] == src_path
+        if self.mode == "manifest" or not os.path.lexists(dest):
+            return True
+        return _is_placed(self.mode, src_path, dest)
+
+    def add(self, src_path, target_folder, file_name=None):
+        """
+        Plan one image of the view.
+
+        Args:
+            src_path (str): Original image
+            target_folder (str): Class folder relative to the output folder, e.g. "HyCoDiLe/Apidae"
+            file_name (str, optional): File name in the view, defaults to the original file name
+
+        Returns:
+            str: Path of the image in the view, numbered ("name_2.jpg", ...) if the
+                 file name is already taken by another image
+        """
+        dest = os.path.join(self.output_folder, target_folder, file_name or os.path.basename(src_path))
+        base, ext = os.path.splitext(dest)
+        number = 1
+        while not self._can_use(src_path, dest):
+            number += 1
+            dest = f"{base}_{number}{ext}"
+        if dest in self._planned:
+            # The same image added twice
+            return dest
+        self._planned[dest] = src_path
+        created = self.mode == "manifest" or not os.path.lexists(dest)
+        self._rows.append((self.mode, src_path, dest, created))
+        return dest
+
+    def commit(self):
+        """
+        Write the journal, create the view and record it in the manifest.
+
+        Returns:
+            int: Number of images in the view
+        """
+        if os.path.exists(self.journal_path):
+            raise RuntimeError(f"Unfinished sorting run in {self.output_folder}, "
+                               f"resume or roll it back first with recover_sorted_view()")
+        os.makedirs(self.output_folder, exist_ok=True)
+        with open(self.journal_path, 'w', newline='', encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(JOURNAL_HEADER)
+            writer.writerows((mode, src, dest, int(created)) for mode, src, dest, created in self._rows)
+            f.flush()
+            os.fsync(f.fileno())
+
+        _finish(self.journal_path, self.manifest_path, _apply(self._rows))
+        count = len(self._rows)
+        self._rows = []
+        self._planned = {}
+        return count
+
+
+def _finish(journal_path, manifest_path, rows):
+    # Append the placed entries to the manifest, then drop the journal
+    new_manifest = not os.path.exists(manifest_path)
+    with open(manifest_path, 'a', newline='', encoding="utf-8") as f:
+        writer = csv.writer(f)
+        if new_manifest:
+            writer.writerow(MANIFEST_HEADER)
+        writer.writerows(row[:3] for row in rows)
+    os.remove(journal_path)
+
+
+def recover_sorted_view(output_folder, action="resume"):
+    """
+    Finish or undo a sorting run that was interrupted before it completed.
+
+    Args:
+        output_folder (str): Root folder of the sorted tree
+        action (str): "resume" places the remaining images of the journal,
+                      "rollback" removes the images the run already placed
+                      (entries that were in place before the run and the
+                      original files are never touched)
+
+    Returns:
+        int: Number of journal entries handled (0 if there was no unfinished run)
+    """
+    journal_path = os.path.join(output_folder, JOURNAL_NAME)
+    if not os.path.exists(journal_path):
+        return 0
+    rows = _read_journal(journal_path)
+
+    if action == "resume":
+        print(f"Resuming interrupted sorting run with {len(rows)} images in {output_folder}")
+        _finish(journal_path, os.path.join(output_folder, MANIFEST_NAME), _apply(rows))
+    elif action == "rollback":
+        print(f"Rolling back interrupted sorting run with {len(rows)} images in {output_folder}")
+        root = os.path.normpath(os.path.abspath(output_folder))
+        folders = set()
+        for mode, src, dest, created in rows:
+            if mode == "manifest" or not created:
+                continue
+            if os.path.lexists(dest) and os.path.abspath(dest) != os.path.abspath(src):
+                os.remove(dest)
+            folders.add(os.path.normpath(os.path.abspath(os.path.dirname(dest))))
+        # Remove the empty class folders below the output folder, deepest first
+        for folder in sorted(folders, key=len, reverse=True):
+            while folder.startswith(root + os.sep) and os.path.isdir(folder) and not os.listdir(folder):
+                os.rmdir(folder)
+                folder = os.path.dirname(folder)
+        os.remove(journal_path)
+    else:
+        raise ValueError(f"Unknown action {action}, use 'resume' or 'rollback'")
+    return len(rows)
@@ -0,0 +1,196 @@
+# opt-in timing of the stages of a classification run
+# records how long discovery, decoding, preprocessing, the model forward pass, post-processing and
+# writing take, so a slow run can be attributed to I/O or compute. Reports percentiles per stage and
+# writes a JSON or Prometheus text-format summary. Optionally wraps the run in cProfile or torch.profiler.
+
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager, nullcontext
+import numpy as np
+
+# Stages in the order they happen for an image, used to order the report
+STAGES = ["discovery", "decode", "preprocess", "decode_wait", "forward", "postprocess", "write"]
+
+
+class StageTimer:
+    """
+    Collect wall-clock durations per stage.
+
+    Every call of a stage is one sample (e.g. one decoded image or one model
+    forward pass over a batch) together with the number of images it covered.
+    Samples may be recorded from the prefetch threads.
+    """
+
+    def __init__(self):
+        self._samples = {}
+        self._lock = threading.Lock()
+        self.start_time = time.perf_counter()
+
+    def add(self, stage, seconds, items=1):
+        """
+        Record one sample of a stage.
+
+        Args:
+            stage (str): Stage name, e.g. "forward"
+            seconds (float): Duration of the sample
+            items (int): Number of images the sample covered
+        """
+        with self._lock:
+            self._samples.setdefault(stage, []).append((seconds, items))
+
+    @contextmanager
+    def stage(self, stage, items=1):
+        """
+        Time the body of a with block as one sample of a stage.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - start, items)
+
+    def summary(self):
+        """
+        Summarize the recorded samples.
+
+        Decoding and preprocessing run on several threads, so their totals can
+        be larger than the wall time. "decode_wait" is the time the model waited
+        for decoded images: if it is large, the run is limited by I/O and decoding.
+
+        Returns:
+            dict: "wall_seconds" and "stages", stage name -> count, items,
+                  total_seconds, ms_per_item, p50_ms, p90_ms, p99_ms and max_ms
+        """
+        with self._lock:
+            samples = {stage: list(values) for stage, values in self._samples.items()}
+
+        stages = {}
+        order = STAGES + sorted(set(samples) - set(STAGES))
+        for stage in order:
+            if stage not in samples:
+                continue
+            durations = np.array([seconds for seconds, _ in samples[stage]]) * 1000
+            items = sum(count for _, count in samples[stage])
+            p50, p90, p99 = np.percentile(durations, [50, 90, 99])
+            stages[stage] = {
+                "count": len(durations),
+                "items": items,
+                "total_seconds": round(float(durations.sum()) / 1000, 4),
+                "ms_per_item": round(float(durations.sum()) / max(items, 1), 4),
+                "p50_ms": round(float(p50), 4),
+                "p90_ms": round(float(p90), 4),
+                "p99_ms": round(float(p99), 4),
+                "max_ms": round(float(durations.max()), 4),
+            }
+        return {"wall_seconds": round(time.perf_counter() - self.start_time, 4), "stages": stages}
+
+    def print_report(self):
+        """
+        Print the per-stage summary as a table.
+        """
+        summary = self.summary()
+        print(f"\nStage timings (wall time {summary['wall_seconds']:.1f} s):")
+        print(f"{'stage':<12} {'count':>8} {'total s':>9} {'ms/img':>8} {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8}")
+        for stage, stats in summary["stages"].items():
+            print(f"{stage:<12} {stats['count']:>8} {stats['total_seconds']:>9.2f} {stats['ms_per_item']:>8.2f} "
+                  f"{stats['p50_ms']:>8.2f} {stats['p90_ms']:>8.2f} {stats['p99_ms']:>8.2f}")
+
+    def write_report(self, report_path, labels=None):
+        """
+        Write the summary of the run, as Prometheus text format if the path ends in .prom, otherwise as JSON.
+
+        Args:
+            report_path (str): Output file
+            labels (dict, optional): Extra run information, e.g. {"camera": "cam32"},
+                                     stored in the JSON and as Prometheus labels
+        """
+        summary = self.summary()
+        labels = labels or {}
+        if report_path.endswith(".prom"):
+            text = _prometheus_text(summary, labels)
+        else:
+            text = json.dumps(dict(summary, labels=labels), indent=2)
+
+        # Write to a temporary file first, so a scraper never reads a half written report
+        tmp_path = report_path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            f.write(text)
+        os.replace(tmp_path, report_path)
+        print(f"Timing report saved to {report_path}")
+
+
+def _prometheus_text(summary, labels):
+    def label_str(extra):
+        pairs = dict(labels, **extra)
+        return "{" + ",".join(f'{key}="{value}"' for key, value in pairs.items()) + "}"
+
+    lines = [
+        "# HELP bioclip_run_wall_seconds Wall time of the classification run.",
+        "# TYPE bioclip_run_wall_seconds gauge",
+        f"bioclip_run_wall_seconds{label_str({})} {summary['wall_seconds']}",
+        "# HELP bioclip_stage_seconds Duration of one stage sample.",
+        "# TYPE bioclip_stage_seconds summary",
+    ]
+    for stage, stats in summary["stages"].items():
+        for quantile, key in (("0.5", "p50_ms"), ("0.9", "p90_ms"), ("0.99", "p99_ms")):
+            lines.append(f"bioclip_stage_seconds{label_str({'stage': stage, 'quantile': quantile})} "
+                         f"{round(stats[key] / 1000, 7)}")
+        lines.append(f"bioclip_stage_seconds_sum{label_str({'stage': stage})} {stats['total_seconds']}")
+        lines.append(f"bioclip_stage_seconds_count{label_str({'stage': stage})} {stats['count']}")
+    lines.append("# HELP bioclip_stage_items_total Images processed by a stage.")
+    lines.append("# TYPE bioclip_stage_items_total counter")
+    for stage, stats in summary["stages"].items():
+        lines.append(f"bioclip_stage_items_total{label_str({'stage': stage})} {stats['items']}")
+    return "\n".join(lines) + "\n"
+
+
+def timed(timer, stage, items=1):
+    """
+    timer.stage(stage, items), or a no-op context if timing is disabled (timer is None).
+    """
+    if timer is None:
+        return nullcontext()
+    return timer.stage(stage, items)
+
+
+@contextmanager
+def profile_run(profiler, output_base):
+    """
+    Optionally run the body of a with block under a profiler.
+
+    Args:
+        profiler (str or None): None, "cprofile" (Python call profile saved to
+            <output_base>.prof, open it with snakeviz or pstats) or "torch"
+            (torch.profiler operator trace saved to <output_base>.trace.json,
+            open it in chrome://tracing or Perfetto)
+        output_base (str): Profile output path without extension
+    """
+    if not profiler:
+        yield
+        return
+
+    if profiler == "cprofile":
+        import cProfile
+        prof = cProfile.Profile()
+        prof.enable()
+        try:
+            yield
+        finally:
+            prof.disable()
+            output_path = output_base + ".prof"
+            prof.dump_stats(output_path)
+            print(f"cProfile stats saved to {output_path}")
+    elif profiler == "torch":
+        import torch
+        activities = [torch.profiler.ProfilerActivity.CPU]
+        if torch.cuda.is_available():
+            activities.append(torch.profiler.ProfilerActivity.CUDA)
+        with torch.profiler.profile(activities=activities, record_shapes=True) as prof:
+            yield
+        output_path = output_base + ".trace.json"
+        prof.export_chrome_trace(output_path)
+        print(f"torch profiler trace saved to {output_path}")
+    else:
+        raise ValueError(f"Unknown profiler {profiler}, use 'cprofile' or 'torch'")
@@ -0,0 +1,148 @@
+# compact taxonomy index built from the GBIF downloads
+# family_explorer.py stores every family of the downloads with its order, its class and its number of
+# occurrences per region (one GBIF download per region) in one small JSON file. The classification
+# scripts load it once instead of the flat family list, which gives set lookups for the target families
+# and lets them roll family predictions up to order without another model call.
+
+import os
+import json
+from collections import Counter
+
+TAXONOMY_INDEX_NAME = "taxonomy_index.json"
+INDEX_VERSION = 1
+
+
+def build_taxonomy_index(region_counts):
+    """
+    Build the index data from the taxon counts of the GBIF downloads.
+
+    Args:
+        region_counts (dict): Region name -> Counter of GBIF occurrences per (class, order, family),
+                              e.g. from family_explorer.load_taxonomy_counts() (the numberOfOccurrences
+                              of the species lists summed per family)
+
+    Returns:
+        dict: JSON-ready index, families map to [order, class, occurrences per region]
+    """
+    regions = sorted(region_counts)
+    parents = {}
+    counts = {}
+    for i, region in enumerate(regions):
+        for (class_name, order, family), count in region_counts[region].items():
+            parents.setdefault(family, Counter())[(order, class_name)] += count
+            counts.setdefault(family, [0] * len(regions))[i] += count
+
+    families = {}
+    for family, family_parents in parents.items():
+        # Some records lack the order or class, or use an outdated placement: keep the most common known one
+        known = [parent for parent, _ in family_parents.most_common() if parent[0] and parent[1]]
+        order, class_name = known[0] if known else family_parents.most_common(1)[0][0]
+        families[family] = [order, class_name, counts[family]]
+    return {"version": INDEX_VERSION, "regions": regions, "families": dict(sorted(families.items()))}
+
+
+def save_taxonomy_index(index_data, index_path):
+    """
+    Write the index data from build_taxonomy_index() to a JSON file.
+    """
+    tmp_path = index_path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(index_data, f, separators=(",", ":"))
+    os.replace(tmp_path, index_path)
+
+
+class TaxonomyIndex:
+    """
+    Family -> order -> class lookups with GBIF occurrence counts per region.
+    """
+
+    def __init__(self, index_data):
+        if index_data.get("version") != INDEX_VERSION:
+            raise ValueError("Taxonomy index has another version, run family_explorer.py again")
+        self.regions = index_data["regions"]
+        self._families = index_data["families"]
+        self._region_pos = {region: i for i, region in enumerate(self.regions)}
+
+    def __contains__(self, family):
+        return family in self._families
+
+    def __len__(self):
+        return len(self._families)
+
+    def families(self):
+        """
+        Set of all family names in the index.
+        """
+        return set(self._families)
+
+    def order_of(self, family):
+        """
+        Order of a family, '' if the family or its order is unknown.
+        """
+        entry = self._families.get(family)
+        return entry[0] if entry else ''
+
+    def class_of(self, family):
+        """
+        Class of a family, '' if the family or its class is unknown.
+        """
+        entry = self._families.get(family)
+        return entry[1] if entry else ''
+
+    def occurrences(self, family, region=None):
+        """
+        Number of GBIF occurrences of a family in one region, or in all regions if region is None.
+        """
+        entry = self._families.get(family)
+        if entry is None:
+            return 0
+        if region is None:
+            return sum(entry[2])
+        return entry[2][self._region_pos[region]]
+
+
+def load_taxonomy_index(index_path):
+    """
+    Load a taxonomy index written by family_explorer.py.
+
+    Returns:
+        TaxonomyIndex: The index
+    """
+    with open(index_path, 'r', encoding='utf-8') as f:
+        return TaxonomyIndex(json.load(f))
+
+
+def load_target_families(target_families_path):
+    """
+    Load the target families from a taxonomy index (.json) or a gbif_families.txt file.
+
+    Returns:
+        set: Family names
+    """
+    if target_families_path.endswith(".json"):
+        return load_taxonomy_index(target_families_path).families()
+    with open(target_families_path, 'r') as f:
+        # gbif_families.txt starts with a "Total families: N" line
+        return {line.strip() for line in f if line.strip() and not line.startswith("Total families:")}
+
+
+def roll_up_to_order(family_predictions, taxonomy_index):
+    """
+    Order predictions from family predictions, summing the scores of the families of each order.
+
+    Families missing from the index keep the order BioClip predicted with them, if any.
+
+    Args:
+        family_predictions (list): Family predictions of one image, best first
+        taxonomy_index (TaxonomyIndex): Index giving the order of each family
+
+    Returns:
+        list: (order, score) tuples, best first
+    """
+    scores = Counter()
+    for prediction in family_predictions:
+        family = prediction["family"].replace(" ", "_")
+        order = taxonomy_index.order_of(family) or prediction.get("order", '')
+        if order:
+            scores[order] += prediction["score"]
+    return scores.most_common()
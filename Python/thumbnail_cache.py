@@ -0,0 +1,87 @@
+# on-disk thumbnail cache for the grid review in verificator.py
+# every thumbnail is stored as a small JPEG named after a hash of the image path, its size and mtime,
+# so a changed image gets a new thumbnail and the cache can be shared by several reviewers. The
+# thumbnails can be precomputed for the whole queue in the background while the first pages are reviewed.
+
+import os
+import hashlib
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+
+THUMBNAIL_SIZE = (120, 120)
+
+
+def thumbnail_path(cache_dir, image_path, size=THUMBNAIL_SIZE):
+    """
+    Path of the cached thumbnail of an image (the file may not exist yet).
+    """
+    stat = os.stat(image_path)
+    key = f"{os.path.abspath(image_path)}|{stat.st_size}|{stat.st_mtime_ns}|{size[0]}x{size[1]}"
+    digest = hashlib.blake2b(key.encode("utf-8", "surrogateescape"), digest_size=16).hexdigest()
+    # Two-level layout keeps the folders small
+    return os.path.join(cache_dir, digest[:2], digest + ".jpg")
+
+
+def _make_thumbnail(image_path, thumb_path, size):
+    img = Image.open(image_path)
+    if img.format == "JPEG":
+        img.draft("RGB", size)
+    img = img.convert("RGB")
+    img.thumbnail(size)
+    os.makedirs(os.path.dirname(thumb_path), exist_ok=True)
+    # Write to a unique file next to the target and rename, a reader never sees half a thumbnail and
+    # threads building the same thumbnail (precompute and prefetch) do not share a temporary file
+    fd, tmp_path = tempfile.mkstemp(suffix=".tmp", dir=os.path.dirname(thumb_path))
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            img.save(f, "JPEG", quality=85)
+        os.replace(tmp_path, thumb_path)
+    except OSError:
+        # Lost the race against another writer (Windows refuses to replace a file that is open)
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        if not os.path.exists(thumb_path):
+            raise
+    return img
+
+
+def load_thumbnail(image_path, cache_dir, size=THUMBNAIL_SIZE):
+    """
+    Thumbnail of an image from the cache, created and stored if it is missing.
+
+    Returns:
+        PIL.Image.Image: Thumbnail no larger than size, keeping the aspect ratio
+    """
+    thumb_path = thumbnail_path(cache_dir, image_path, size)
+    try:
+        img = Image.open(thumb_path)
+        img.load()
+        return img
+    except FileNotFoundError:
+        return _make_thumbnail(image_path, thumb_path, size)
+
+
+def precompute_thumbnails(image_paths, cache_dir, size=THUMBNAIL_SIZE, num_workers=4):
+    """
+    Create the missing thumbnails of a list of images.
+
+    Images that cannot be read (moved, deleted or broken) are reported and
+    skipped, so one bad image does not stop the run in the background.
+
+    Returns:
+        int: Number of thumbnails created
+    """
+    def build(image_path):
+        try:
+            thumb_path = thumbnail_path(cache_dir, image_path, size)
+            if os.path.exists(thumb_path):
+                return 0
+            _make_thumbnail(image_path, thumb_path, size)
+        except Exception as e:
+            print(f"Could not create the thumbnail of {image_path}: {e}")
+            return 0
+        return 1
+
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        return sum(executor.map(build, image_paths))
@@ -0,0 +1,209 @@
+# track-level deduplication for the BioClip classification
+# InsectDetect saves many near-identical crops of the same insect per track (the _ID<n>_ part of the crop
+# file name). The crops are grouped by track ID and/or a perceptual hash, only a few representative frames
+# per group are classified, and the averaged scores of the representatives are written for every crop of
+# the group, so the number of model calls drops by about the average track length.
+
+import os
+import re
+from collections import deque
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import PIL.Image
+from bioclip import Rank
+
+DEDUP_MODES = ("track", "phash", "track+phash")
+DEDUP_COLUMNS = ['Dedup_Group_BioClip', 'Dedup_Representative_BioClip']
+
+# e.g. "2024-07-21_11-25-48-096510_ID92_crop.jpg"
+CROP_NAME_PATTERN = re.compile(r"(\d{4}-\d{2}-\d{2}_\d{2}-\d{2}-\d{2}-\d{6})_ID(\d+)")
+
+
+def parse_crop_name(file_name):
+    """
+    Read the capture time and the track ID from an InsectDetect crop file name.
+
+    Returns:
+        tuple: (datetime, track ID) or (None, None) if the name has another format
+    """
+    match = CROP_NAME_PATTERN.search(file_name)
+    if not match:
+        return None, None
+    return datetime.strptime(match.group(1), "%Y-%m-%d_%H-%M-%S-%f"), int(match.group(2))
+
+
+def dhash(image_path, hash_size=8):
+    """
+    Difference hash of an image: 64 bits describing where brightness increases from left to right.
+
+    Near-identical frames of a track differ in only a few bits.
+    """
+    img = PIL.Image.open(image_path)
+    if img.format == "JPEG":
+        img.draft("L", (hash_size * 4, hash_size * 4))
+    pixels = np.asarray(img.convert("L").resize((hash_size + 1, hash_size), PIL.Image.BILINEAR), dtype=np.int16)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).flatten()
+    return int("".join("1" if bit else "0" for bit in bits), 2)
+
+
+def _split_by_hash(paths, hashes, hash_threshold):
+    # Start a new group whenever a frame differs too much from the first frame of the current group
+    groups = []
+    for path in paths:
+        if groups and bin(hashes[path] ^ hashes[groups[-1][0]]).count("1") <= hash_threshold:
+            groups[-1].append(path)
+        else:
+            groups.append([path])
+    return groups
+
+
+def group_crops(image_paths, mode="track", max_gap_seconds=60, hash_threshold=6, num_workers=4):
+    """
+    Group crops of the same insect.
+
+    Args:
+        image_paths (list): Crop paths
+        mode (str): "track" (same folder and track ID, split where the track
+            pauses longer than max_gap_seconds, since IDs restart with every
+            recording), "phash" (consecutive frames of a folder with similar
+            perceptual hashes) or "track+phash" (tracks, split where the frames
+            change too much, e.g. when the tracker swapped insects)
+        max_gap_seconds (float): Longest pause within one group
+        hash_threshold (int): Largest number of differing hash bits within one group
+        num_workers (int): Threads computing the perceptual hashes
+
+    Returns:
+        list: Groups, each a list of crop paths in capture order
+    """
+    if mode not in DEDUP_MODES:
+        raise ValueError(f"Unknown dedup mode {mode}, use one of {', '.join(DEDUP_MODES)}")
+
+    # Sort the crops by folder and capture time, crops with unknown names stay on their own
+    parsed = {}
+    singles = []
+    for image_path in image_paths:
+        timestamp, track_id = parse_crop_name(os.path.basename(image_path))
+        if timestamp is None:
+            singles.append([image_path])
+        else:
+            parsed[image_path] = (os.path.dirname(image_path), timestamp, track_id)
+
+    if mode == "phash":
+        keyed = sorted(parsed, key=lambda p: (parsed[p][0], parsed[p][1]))
+        group_key = lambda p: parsed[p][0]
+    else:
+        keyed = sorted(parsed, key=lambda p: (parsed[p][0], parsed[p][2], parsed[p][1]))
+        group_key = lambda p: (parsed[p][0], parsed[p][2])
+
+    # Consecutive crops with the same key and no long pause form one group
+    groups = []
+    previous = None
+    for image_path in keyed:
+        if (previous is not None and group_key(image_path) == group_key(previous)
+                and (parsed[image_path][1] - parsed[previous][1]).total_seconds() <= max_gap_seconds):
+            groups[-1].append(image_path)
+        else:
+            groups.append([image_path])
+        previous = image_path
+
+    if mode != "track":
+        with ThreadPoolExecutor(max_workers=max(num_workers, 1)) as executor:
+            hashes = dict(zip(keyed, executor.map(dhash, keyed)))
+        groups = [split for group in groups for split in _split_by_hash(group, hashes, hash_threshold)]
+
+    return groups + singles
+
+
+def select_representatives(group, per_group=3):
+    """
+    Pick up to per_group frames spread evenly over a group (first, middle, last, ...).
+    """
+    if len(group) <= per_group:
+        return list(group)
+    idx = np.unique(np.linspace(0, len(group) - 1, per_group).round().astype(int))
+    return [group[i] for i in idx]
+
+
+def aggregate_predictions(representative_predictions, ranks, k=1):
+    """
+    Average the scores of the representatives of a group.
+
+    A taxon missing from the top predictions of a representative counts as score 0 there.
+
+    Args:
+        representative_predictions (list): One dict per representative mapping each rank to its predictions
+        ranks (list): Ranks to aggregate
+        k (int): Number of predictions to keep per rank
+
+    Returns:
+        dict: Rank -> list of up to k predictions, best first
+    """
+    aggregated = {}
+    n = len(representative_predictions)
+    for rank in ranks:
+        labels = [r.get_label() for r in Rank if r.value <= rank.value]
+        scores = {}
+        examples = {}
+        for predictions in representative_predictions:
+            for prediction in predictions[rank]:
+                taxon = tuple(prediction[label] for label in labels)
+                scores[taxon] = scores.get(taxon, 0.0) + prediction["score"]
+                examples.setdefault(taxon, prediction)
+        best = sorted(scores, key=scores.get, reverse=True)[:k]
+        aggregated[rank] = [dict(examples[taxon], score=scores[taxon] / n) for taxon in best]
+    return aggregated
+
+
+def plan_dedup(image_paths, mode="track", per_group=3, max_gap_seconds=60, hash_threshold=6, num_workers=4):
+    """
+    Group the crops and choose the representatives to classify.
+
+    Returns:
+        tuple: (groups, representative paths in group order, dict group index -> representatives)
+    """
+    groups = group_crops(image_paths, mode, max_gap_seconds, hash_threshold, num_workers)
+    representatives = {i: select_representatives(group, per_group) for i, group in enumerate(groups)}
+    ordered = [path for i in range(len(groups)) for path in representatives[i]]
+    print(f"Dedup ({mode}): {len(image_paths)} crops in {len(groups)} groups, "
+          f"classifying {len(ordered)} representatives")
+    return groups, ordered, representatives
+
+
+def iter_group_rows(groups, representatives, rep_batches, ranks, k=1):
+    """
+    Turn batches of representative predictions into predictions for every crop of the finished groups.
+
+    Args:
+        groups (list): Groups from plan_dedup()
+        representatives (dict): Group index -> representative paths, from plan_dedup()
+        rep_batches (iterable): (batch paths, rank predictions) of the representatives in
+                                group order, e.g. from bioclip_utils.iter_rank_predictions()
+        ranks (list): Predicted ranks
+        k (int): Number of predictions to keep per rank
+
+    Yields:
+        tuple: (crop paths, rank predictions per crop, dict of DEDUP_COLUMNS values per crop)
+               for the groups completed by each batch
+    """
+    next_group = 0
+    # Predictions of the representatives not yet assigned to a group, in group order
+    collected = deque()
+    for batch_paths, rank_predictions in rep_batches:
+        collected.extend(rank_predictions)
+        paths, predictions, group_names, is_representative = [], [], [], []
+        # A group is complete once the predictions of all its representatives arrived
+        while next_group < len(groups) and len(collected) >= len(representatives[next_group]):
+            n_reps = len(representatives[next_group])
+            group_prediction = aggregate_predictions([collected.popleft() for _ in range(n_reps)], ranks, k)
+            group = groups[next_group]
+            rep_set = set(representatives[next_group])
+            group_name = os.path.splitext(os.path.basename(group[0]))[0]
+            for image_path in group:
+                paths.append(image_path)
+                predictions.append(group_prediction)
+                group_names.append(group_name)
+                is_representative.append(image_path in rep_set)
+            next_group += 1
+        if paths:
+            yield paths, predictions, dict(zip(DEDUP_COLUMNS, [group_names, is_representative]))
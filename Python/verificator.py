@@ -1,63 +1,97 @@
 import os
-import csv
 import time
+import threading
 import tkinter as tk
 from tkinter import ttk
-from PIL import Image, ImageTk
+from PIL import ImageTk
+from image_prefetch import ImagePrefetcher
+from review_index import ReviewIndex
+from thumbnail_cache import load_thumbnail, precompute_thumbnails
 
 # Define root directory
 ROOT_DIR = "C:/Users/Almas/YOLOv5/yolov5-master/runs/predict-cls"
 OUTPUT_CSV = "verification_results3.csv"
-BOOKMARK_FILE = "bookmark.txt"
-
-# Find all images in the classification folders
-def get_image_list():
-    image_paths = []
-    for cam in os.listdir(ROOT_DIR):
-        if cam in ["seppi-cam36", "seppi-cam37", "seppi-cam38"]:
-            cam_path = os.path.join(ROOT_DIR, cam, "top1_classes", "prob_0.8-1.0")
-            if os.path.exists(cam_path):
-                for taxa in os.listdir(cam_path):
-                    if "none_" in taxa.lower():
-                        continue  # Skip folders with "none_" in the name
-                    taxa_path = os.path.join(cam_path, taxa)
-                    if os.path.isdir(taxa_path):
-                        for img in os.listdir(taxa_path):
-                            if img.lower().endswith((".jpg", ".png", ".jpeg")):
-                                image_paths.append((os.path.join(taxa_path, img), taxa, img))
-    return image_paths
-
-# Load bookmark
-def load_bookmark():
-    if os.path.exists(BOOKMARK_FILE):
-        with open(BOOKMARK_FILE, "r") as file:
-            try:
-                return int(file.read().strip())
-            except ValueError:
-                return 0
-    return 0
-
-# Save bookmark
-def save_bookmark():
-    with open(BOOKMARK_FILE, "w") as file:
-        file.write(str(current_index))
+CAMERAS = ["seppi-cam36", "seppi-cam37", "seppi-cam38"]
+
+# Review queue and verdicts, shared by all reviewers (replaces bookmark.txt)
+# Only folders that changed since the last start are listed again
+INDEX_PATH = "review_index.sqlite"
+# Several reviewers can work at the same time on disjoint shards of the queue:
+# give each one the same NUM_SHARDS and its own SHARD (0 ... NUM_SHARDS - 1)
+REVIEWER = ""
+SHARD = 0
+NUM_SHARDS = 1
+# Verdicts are committed and appended to OUTPUT_CSV in batches, at the latest after FLUSH_EVERY images
+# or FLUSH_SECONDS
+FLUSH_EVERY = 20
+FLUSH_SECONDS = 30
+
+# Number of upcoming images decoded in the background, and the most images kept in memory
+# (500x500 RGB images take about 0.75 MB each)
+PREFETCH_AHEAD = 8
+PREFETCH_CACHE_SIZE = 32
+
+# Grid review: pages of thumbnails of one predicted class, click the wrong ones and accept the
+# page (every image still gets its own row in the results CSV)
+GRID_MODE = False
+GRID_COLUMNS = 8
+GRID_ROWS = 5
+THUMBNAIL_SIZE = (120, 120)
+# On-disk thumbnail cache, the thumbnails of the whole queue are built in the background
+THUMBNAIL_DIR = "thumbnail_cache"
+
+# Add new images of the classification folders to the review queue
+def refresh_image_queue():
+    cam_paths = [os.path.join(ROOT_DIR, cam, "top1_classes", "prob_0.8-1.0") for cam in CAMERAS]
+    # Skip folders with "none_" in the name
+    added = review_index.refresh(cam_paths, skip_folder=lambda taxa: "none_" in taxa.lower())
+    print(f"Found {added} new images")
+    return review_index.queue(SHARD, NUM_SHARDS)
 
 # Load images
-image_list = get_image_list()
-current_index = load_bookmark()
+index_is_new = not os.path.exists(INDEX_PATH)
+review_index = ReviewIndex(INDEX_PATH, REVIEWER, FLUSH_EVERY, FLUSH_SECONDS, results_csv=OUTPUT_CSV)
+image_list = refresh_image_queue()
+if index_is_new and os.path.exists(OUTPUT_CSV):
+    # First start with an index: images already in the results CSV leave the queue
+    print(f"Imported {review_index.import_results(OUTPUT_CSV)} verdicts from {OUTPUT_CSV}")
+    image_list = review_index.queue(SHARD, NUM_SHARDS)
+print(f"{len(image_list)} images to review in shard {SHARD + 1} of {NUM_SHARDS}")
+current_index = 0
 start_time = time.time()
 
+# Split the queue into pages of one predicted class each
+def make_pages(images):
+    by_class = {}
+    for item in images:
+        by_class.setdefault(item[1], []).append(item)
+    page_size = GRID_COLUMNS * GRID_ROWS
+    return [items[i:i + page_size] for predicted_class, items in sorted(by_class.items())
+            for i in range(0, len(items), page_size)]
+
+if GRID_MODE:
+    pages = make_pages(image_list)
+    current_page = 0
+    flagged = set()
+    page_size = GRID_COLUMNS * GRID_ROWS
+    # Thumbnails of the next two pages are read from the cache ahead of time
+    prefetcher = ImagePrefetcher(loader=lambda path: load_thumbnail(path, THUMBNAIL_DIR, THUMBNAIL_SIZE),
+                                 ahead=2 * page_size, capacity=4 * page_size, num_threads=2)
+    threading.Thread(target=precompute_thumbnails, args=([path for path, _, _ in image_list], THUMBNAIL_DIR,
+                                                         THUMBNAIL_SIZE, 2), daemon=True).start()
+else:
+    prefetcher = ImagePrefetcher(ahead=PREFETCH_AHEAD, capacity=PREFETCH_CACHE_SIZE)
+
 # Save classification result
 def save_result(is_correct):
     global current_index, start_time
     if current_index < len(image_list):
         image_path, predicted_class, image_name = image_list[current_index]
         elapsed_time = time.time() - start_time
-        with open(OUTPUT_CSV, "a", newline="") as file:
-            writer = csv.writer(file)
-            writer.writerow([image_path, predicted_class, image_name, "Correct" if is_correct else "Incorrect", round(elapsed_time, 2)])
+        # Buffered, the verdict and the queue position are committed together in the next batch
+        review_index.record(image_path, predicted_class, image_name, "Correct" if is_correct else "Incorrect",
+                            elapsed_time)
         current_index += 1
-        save_bookmark()
         start_time = time.time()  # Reset timer for next image
         load_next_image()
 
@@ -65,42 +99,120 @@ def save_result(is_correct):
 def load_next_image():
     if current_index < len(image_list):
         image_path, predicted_class, image_name = image_list[current_index]
-        img = Image.open(image_path)
-        img = img.resize((500, 500))  # Resize for display
-        img = ImageTk.PhotoImage(img)
+        # Decoded and resized to 500x500 in the background while the previous image was shown
+        img = ImageTk.PhotoImage(prefetcher.get(image_path))
         image_label.config(image=img)
         image_label.image = img
         class_label.config(text=f"Predicted: {predicted_class}")
         file_name_label.config(text=f"File: {image_name}")
+        prefetcher.prefetch([path for path, _, _ in image_list[current_index + 1:current_index + 1 + PREFETCH_AHEAD]])
     else:
         class_label.config(text="All images reviewed!")
         image_label.config(image='')
         file_name_label.config(text="")
 
+# Save the page: flagged images are incorrect, all others correct
+def save_page():
+    global current_page, start_time
+    if current_page < len(pages):
+        page = pages[current_page]
+        elapsed_time = (time.time() - start_time) / len(page)
+        for image_path, predicted_class, image_name in page:
+            review_index.record(image_path, predicted_class, image_name,
+                                "Incorrect" if image_path in flagged else "Correct", elapsed_time)
+        flagged.clear()
+        current_page += 1
+        start_time = time.time()
+        load_next_page()
+
+# Flag or unflag one thumbnail of the page
+def toggle_flag(cell):
+    if current_page < len(pages) and cell < len(pages[current_page]):
+        image_path = pages[current_page][cell][0]
+        if image_path in flagged:
+            flagged.remove(image_path)
+        else:
+            flagged.add(image_path)
+        grid_cells[cell].config(bg="red" if image_path in flagged else root.cget("bg"))
+
+# Show the next page of thumbnails
+def load_next_page():
+    if current_page < len(pages):
+        page = pages[current_page]
+        for cell, label in enumerate(grid_cells):
+            if cell < len(page):
+                img = ImageTk.PhotoImage(prefetcher.get(page[cell][0]))
+                label.config(image=img, bg=root.cget("bg"))
+                label.image = img
+            else:
+                label.config(image='', bg=root.cget("bg"))
+                label.image = None
+        class_label.config(text=f"Predicted: {page[0][1]} ({len(page)} images, click the wrong ones)")
+        file_name_label.config(text=f"Page {current_page + 1} of {len(pages)}")
+        upcoming = pages[current_page + 1:current_page + 3]
+        prefetcher.prefetch([path for next_page in upcoming for path, _, _ in next_page])
+    else:
+        class_label.config(text="All images reviewed!")
+        file_name_label.config(text="")
+        for label in grid_cells:
+            label.config(image='')
+            label.image = None
+
 # Handle key press events
 def on_key_press(event):
     if event.keysym == "space":
         save_result(True)  # Space bar triggers "Correct" button
 
+# Commit the last verdicts (they are appended to the results CSV)
+def on_close():
+    review_index.close()
+    prefetcher.close()
+    root.destroy()
+
+# Also commit the buffered verdicts while the reviewer is idle, every FLUSH_SECONDS
+def periodic_flush():
+    review_index.flush()
+    root.after(FLUSH_SECONDS * 1000, periodic_flush)
+
 # Tkinter GUI setup
 root = tk.Tk()
 root.title("Image Verification Tool")
+root.protocol("WM_DELETE_WINDOW", on_close)
 
 # UI Elements
-image_label = tk.Label(root)
-image_label.pack()
+if GRID_MODE:
+    grid_frame = tk.Frame(root)
+    grid_frame.pack()
+    grid_cells = []
+    for cell in range(page_size):
+        # The border turns red for flagged images
+        label = tk.Label(grid_frame, bd=0, padx=3, pady=3)
+        label.grid(row=cell // GRID_COLUMNS, column=cell % GRID_COLUMNS)
+        label.bind("<Button-1>", lambda event, cell=cell: toggle_flag(cell))
+        grid_cells.append(label)
+else:
+    image_label = tk.Label(root)
+    image_label.pack()
 class_label = tk.Label(root, text="", font=("Arial", 14))
 class_label.pack()
 file_name_label = tk.Label(root, text="", font=("Arial", 12))
 file_name_label.pack()
 
-btn_correct = ttk.Button(root, text="Correct", command=lambda: save_result(True))
-btn_correct.pack(side=tk.LEFT, padx=10, pady=10)
+if GRID_MODE:
+    btn_accept = ttk.Button(root, text="Accept page", command=save_page)
+    btn_accept.pack(pady=10)
+else:
+    btn_correct = ttk.Button(root, text="Correct", command=lambda: save_result(True))
+    btn_correct.pack(side=tk.LEFT, padx=10, pady=10)
 
-btn_incorrect = ttk.Button(root, text="Incorrect", command=lambda: save_result(False))
-btn_incorrect.pack(side=tk.RIGHT, padx=10, pady=10)
+    btn_incorrect = ttk.Button(root, text="Incorrect", command=lambda: save_result(False))
+    btn_incorrect.pack(side=tk.RIGHT, padx=10, pady=10)
 
 # Start the app
 start_time = time.time()
-load_next_image()
+if GRID_MODE:
+    load_next_page()
+else:
+    load_next_image()
+root.after(FLUSH_SECONDS * 1000, periodic_flush)
 root.mainloop()
\ No newline at end of file
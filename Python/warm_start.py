@@ -0,0 +1,169 @@
+# warm-start cache for the TreeOfLifeClassifier
+# the first run saves the text embedding matrix as a plain .npy file and the label names as integer codes
+# plus one vocabulary per rank. Later runs memory-map the embeddings (no copy, and the pages are shared
+# between processes running at the same time, e.g. the sharded workers) and rebuild the label names and
+# the label table from the codes instead of parsing the large label JSON and looping over every label.
+# the model weights are still loaded by open_clip as before.
+
+import os
+import json
+import warnings
+import numpy as np
+import pandas as pd
+import torch
+from bioclip import TreeOfLifeClassifier, Rank
+
+WARM_START_VERSION = 1
+
+# Columns of the label codes: the seven taxon ranks, then the common name
+TAXON_COLUMNS = [rank.get_label() for rank in Rank]
+CODE_COLUMNS = TAXON_COLUMNS + ["common_name"]
+
+
+def save_warm_start(classifier, cache_dir):
+    """
+    Save the full label set of an initialized classifier as a warm-start cache.
+
+    Args:
+        classifier (TreeOfLifeClassifier): Classifier with its full label set loaded
+        cache_dir (str): Cache folder
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+
+    vocabularies = [{} for _ in CODE_COLUMNS]
+    codes = np.empty((len(classifier.txt_names), len(CODE_COLUMNS)), dtype=np.int32)
+    for i, (taxon, common_name) in enumerate(classifier.txt_names):
+        for j, value in enumerate(list(taxon) + [common_name]):
+            codes[i, j] = vocabularies[j].setdefault(value, len(vocabularies[j]))
+
+    # Write the metadata last, a cache without it is rebuilt
+    np.save(os.path.join(cache_dir, "txt_embeddings.npy"), classifier.txt_embeddings.cpu().numpy())
+    np.save(os.path.join(cache_dir, "label_codes.npy"), codes)
+    labels = {
+        "version": WARM_START_VERSION,
+        "model": classifier.model_str,
+        "vocabularies": {column: list(vocabulary) for column, vocabulary in zip(CODE_COLUMNS, vocabularies)},
+    }
+    with open(os.path.join(cache_dir, "labels.json"), 'w', encoding="utf-8") as f:
+        json.dump(labels, f)
+    print(f"Saved warm-start cache with {len(codes)} labels to {cache_dir}")
+
+
+class WarmStartClassifier(TreeOfLifeClassifier):
+    """
+    TreeOfLifeClassifier that loads its labels from a warm-start cache.
+
+    If the cache folder is empty or was built for another model, the labels
+    are loaded as usual and the cache is written for the next run.
+    """
+
+    def __init__(self, warm_start_dir, **kwargs):
+        """
+        Args:
+            warm_start_dir (str): Warm-start cache folder
+            **kwargs: Passed to TreeOfLifeClassifier, e.g. device
+        """
+        self.warm_start_dir = warm_start_dir
+        self._labels = None
+        self._label_codes = None
+        # TreeOfLifeClassifier.__init__ calls get_txt_emb() and get_txt_names() below
+        super().__init__(**kwargs)
+        if self._labels is None:
+            save_warm_start(self, warm_start_dir)
+
+    def _load_labels(self):
+        labels_path = os.path.join(self.warm_start_dir, "labels.json")
+        if not os.path.exists(labels_path):
+            return False
+        with open(labels_path, encoding="utf-8") as f:
+            labels = json.load(f)
+        if labels["version"] != WARM_START_VERSION or labels["model"] != self.model_str:
+            print(f"Warm-start cache {self.warm_start_dir} was built for another model, rebuilding it")
+            return False
+        self._labels = labels
+        self._label_codes = np.load(os.path.join(self.warm_start_dir, "label_codes.npy"), mmap_mode='r')
+        return True
+
+    def get_txt_emb(self):
+        if self._labels is None and not self._load_labels():
+            return super().get_txt_emb()
+        txt_emb = np.load(os.path.join(self.warm_start_dir, "txt_embeddings.npy"), mmap_mode='r')
+        with warnings.catch_warnings():
+            # The memory map is read-only, nothing writes into the label matrix
+            warnings.simplefilter("ignore", UserWarning)
+            return torch.from_numpy(txt_emb)
+
+    def _column_values(self, column):
+        vocabulary = np.array(self._labels["vocabularies"][column], dtype=object)
+        return vocabulary[self._label_codes[:, CODE_COLUMNS.index(column)]]
+
+    def get_txt_names(self):
+        if self._labels is None:
+            return super().get_txt_names()
+        # The name strings are shared between labels instead of one copy per label
+        taxa = np.stack([self._column_values(column) for column in TAXON_COLUMNS], axis=1).tolist()
+        common_names = self._column_values("common_name").tolist()
+        return [[taxon, common_name] for taxon, common_name in zip(taxa, common_names)]
+
+    def get_label_data(self):
+        """
+        Same table as TreeOfLifeClassifier.get_label_data(), built column by column from the label codes.
+        """
+        if self._labels is None:
+            return super().get_label_data()
+        columns = {column: self._column_values(column) for column in TAXON_COLUMNS}
+        label_data = pd.DataFrame({
+            "kingdom": columns["kingdom"],
+            "phylum": columns["phylum"],
+            "class": columns["class"],
+            "order": columns["order"],
+            "family": columns["family"],
+            "genus": columns["genus"],
+            "species_epithet": columns["species"],
+            "species": pd.Series(columns["genus"]) + " " + pd.Series(columns["species"]),
+            "common_name": self._column_values("common_name"),
+        })
+        return label_data
+
+    def known_taxa(self, rank):
+        """
+        Set of all taxon names at a rank, read from the vocabulary without building the label table.
+        """
+        if self._labels is None:
+            return {name_ary[0][rank.value] for name_ary in self.txt_names}
+        return set(self._labels["vocabularies"][rank.get_label()])
+
+
+def load_classifier(warm_start_dir=None, label_bundle_path=None, **kwargs):
+    """
+    Create the TreeOfLifeClassifier, with a warm-start cache if warm_start_dir is set.
+
+    Args:
+        warm_start_dir (str, optional): Warm-start cache folder, None loads the labels as usual
+        label_bundle_path (str, optional): Saved label bundle, if it exists its labels are loaded
+                                           instead of the full label set (see label_bundle.py)
+        **kwargs: Passed to TreeOfLifeClassifier, e.g. device
+
+    Returns:
+        TreeOfLifeClassifier: Initialized classifier
+    """
+    if label_bundle_path:
+        from label_bundle import load_bundle_classifier
+        classifier = load_bundle_classifier(label_bundle_path, **kwargs)
+        if classifier is not None:
+            return classifier
+    if warm_start_dir:
+        return WarmStartClassifier(warm_start_dir, **kwargs)
+    return TreeOfLifeClassifier(**kwargs)
+
+
+def known_families(classifier):
+    """
+    Set of all family names known to the classifier.
+
+    Uses the warm-start vocabulary (or the families stored in a label bundle) if available
+    instead of building the whole label table.
+    """
+    if hasattr(classifier, "known_taxa"):
+        return classifier.known_taxa(Rank.FAMILY)
+    return set(classifier.get_label_data()[Rank.FAMILY.get_label()])
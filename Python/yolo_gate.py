@@ -0,0 +1,57 @@
+# YOLO gating for the BioClip classification
+# the YOLO classification results already answer the question for part of the crops, e.g. background
+# crops classified as none_bg with high confidence. Those crops skip BioClip and get a skip reason in the
+# results instead, so the model only runs where its answer can change the result.
+
+import numpy as np
+import pandas as pd
+
+SKIP_REASON_COLUMN = 'Skip_Reason_BioClip'
+SKIPPED_CATEGORY = 'skipped_yolo'
+
+
+def gate_images(yolo_table, img_names, skip_prefixes=("none_",), skip_min_prob=0.9, classify_below=None):
+    """
+    Decide which crops need BioClip from their YOLO top1 result.
+
+    Crops without a YOLO result are always classified.
+
+    Args:
+        yolo_table (pd.DataFrame): YOLO results indexed by img_name, see yolo_join.load_yolo_table()
+        img_names (list): Image file names
+        skip_prefixes (list): YOLO classes starting with one of these prefixes are
+                              skipped if their top1_prob is at least skip_min_prob
+        skip_min_prob (float): Confidence needed to skip a crop of a skipped class
+        classify_below (float, optional): Only classify crops whose YOLO top1_prob is
+                                          below this value (None classifies every
+                                          crop that is not skipped by class)
+
+    Returns:
+        list: Skip reason per image, '' for the crops that need BioClip,
+              e.g. 'yolo_none_bg' or 'yolo_confident'
+    """
+    top1 = yolo_table['top1'].reindex(img_names).astype(object)
+    prob = pd.to_numeric(yolo_table['top1_prob'].reindex(img_names), errors='coerce')
+    has_result = (top1.notna() & prob.notna()).to_numpy()
+    top1_names = top1.where(top1.notna(), '').astype(str)
+
+    reasons = np.full(len(img_names), '', dtype=object)
+    if classify_below is not None:
+        confident = has_result & (prob >= classify_below).to_numpy()
+        reasons[confident] = 'yolo_confident'
+    if skip_prefixes:
+        background = (has_result & top1_names.str.startswith(tuple(skip_prefixes)).to_numpy()
+                      & (prob >= skip_min_prob).to_numpy())
+        # The class reason is more specific than 'yolo_confident'
+        reasons[background] = ('yolo_' + top1_names[background]).to_numpy()
+    return reasons.tolist()
+
+
+def summarize_skips(reasons):
+    """
+    Print how many crops skip BioClip and why.
+    """
+    counts = pd.Series([reason for reason in reasons if reason], dtype=object).value_counts()
+    print(f"YOLO gating: {len(reasons) - counts.sum()} of {len(reasons)} images need BioClip")
+    for reason, count in counts.items():
+        print(f"- {reason}: {count} skipped")
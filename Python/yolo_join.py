@@ -0,0 +1,86 @@
+# columnar join of YOLO classification results with BioClip outputs
+# the YOLO results are kept as one pandas table indexed by img_name instead of one dict per image,
+# and the BioClip results of a batch are joined to it with a single reindex
+
+import os
+import pandas as pd
+
+# YOLO columns copied into the BioClip results
+YOLO_COLUMNS = ['top1', 'top1_prob']
+
+
+def _read_yolo_csvs(yolo_results_paths, columns):
+    frames = []
+    for yolo_results_path in yolo_results_paths:
+        if not os.path.exists(yolo_results_path):
+            print(f"YOLO results file not found: {yolo_results_path}")
+            continue
+        try:
+            frames.append(pd.read_csv(yolo_results_path, usecols=['img_name'] + list(columns)))
+        except Exception as e:
+            print(f"Error loading YOLO results: {e}")
+    if not frames:
+        return pd.DataFrame(columns=list(columns), index=pd.Index([], name='img_name'))
+
+    table = pd.concat(frames, ignore_index=True)
+    # If an image occurs in several files, the last file wins
+    table = table.drop_duplicates('img_name', keep='last')
+    return table.set_index('img_name')
+
+
+def load_yolo_table(yolo_results, columns=YOLO_COLUMNS):
+    """
+    Load YOLO classification results into one columnar table indexed by img_name.
+
+    Args:
+        yolo_results (str, list or dict): One classification_results.csv path,
+            a list of paths (e.g. several cameras of one run, stacked), or a dict
+            run name -> path or list of paths for several YOLO runs. The columns
+            of the first run keep their names, the columns of the other runs get
+            the run name as suffix (e.g. top1_run2).
+        columns (list): YOLO columns to keep
+
+    Returns:
+        pd.DataFrame: YOLO columns indexed by img_name
+    """
+    if isinstance(yolo_results, str):
+        yolo_results = [yolo_results]
+    if not isinstance(yolo_results, dict):
+        yolo_results = {None: yolo_results}
+
+    table = None
+    for run_idx, (run_name, paths) in enumerate(yolo_results.items()):
+        if isinstance(paths, str):
+            paths = [paths]
+        run_table = _read_yolo_csvs(paths, columns)
+        if run_idx == 0:
+            table = run_table
+        else:
+            table = table.join(run_table.add_suffix(f"_{run_name}"), how='outer')
+
+    print(f"Loaded YOLO classification results: {len(table)} entries")
+    return table
+
+
+def join_yolo(yolo_table, img_names, bioclip_columns, fill_missing=''):
+    """
+    Join the BioClip results of a batch with the YOLO table.
+
+    Args:
+        yolo_table (pd.DataFrame): Table from load_yolo_table()
+        img_names (list): Image file names of the batch
+        bioclip_columns (dict): Column name -> list of values, one per image
+        fill_missing: Value used where an image has no YOLO result, None keeps NaN
+
+    Returns:
+        pd.DataFrame: img_name, the YOLO columns and the BioClip columns, one row per image
+    """
+    yolo_part = yolo_table.reindex(img_names)
+    if fill_missing is not None:
+        # Keep missing YOLO values empty in the CSV, like the per-image lookup did
+        yolo_part = yolo_part.astype(object).where(yolo_part.notna(), fill_missing)
+    joined = yolo_part.reset_index(drop=True)
+    joined.insert(0, 'img_name', list(img_names))
+    for column, values in bioclip_columns.items():
+        joined[column] = values
+    return joined